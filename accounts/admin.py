@@ -1,6 +1,37 @@
 from django.contrib import admin
-from .models import JuryMember, ScoreCriterion, Score
+from debattle.models import Match
+from .models import JuryMember, ScoreCriterion, Score, ScoreOp, MatchResultTotal
+from .services import rebuild_match_totals
 
 admin.site.register(JuryMember)
 admin.site.register(ScoreCriterion)
-admin.site.register(Score)
\ No newline at end of file
+admin.site.register(MatchResultTotal)
+admin.site.register(ScoreOp)
+
+
+@admin.register(Score)
+class ScoreAdmin(admin.ModelAdmin):
+    # Правки оценок в админке идут мимо upsert_scores — суммы матча пересчитываем из Score
+    list_display = ("match", "jury", "team", "criterion", "value")
+    list_filter = ("match__tour__event",)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        match_ids = {obj.match_id}
+        # Оценку перенесли в другой матч — прежний тоже пересчитываем
+        if change and "match" in form.changed_data:
+            match_ids.add(form.initial["match"])
+        self._rebuild(match_ids)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        self._rebuild({obj.match_id})
+
+    def delete_queryset(self, request, queryset):
+        match_ids = set(queryset.values_list("match_id", flat=True))
+        super().delete_queryset(request, queryset)
+        self._rebuild(match_ids)
+
+    def _rebuild(self, match_ids: set) -> None:
+        for match in Match.objects.filter(pk__in=match_ids):
+            rebuild_match_totals(match)
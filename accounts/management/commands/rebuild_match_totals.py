@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from debattle.models import DebattleEvent, Match
+from accounts.services import rebuild_match_totals
+
+
+class Command(BaseCommand):
+    help = "Пересчитать суммы оценок (MatchResultTotal) и счётчики карточек жюри из Score для матчей мероприятия"
+
+    def add_arguments(self, parser):
+        parser.add_argument("slug", help="slug мероприятия")
+
+    def handle(self, *args, slug, **options):
+        event = DebattleEvent.objects.filter(slug=slug).first()
+        if event is None:
+            raise CommandError(f"Мероприятие {slug} не найдено")
+
+        matches = Match.objects.filter(tour__event=event)
+        for match in matches.iterator():
+            rebuild_match_totals(match)
+
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано матчей: {matches.count()}"))
@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
 from debattle.models import DebattleEvent, Team, Round
 from django.utils import timezone
@@ -37,6 +38,9 @@ class Score(models.Model):
     team = models.ForeignKey(Team, on_delete=models.CASCADE)
     criterion = models.ForeignKey(ScoreCriterion, on_delete=models.CASCADE)
     value = models.PositiveSmallIntegerField()  # 1..3
+    # Номер операции судьи, записавшей значение (0 — запись с формы, без синхронизации).
+    # Операция с номером не больше текущего устарела и значение не перезаписывает
+    seq = models.PositiveIntegerField(default=0)
 
     class Meta:
         unique_together = ("match", "jury", "team", "criterion")
@@ -44,16 +48,77 @@ class Score(models.Model):
         verbose_name_plural = "Оценки"
 
 
+class ScoreOp(models.Model):
+    # Уже обработанные операции синхронизации оценок: повтор той же операции
+    # (клиент не дождался ответа и отправил пачку снова) получает тот же ответ
+    class Status(models.TextChoices):
+        APPLIED = "applied", "Применена"
+        STALE = "stale", "Устарела"
+
+    jury = models.ForeignKey(JuryMember, on_delete=models.CASCADE, related_name="score_ops")
+    op_id = models.CharField(max_length=64)
+    seq = models.PositiveIntegerField()
+    status = models.CharField(max_length=16, choices=Status.choices)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("jury", "op_id")
+        verbose_name = "Операция синхронизации оценок"
+        verbose_name_plural = "Операции синхронизации оценок"
+
+
 class JuryMatchSubmission(models.Model):
     match = models.ForeignKey(Match, on_delete=models.CASCADE, related_name="jury_submissions")
     jury = models.ForeignKey(JuryMember, on_delete=models.CASCADE, related_name="match_submissions")
     is_submitted = models.BooleanField(default=False)
     submitted_at = models.DateTimeField(null=True, blank=True)
+    # Сколько ячеек карточки (команда × критерий) судья уже заполнил — ведётся в upsert_scores
+    scores_count = models.PositiveSmallIntegerField(default=0)
 
     class Meta:
         unique_together = ("match", "jury")
 
     def submit(self):
+        now = timezone.now()
+        with transaction.atomic():
+            # Условный апдейт: повторная отправка не должна второй раз попасть в суммы
+            flipped = JuryMatchSubmission.objects.filter(pk=self.pk, is_submitted=False).update(
+                is_submitted=True, submitted_at=now
+            )
+            if flipped:
+                MatchResultTotal.add_jury_scores(self.match_id, self.jury_id)
+
+        if flipped:
+            self.submitted_at = now
         self.is_submitted = True
-        self.submitted_at = timezone.now()
-        self.save(update_fields=["is_submitted", "submitted_at"])
\ No newline at end of file
+
+
+class MatchResultTotal(models.Model):
+    # Суммы оценок по (матч, команда, критерий) только по судьям, отправившим итог.
+    # Ведутся инкрементально при отправке итога и изменении оценок отправивших судей.
+    match = models.ForeignKey(Match, on_delete=models.CASCADE, related_name="result_totals")
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name="+")
+    criterion = models.ForeignKey(ScoreCriterion, on_delete=models.CASCADE, related_name="+")
+    total = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("match", "team", "criterion")
+        verbose_name = "Сумма оценок"
+        verbose_name_plural = "Суммы оценок"
+
+    @classmethod
+    def add(cls, match_id: int, team_id: int, criterion_id: int, delta: int) -> None:
+        if not delta:
+            return
+        cls.objects.get_or_create(match_id=match_id, team_id=team_id, criterion_id=criterion_id)
+        cls.objects.filter(match_id=match_id, team_id=team_id, criterion_id=criterion_id).update(
+            total=F("total") + delta
+        )
+
+    @classmethod
+    def add_jury_scores(cls, match_id: int, jury_id: int) -> None:
+        scores = Score.objects.filter(match_id=match_id, jury_id=jury_id).values_list(
+            "team_id", "criterion_id", "value"
+        )
+        for team_id, criterion_id, value in scores:
+            cls.add(match_id, team_id, criterion_id, value)
\ No newline at end of file
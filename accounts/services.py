@@ -1,30 +1,208 @@
 from collections import defaultdict
 from decimal import Decimal
 
-from debattle.models import Match
-from .models import Score, JuryMatchSubmission
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+
+from debattle import event_log
+from debattle.models import DebattleEvent, Match
+from debattle.realtime import commit_state_change, publish_jury_progress, results_payload
+from debattle.standings import SCREEN_STANDINGS, resolve_match, standings_payload
+from .models import JuryMember, Score, ScoreOp, JuryMatchSubmission, MatchResultTotal
 
 
 def compute_match_results(match: Match) -> dict:
-    submitted_jury_ids = list(
-        JuryMatchSubmission.objects.filter(match=match, is_submitted=True)
-        .values_list("jury_id", flat=True)
-    )
+    # Читаем готовые суммы из MatchResultTotal вместо перебора всех Score
+    submitted_jury_count = JuryMatchSubmission.objects.filter(match=match, is_submitted=True).count()
 
-    if not submitted_jury_ids:
+    if not submitted_jury_count:
         return {"team_totals": {}, "team_by_criterion": {}, "submitted_jury_count": 0}
 
-    qs = Score.objects.filter(match=match, jury_id__in=submitted_jury_ids).select_related("team", "criterion")
-
     team_totals = defaultdict(Decimal)
-    team_by_criterion = defaultdict(lambda: defaultdict(Decimal))
+    team_by_criterion = defaultdict(dict)
 
-    for s in qs:
-        team_totals[s.team_id] += Decimal(s.value)
-        team_by_criterion[s.team_id][s.criterion_id] += Decimal(s.value)
+    rows = MatchResultTotal.objects.filter(match=match).values_list("team_id", "criterion_id", "total")
+    for team_id, criterion_id, total in rows:
+        team_totals[team_id] += Decimal(total)
+        team_by_criterion[team_id][criterion_id] = Decimal(total)
 
     return {
         "team_totals": dict(team_totals),
-        "team_by_criterion": {k: dict(v) for k, v in team_by_criterion.items()},
-        "submitted_jury_count": len(submitted_jury_ids),
-    }
\ No newline at end of file
+        "team_by_criterion": dict(team_by_criterion),
+        "submitted_jury_count": submitted_jury_count,
+    }
+
+
+@transaction.atomic
+def rebuild_match_totals(match: Match) -> None:
+    # Полный пересчёт сумм и счётчиков из Score (для уже существующих данных и ручной сверки)
+    submitted_jury_ids = JuryMatchSubmission.objects.filter(match=match, is_submitted=True).values("jury_id")
+    totals = (
+        Score.objects.filter(match=match, jury_id__in=submitted_jury_ids)
+        .values("team_id", "criterion_id")
+        .annotate(total=Sum("value"))
+    )
+
+    MatchResultTotal.objects.filter(match=match).delete()
+    MatchResultTotal.objects.bulk_create([
+        MatchResultTotal(match=match, team_id=row["team_id"], criterion_id=row["criterion_id"], total=row["total"])
+        for row in totals
+    ])
+
+    # Счётчики заполненных ячеек по судьям
+    counts = dict(Score.objects.filter(match=match).values("jury_id").annotate(n=Count("id")).values_list("jury_id", "n"))
+    submissions = list(JuryMatchSubmission.objects.filter(match=match))
+    for submission in submissions:
+        submission.scores_count = counts.get(submission.jury_id, 0)
+    JuryMatchSubmission.objects.bulk_update(submissions, ["scores_count"])
+
+
+# Допустимые значения оценки (шкала 1–3)
+SCORE_VALUES = (1, 2, 3)
+
+
+@transaction.atomic
+def upsert_scores(
+    match: Match, jury: JuryMember, cells: list[tuple[int, int, int]], seqs: dict | None = None
+) -> None:
+    # cells: [(team_id, criterion_id, value), ...]; одинаковые ячейки — побеждает последняя.
+    # seqs: {(team_id, criterion_id): номер операции} — пишется в Score.seq при синхронизации
+    latest = {(team_id, criterion_id): value for team_id, criterion_id, value in cells}
+    if not latest:
+        return
+
+    # Текущая карточка судьи: нужна и для счётчика заполненных ячеек,
+    # и (если итог уже отправлен) для разницы в суммах
+    submitted = JuryMatchSubmission.objects.filter(match=match, jury=jury, is_submitted=True).exists()
+    old_values = {
+        (team_id, criterion_id): value
+        for team_id, criterion_id, value in Score.objects.select_for_update()
+        .filter(match=match, jury=jury)
+        .values_list("team_id", "criterion_id", "value")
+    }
+
+    # Один INSERT ... ON CONFLICT DO UPDATE на всю карточку
+    Score.objects.bulk_create(
+        [
+            Score(
+                match=match, jury=jury, team_id=team_id, criterion_id=criterion_id, value=value,
+                seq=(seqs or {}).get((team_id, criterion_id), 0),
+            )
+            for (team_id, criterion_id), value in latest.items()
+        ],
+        update_conflicts=True,
+        unique_fields=["match", "jury", "team", "criterion"],
+        update_fields=["value", "seq"] if seqs else ["value"],
+    )
+
+    if submitted:
+        for (team_id, criterion_id), value in latest.items():
+            MatchResultTotal.add(match.id, team_id, criterion_id, value - old_values.get((team_id, criterion_id), 0))
+
+    event_log.append(jury.event_id, "scores", {
+        "match_id": match.id,
+        "jury_id": jury.id,
+        "cells": {f"{team_id}:{criterion_id}": value for (team_id, criterion_id), value in latest.items()},
+    })
+
+    # Абсолютное значение, а не инкремент: счётчик сам выравнивается при повторных записях
+    scores_count = len(old_values.keys() | latest.keys())
+    if scores_count != len(old_values):
+        updated = JuryMatchSubmission.objects.filter(match=match, jury=jury).update(scores_count=scores_count)
+        if not updated:
+            JuryMatchSubmission.objects.create(match=match, jury=jury, scores_count=scores_count)
+        publish_jury_progress(jury.event_id, match.id, jury.id, scores_count, submitted)
+
+
+@transaction.atomic
+def save_jury_scores(match: Match, jury: JuryMember, cells: list[tuple[int, int, int]]) -> None:
+    # Запись оценок судьёй (форма и JSON-карточка). Итог проверяется под блокировкой строки
+    # отправки, как в sync_scores: отправка, закоммиченная после проверки в обработчике,
+    # не пропустит запись в уже отправленную карточку
+    submission, _ = JuryMatchSubmission.objects.select_for_update().get_or_create(match=match, jury=jury)
+    if submission.is_submitted:
+        raise ValueError("Итог уже отправлен. Изменения запрещены.")
+    upsert_scores(match, jury, cells)
+
+
+def jury_last_seq(jury: JuryMember) -> int:
+    # Последний номер операции судьи: планшет продолжает нумерацию с него,
+    # даже если локальное хранилище очищено или судья перешёл на другое устройство
+    return ScoreOp.objects.filter(jury=jury).aggregate(seq=Max("seq"))["seq"] or 0
+
+
+async def ajury_last_seq(jury: JuryMember) -> int:
+    return (await ScoreOp.objects.filter(jury=jury).aaggregate(seq=Max("seq")))["seq"] or 0
+
+
+@transaction.atomic
+def sync_scores(match: Match, jury: JuryMember, ops: list[tuple[str, int, int, int, int]]) -> dict:
+    # ops: [(op_id, seq, team_id, criterion_id, value), ...] — уже проверенные операции планшета.
+    # Возвращает {op_id: статус}. Повтор обработанной операции получает прежний статус и
+    # ничего не пишет; операция с номером не больше записанного в ячейке — устаревшая.
+    # Строка отправки блокируется: синхронизации судьи по матчу и его итог идут по очереди
+    submission, _ = JuryMatchSubmission.objects.select_for_update().get_or_create(match=match, jury=jury)
+    if submission.is_submitted:
+        raise ValueError("Итог уже отправлен. Изменения запрещены.")
+
+    acks = dict(
+        ScoreOp.objects.filter(jury=jury, op_id__in=[op[0] for op in ops]).values_list("op_id", "status")
+    )
+    cell_seqs = {
+        (team_id, criterion_id): seq
+        for team_id, criterion_id, seq in Score.objects.filter(match=match, jury=jury)
+        .values_list("team_id", "criterion_id", "seq")
+    }
+
+    latest = {}
+    new_ops = []
+    for op_id, seq, team_id, criterion_id, value in sorted(ops, key=lambda op: op[1]):
+        if op_id in acks:
+            continue
+        key = (team_id, criterion_id)
+        if seq > cell_seqs.get(key, 0):
+            cell_seqs[key] = seq
+            latest[key] = value
+            status = ScoreOp.Status.APPLIED
+        else:
+            status = ScoreOp.Status.STALE
+        acks[op_id] = status
+        new_ops.append(ScoreOp(jury=jury, op_id=op_id, seq=seq, status=status))
+
+    ScoreOp.objects.bulk_create(new_ops)
+    upsert_scores(
+        match, jury,
+        [(team_id, criterion_id, value) for (team_id, criterion_id), value in latest.items()],
+        seqs={key: cell_seqs[key] for key in latest},
+    )
+    return {op_id: str(status) for op_id, status in acks.items()}
+
+
+def jury_score_map(match: Match, jury: JuryMember) -> dict:
+    # "team_id:criterion_id" -> value, тот же формат, что и в шаблоне жюри
+    scores = Score.objects.filter(jury=jury, match=match).values_list("team_id", "criterion_id", "value")
+    return {f"{team_id}:{criterion_id}": int(value) for team_id, criterion_id, value in scores}
+
+
+async def ajury_score_map(match: Match, jury: JuryMember) -> dict:
+    scores = Score.objects.filter(jury=jury, match=match).values_list("team_id", "criterion_id", "value")
+    return {f"{team_id}:{criterion_id}": int(value) async for team_id, criterion_id, value in scores}
+
+
+@transaction.atomic
+def submit_jury_match(event: DebattleEvent, submission: JuryMatchSubmission) -> None:
+    # Итог жюри меняет результаты на экране — двигаем версию и рассылаем дельту
+    submission.submit()
+    publish_jury_progress(event.id, submission.match_id, submission.jury_id, submission.scores_count, True)
+
+    match = submission.match
+    delta = {}
+    results = None
+    if event.state == DebattleEvent.State.RESULTS and event.current_match_id == match.id:
+        results = compute_match_results(match)
+        delta["results"] = results_payload(results)
+    # Итог пришёл после закрытия последнего раунда — переподводим матч и таблицу
+    if match.team_a_total is not None:
+        resolve_match(event, match, results or compute_match_results(match))
+        delta["standings"] = standings_payload(event.id, SCREEN_STANDINGS)
+    commit_state_change(event, "jury_submit", delta, log={"match_id": submission.match_id, "jury_id": submission.jury_id})
@@ -1,3 +1,310 @@
-from django.test import TestCase
+import threading
+import time
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from debattle import game_flow
+from debattle.models import DebattleEvent, Team
+from debattle.realtime import control_group_name
+from debattle.tests import make_event
+
+from .models import JuryMember, JuryMatchSubmission, MatchResultTotal, Score, ScoreCriterion, ScoreOp
+from .services import compute_match_results, save_jury_scores, submit_jury_match, upsert_scores
+
+
+class JuryProgressTests(TestCase):
+    def setUp(self):
+        self.event = make_event("deb-progress", 1)
+        self.match = game_flow.start_roulette(self.event)
+        self.jury = JuryMember.objects.create(user=User.objects.create(username="jury-progress"), event=self.event)
+        self.criteria = list(self.event.criteria.order_by("id"))
+
+    def _submission(self) -> JuryMatchSubmission:
+        return JuryMatchSubmission.objects.get(match=self.match, jury=self.jury)
+
+    def test_counter_counts_each_cell_once(self):
+        team_id = self.match.team_a_id
+        upsert_scores(self.match, self.jury, [(team_id, c.id, 1) for c in self.criteria[:3]])
+        self.assertEqual(self._submission().scores_count, 3)
+
+        # Исправления уже заполненных ячеек счётчик не двигают, новые — двигают
+        upsert_scores(self.match, self.jury, [(team_id, c.id, 3) for c in self.criteria[:4]])
+        self.assertEqual(self._submission().scores_count, 4)
+
+    def test_progress_streamed_to_control_group(self):
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(control_group_name(self.event.id), channel)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            upsert_scores(self.match, self.jury, [(self.match.team_a_id, self.criteria[0].id, 2)])
+        payload = async_to_sync(layer.receive)(channel)["payload"]
+        self.assertEqual(payload, {
+            "kind": "jury_progress", "match_id": self.match.id, "jury_id": self.jury.id,
+            "scores": 1, "submitted": False,
+        })
+
+        event = DebattleEvent.objects.get(pk=self.event.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            submit_jury_match(event, self._submission())
+        payload = async_to_sync(layer.receive)(channel)["payload"]
+        self.assertEqual((payload["scores"], payload["submitted"]), (1, True))
+
+    def test_control_page_uses_real_criteria_count(self):
+        ScoreCriterion.objects.create(event=self.event, title="Шестой", max_value=3)
+        upsert_scores(self.match, self.jury, [(self.match.team_b_id, self.criteria[0].id, 2)])
+
+        staff = User.objects.create(username="operator", is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse("debattle_control", kwargs={"slug": self.event.slug}))
+
+        self.assertEqual(response.context["expected_per_jury"], 12)
+        self.assertEqual(response.context["expected_scores"], 12)
+        self.assertEqual(response.context["scores_count"], 1)
+        self.assertEqual(response.context["jury_progress"][0]["scores"], 1)
+
+
+class JuryScorecardTests(TestCase):
+    def setUp(self):
+        self.event = make_event("deb-scorecard", 1)
+        self.match = game_flow.start_roulette(self.event)
+        user = User.objects.create(username="jury-scorecard")
+        self.jury = JuryMember.objects.create(user=user, event=self.event)
+        self.criteria = list(self.event.criteria.order_by("id"))
+        self.client.force_login(user)
+        self.url = reverse("debattle_jury_scorecard", kwargs={"slug": self.event.slug})
+
+    def _post(self, *cells):
+        scores = [
+            {"team_id": team_id, "criterion_id": criterion_id, "value": value}
+            for team_id, criterion_id, value in cells
+        ]
+        return self.client.post(self.url, {"scores": scores}, content_type="application/json")
+
+    def test_invalid_cells_rejected(self):
+        other_team = Team.objects.filter(event=self.event).exclude(
+            pk__in=[self.match.team_a_id, self.match.team_b_id]
+        ).first()
+        cases = [
+            (other_team.id, self.criteria[0].id, 2),
+            (self.match.team_a_id, 999_999, 2),
+            (self.match.team_a_id, self.criteria[0].id, 4),
+            (self.match.team_a_id, self.criteria[0].id, 0),
+        ]
+        for cell in cases:
+            with self.subTest(cell=cell):
+                # Некорректная ячейка отклоняет всю карточку, в том числе верные ячейки рядом
+                response = self._post((self.match.team_b_id, self.criteria[1].id, 3), cell)
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.post(self.url, {"scores": [5]}, content_type="application/json").status_code, 400)
+        self.assertFalse(Score.objects.filter(match=self.match).exists())
+
+    def test_refused_after_submit(self):
+        self._post((self.match.team_a_id, self.criteria[0].id, 2))
+        JuryMatchSubmission.objects.get(match=self.match, jury=self.jury).submit()
+
+        response = self._post((self.match.team_a_id, self.criteria[0].id, 3))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Score.objects.get(match=self.match, jury=self.jury).value, 2)
+        self.assertTrue(self.client.get(self.url).json()["submitted"])
+
+    def test_batch_written_with_one_upsert(self):
+        teams = (self.match.team_a_id, self.match.team_b_id)
+        cells = [(team_id, c.id, 2) for team_id in teams for c in self.criteria[:3]]
+        self._post(*cells[:2])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self._post(*[(team_id, criterion_id, 3) for team_id, criterion_id, _ in cells])
+
+        self.assertEqual(response.status_code, 200)
+        writes = [q["sql"] for q in queries.captured_queries if 'INTO "accounts_score"' in q["sql"]]
+        self.assertEqual(len(writes), 1)
+        self.assertIn("ON CONFLICT", writes[0])
+        self.assertEqual(len(response.json()["scores"]), 6)
+        self.assertEqual(set(Score.objects.filter(match=self.match).values_list("value", flat=True)), {3})
+        self.assertEqual(JuryMatchSubmission.objects.get(match=self.match, jury=self.jury).scores_count, 6)
+
+
+class JurySyncTests(TestCase):
+    def setUp(self):
+        self.event = make_event("deb-sync", 1)
+        self.match = game_flow.start_roulette(self.event)
+        user = User.objects.create(username="jury-sync")
+        self.jury = JuryMember.objects.create(user=user, event=self.event)
+        self.criteria = list(self.event.criteria.order_by("id"))
+        self.client.force_login(user)
+        self.url = reverse("debattle_jury_sync", kwargs={"slug": self.event.slug})
+
+    def _op(self, op_id: str, seq: int, value: int, criterion: int = 0) -> dict:
+        return {
+            "op_id": op_id, "seq": seq, "team_id": self.match.team_a_id,
+            "criterion_id": self.criteria[criterion].id, "value": value,
+        }
+
+    def _sync(self, *ops):
+        return self.client.post(
+            self.url, {"match_id": self.match.id, "ops": list(ops)}, content_type="application/json"
+        )
+
+    def _value(self, criterion: int = 0) -> int:
+        return Score.objects.get(
+            match=self.match, jury=self.jury, team_id=self.match.team_a_id, criterion=self.criteria[criterion]
+        ).value
+
+    def test_retry_does_not_apply_twice(self):
+        response = self._sync(self._op("a", 1, 2), self._op("b", 2, 3, criterion=1))
+        self.assertEqual(response.json()["acks"], {"a": "applied", "b": "applied"})
+        self.assertEqual(response.json()["seq"], 2)
+
+        # Значение ячейки поменяли с другого запроса, затем планшет повторил старую пачку
+        self._sync(self._op("c", 3, 1))
+        response = self._sync(self._op("a", 1, 2), self._op("b", 2, 3, criterion=1))
+        self.assertEqual(response.json()["acks"], {"a": "applied", "b": "applied"})
+        self.assertEqual(self._value(), 1)
+        self.assertEqual(ScoreOp.objects.filter(jury=self.jury).count(), 3)
+        self.assertEqual(JuryMatchSubmission.objects.get(match=self.match, jury=self.jury).scores_count, 2)
+
+    def test_stale_write_does_not_overwrite_newer(self):
+        # Операции пришли не по порядку: более поздняя (seq 5) — раньше
+        self._sync(self._op("new", 5, 3))
+        response = self._sync(self._op("old", 4, 1))
+        self.assertEqual(response.json()["acks"], {"old": "stale"})
+        self.assertEqual(self._value(), 3)
+
+        # Внутри одной пачки тоже побеждает больший seq, а не позиция в списке
+        response = self._sync(self._op("x", 7, 2), self._op("y", 6, 1))
+        self.assertEqual(self._value(), 2)
+        self.assertEqual(response.json()["scores"][f"{self.match.team_a_id}:{self.criteria[0].id}"], 2)
+
+    def test_invalid_op_rejected_alone(self):
+        bad = dict(self._op("bad", 1, 3), value=7)
+        response = self._sync(bad, self._op("good", 2, 2))
+        self.assertEqual(response.json()["acks"], {"bad": "rejected", "good": "applied"})
+        self.assertEqual(self._value(), 2)
+
+        # Неразбираемая операция с читаемым op_id тоже отклоняется, без op_id — пропускается
+        response = self._sync(
+            dict(self._op("junk", 3, 1), value="x"),
+            {k: v for k, v in self._op("noseq", 4, 1).items() if k != "seq"},
+            "garbage",
+            self._op("next", 5, 1),
+        )
+        self.assertEqual(response.json()["acks"], {"junk": "rejected", "noseq": "rejected", "next": "applied"})
+        self.assertEqual(self._value(), 1)
+
+    def test_refused_after_submit(self):
+        self._sync(self._op("a", 1, 2))
+        JuryMatchSubmission.objects.get(match=self.match, jury=self.jury).submit()
+
+        response = self._sync(self._op("b", 2, 3))
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(response.json()["submitted"])
+        self.assertEqual(self._value(), 2)
+        self.assertFalse(ScoreOp.objects.filter(op_id="b").exists())
+
+    def test_jury_page_continues_server_seq(self):
+        self._sync(self._op("a", 41, 2))
+        response = self.client.get(reverse("debattle_jury", kwargs={"slug": self.event.slug}))
+        self.assertEqual(response.context["last_seq"], 41)
+
+
+class MatchResultTotalTests(TestCase):
+    def setUp(self):
+        self.event = make_event("deb-totals", 1)
+        self.match = game_flow.start_roulette(self.event)
+        self.jury = JuryMember.objects.create(user=User.objects.create(username="jury-totals"), event=self.event)
+        self.criteria = list(self.event.criteria.order_by("id"))
+        self.team_id = self.match.team_a_id
+        upsert_scores(self.match, self.jury, [(self.team_id, c.id, 2) for c in self.criteria[:2]])
+
+    def _totals(self) -> dict:
+        return dict(
+            MatchResultTotal.objects.filter(match=self.match, team_id=self.team_id)
+            .exclude(total=0)
+            .values_list("criterion_id", "total")
+        )
+
+    def _submit(self) -> None:
+        submission = JuryMatchSubmission.objects.get(match=self.match, jury=self.jury)
+        submit_jury_match(DebattleEvent.objects.get(pk=self.event.pk), submission)
+
+    def test_totals_flip_in_on_submit(self):
+        # До итога оценки судьи в суммы не входят, повторная отправка их не удваивает
+        self.assertEqual(self._totals(), {})
+        self._submit()
+        self._submit()
+        self.assertEqual(self._totals(), {self.criteria[0].id: 2, self.criteria[1].id: 2})
+        self.assertEqual(compute_match_results(self.match)["team_totals"][self.team_id], 4)
+
+    def test_edits_after_submit_update_totals(self):
+        self._submit()
+        upsert_scores(self.match, self.jury, [(self.team_id, self.criteria[0].id, 3)])
+        self.assertEqual(self._totals(), {self.criteria[0].id: 3, self.criteria[1].id: 2})
+
+        # Правка и удаление оценки в админке тоже попадают в суммы
+        self.client.force_login(User.objects.create(username="totals-admin", is_staff=True, is_superuser=True))
+        score = Score.objects.get(match=self.match, jury=self.jury, criterion=self.criteria[1])
+        response = self.client.post(reverse("admin:accounts_score_change", args=[score.pk]), {
+            "match": self.match.pk, "jury": self.jury.pk, "team": self.team_id,
+            "criterion": self.criteria[1].pk, "value": 1, "seq": 0,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self._totals(), {self.criteria[0].id: 3, self.criteria[1].id: 1})
+
+        self.client.post(reverse("admin:accounts_score_delete", args=[score.pk]), {"post": "yes"})
+        self.assertEqual(self._totals(), {self.criteria[0].id: 3})
+
+    def test_rebuild_command_restores_totals(self):
+        self._submit()
+        # Суммы и счётчик разошлись с Score (правка в обход сервисов)
+        MatchResultTotal.objects.filter(match=self.match).update(total=99)
+        JuryMatchSubmission.objects.filter(match=self.match, jury=self.jury).update(scores_count=0)
+
+        out = StringIO()
+        call_command("rebuild_match_totals", self.event.slug, stdout=out)
+
+        self.assertIn("Пересчитано матчей", out.getvalue())
+        self.assertEqual(self._totals(), {self.criteria[0].id: 2, self.criteria[1].id: 2})
+        self.assertEqual(JuryMatchSubmission.objects.get(match=self.match, jury=self.jury).scores_count, 2)
+
+
+class JuryScoreSubmitRaceTests(TransactionTestCase):
+    # Итог коммитится, пока запись оценки ждёт блокировку: запись должна его увидеть
+    def test_write_waiting_on_submit_is_refused(self):
+        event = make_event("deb-race", 1)
+        match = game_flow.start_roulette(event)
+        jury = JuryMember.objects.create(user=User.objects.create(username="jury-race"), event=event)
+        cell = (match.team_a_id, event.criteria.order_by("id").first().id)
+        upsert_scores(match, jury, [(*cell, 2)])
+        submission = JuryMatchSubmission.objects.get(match=match, jury=jury)
+        # Обработчик уже проверил карточку: итог ещё не отправлен
+        self.assertFalse(submission.is_submitted)
+
+        locked = threading.Event()
+
+        def submit():
+            try:
+                with transaction.atomic():
+                    JuryMatchSubmission.objects.get(pk=submission.pk).submit()
+                    locked.set()
+                    time.sleep(0.3)
+            finally:
+                connection.close()
+
+        submitter = threading.Thread(target=submit)
+        submitter.start()
+        locked.wait(5)
+        with self.assertRaisesMessage(ValueError, "Итог уже отправлен"):
+            save_jury_scores(match, jury, [(*cell, 3)])
+        submitter.join()
+
+        self.assertEqual(Score.objects.get(match=match, jury=jury).value, 2)
+        self.assertEqual(MatchResultTotal.objects.get(match=match, team_id=cell[0], criterion_id=cell[1]).total, 2)
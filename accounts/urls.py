@@ -3,4 +3,6 @@ from . import views
 
 urlpatterns = [
     path("debattle/<slug:slug>/jury/", views.jury_view, name="debattle_jury"),
+    path("debattle/<slug:slug>/jury/scorecard/", views.jury_scorecard_view, name="debattle_jury_scorecard"),
+    path("debattle/<slug:slug>/jury/sync/", views.jury_sync_view, name="debattle_jury_sync"),
 ]
\ No newline at end of file
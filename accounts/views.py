@@ -1,17 +1,75 @@
+import json
+
+from asgiref.sync import sync_to_async
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.shortcuts import get_object_or_404, redirect, render
+from django.http import JsonResponse
+from django.shortcuts import redirect, render
 from django.views.decorators.http import require_http_methods
 
-from debattle.models import DebattleEvent, Round
-from .models import JuryMember, Score, JuryMatchSubmission
+from debattle.event_context import aget_event_context, event_jury_member, get_event_context
+from debattle.models import Match, Round
+from debattle.realtime import timer_payload
+from .models import JuryMatchSubmission
+from .services import (
+    SCORE_VALUES, ajury_last_seq, ajury_score_map, jury_last_seq, jury_score_map, save_jury_scores, submit_jury_match,
+    sync_scores,
+)
+
+def _jury_post(request, slug: str, event, jury, match):
+    # Запись оценок и итога — в транзакциях сервисов, поэтому синхронно (в потоке)
+    submission, _ = JuryMatchSubmission.objects.get_or_create(match=match, jury=jury)
+    action = request.POST.get("action", "")
+
+    if submission.is_submitted:
+        messages.error(request, "Итог уже отправлен. Изменения запрещены.")
+        return redirect("debattle_jury", slug=slug)
+
+    if action == "set_score":
+        try:
+            team_id = int(request.POST["team_id"])
+            criterion_id = int(request.POST["criterion_id"])
+            value = int(request.POST["value"])
+        except Exception:
+            messages.error(request, "Некорректные данные.")
+            return redirect("debattle_jury", slug=slug)
+
+        if value not in SCORE_VALUES:
+            messages.error(request, "Оценка может быть только 1, 2 или 3.")
+            return redirect("debattle_jury", slug=slug)
+
+        # менять можно всегда (в любой момент матча), пока итог не отправлен
+        try:
+            save_jury_scores(match, jury, [(team_id, criterion_id, value)])
+        except ValueError as e:
+            messages.error(request, str(e))
+            return redirect("debattle_jury", slug=slug)
+        messages.success(request, "Оценка сохранена.")
+        return redirect("debattle_jury", slug=slug)
+
+    if action == "submit_final":
+        # ВАЖНО: submit запрещён до старта 3-го раунда
+        if event.current_round_number < 3:
+            messages.error(request, "Нельзя отправить итог до старта 3-го раунда.")
+            return redirect("debattle_jury", slug=slug)
+
+        submit_jury_match(event, submission)
+        messages.success(request, "Итог отправлен. Спасибо.")
+        return redirect("debattle_jury", slug=slug)
+
+    messages.error(request, "Неизвестное действие.")
+    return redirect("debattle_jury", slug=slug)
+
 
 @login_required
 @require_http_methods(["GET", "POST"])
-def jury_view(request, slug: str):
-    event = get_object_or_404(DebattleEvent, slug=slug)
+async def jury_view(request, slug: str):
+    # Страница планшета — async: контекст мероприятия из памяти процесса, остальное — async ORM.
+    # Шаблон рендерится без обращений к БД: всё, что он читает, уже загружено
+    context = await aget_event_context(slug)
+    event = context["event"]
 
-    jury = JuryMember.objects.filter(user=request.user, event=event, is_active=True).first()
+    jury = event_jury_member(context, await request.auser())
     if not jury:
         return render(request, "debattle/jury_denied.html", {"event": event}, status=403)
 
@@ -19,66 +77,14 @@ def jury_view(request, slug: str):
     if not match:
         return render(request, "debattle/jury.html", {"event": event, "jury": jury, "match": None})
 
-    submission, _ = JuryMatchSubmission.objects.get_or_create(match=match, jury=jury)
-    criteria = list(event.criteria.all().order_by("id"))
-
-    # ВАЖНО: submit запрещён до старта 3-го раунда
-    can_submit = event.current_round_number >= 3
-
     if request.method == "POST":
-        action = request.POST.get("action", "")
-
-        if submission.is_submitted:
-            messages.error(request, "Итог уже отправлен. Изменения запрещены.")
-            return redirect("debattle_jury", slug=slug)
+        return await sync_to_async(_jury_post)(request, slug, event, jury, match)
 
-        if action == "set_score":
-            try:
-                team_id = int(request.POST["team_id"])
-                criterion_id = int(request.POST["criterion_id"])
-                value = int(request.POST["value"])
-            except Exception:
-                messages.error(request, "Некорректные данные.")
-                return redirect("debattle_jury", slug=slug)
-
-            if value not in (1, 2, 3):
-                messages.error(request, "Оценка может быть только 1, 2 или 3.")
-                return redirect("debattle_jury", slug=slug)
-
-            # менять можно всегда (в любой момент матча)
-            Score.objects.update_or_create(
-                match=match,
-                jury=jury,
-                team_id=team_id,
-                criterion_id=criterion_id,
-                defaults={"value": value},
-            )
-            messages.success(request, "Оценка сохранена.")
-            return redirect("debattle_jury", slug=slug)
-
-        if action == "submit_final":
-            if not can_submit:
-                messages.error(request, "Нельзя отправить итог до старта 3-го раунда.")
-                return redirect("debattle_jury", slug=slug)
+    submission, _ = await JuryMatchSubmission.objects.aget_or_create(match=match, jury=jury)
 
-            submission.submit()
-            messages.success(request, "Итог отправлен. Спасибо.")
-            return redirect("debattle_jury", slug=slug)
-
-        messages.error(request, "Неизвестное действие.")
-        return redirect("debattle_jury", slug=slug)
-
-    # map для вывода текущих оценок: "team_id:criterion_id" -> value
-    scores = Score.objects.filter(jury=jury, match=match).select_related("team", "criterion")
-    score_map = {f"{s.team_id}:{s.criterion_id}": int(s.value) for s in scores}
-
-    # Получаем текущий раунд и все раунды матча
-    from debattle.models import Round
-    current_round = None
-    all_rounds = []
-    if event.current_round_number:
-        current_round = Round.objects.filter(match=match, number=event.current_round_number).first()
-    all_rounds = Round.objects.filter(match=match).order_by("number")
+    # Текущий раунд и все раунды матча
+    all_rounds = [rnd async for rnd in Round.objects.filter(match=match).order_by("number")]
+    current_round = next((rnd for rnd in all_rounds if rnd.number == event.current_round_number), None)
 
     return render(
         request,
@@ -87,11 +93,130 @@ def jury_view(request, slug: str):
             "event": event,
             "jury": jury,
             "match": match,
-            "criteria": criteria,
-            "score_map": score_map,
+            "criteria": context["criteria"],
+            # map для вывода текущих оценок: "team_id:criterion_id" -> value
+            "score_map": await ajury_score_map(match, jury),
             "submission": submission,
-            "can_submit": can_submit,
+            # ВАЖНО: submit запрещён до старта 3-го раунда
+            "can_submit": event.current_round_number >= 3,
             "current_round": current_round,
             "all_rounds": all_rounds,
+            "last_seq": await ajury_last_seq(jury),
+            "timer": timer_payload(current_round),
         },
-    )
\ No newline at end of file
+    )
+
+
+@login_required
+@require_http_methods(["GET", "POST"])
+def jury_scorecard_view(request, slug: str):
+    # JSON-карточка судьи: GET — текущие оценки, POST — вся карточка (или её изменённая часть) одним запросом
+    context = get_event_context(slug)
+    event = context["event"]
+
+    jury = event_jury_member(context, request.user)
+    if not jury:
+        return JsonResponse({"error": "Аккаунт не привязан к жюри этого мероприятия."}, status=403)
+
+    match = event.current_match
+    if not match:
+        return JsonResponse({"error": "Сейчас нет активного матча."}, status=409)
+
+    submission, _ = JuryMatchSubmission.objects.get_or_create(match=match, jury=jury)
+
+    if request.method == "POST":
+        try:
+            payload = json.loads(request.body)
+            cells = [
+                (int(item["team_id"]), int(item["criterion_id"]), int(item["value"]))
+                for item in payload["scores"]
+            ]
+        except (ValueError, TypeError, KeyError):
+            return JsonResponse({"error": "Некорректные данные."}, status=400)
+
+        team_ids = {match.team_a_id, match.team_b_id}
+        criterion_ids = {c.id for c in context["criteria"]}
+        for team_id, criterion_id, value in cells:
+            if team_id not in team_ids:
+                return JsonResponse({"error": f"Команда {team_id} не участвует в матче."}, status=400)
+            if criterion_id not in criterion_ids:
+                return JsonResponse({"error": f"Неизвестный критерий {criterion_id}."}, status=400)
+            if value not in SCORE_VALUES:
+                return JsonResponse({"error": "Оценка может быть только 1, 2 или 3."}, status=400)
+
+        # Итог проверяется в транзакции записи, под блокировкой строки отправки
+        try:
+            save_jury_scores(match, jury, cells)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=409)
+
+    return JsonResponse({
+        "match_id": match.id,
+        "submitted": submission.is_submitted,
+        "scores": jury_score_map(match, jury),
+    })
+
+
+@login_required
+@require_http_methods(["POST"])
+def jury_sync_view(request, slug: str):
+    # Синхронизация оценок планшета: {"match_id": ..., "ops": [{"op_id", "seq", "team_id",
+    # "criterion_id", "value"}, ...]}. Пачку можно слать повторно — уже обработанные операции
+    # не применяются второй раз. Матч — любой матч мероприятия, а не только текущий:
+    # оценки, набранные без сети, доезжают и после смены пары
+    context = get_event_context(slug)
+    event = context["event"]
+
+    jury = event_jury_member(context, request.user)
+    if not jury:
+        return JsonResponse({"error": "Аккаунт не привязан к жюри этого мероприятия."}, status=403)
+
+    try:
+        payload = json.loads(request.body)
+        match_id = int(payload["match_id"])
+        items = list(payload["ops"])
+    except (ValueError, TypeError, KeyError):
+        return JsonResponse({"error": "Некорректные данные."}, status=400)
+
+    match = Match.objects.filter(pk=match_id, tour__event=event).first()
+    if not match:
+        return JsonResponse({"error": "Матч не найден."}, status=404)
+
+    # Некорректная операция не должна навсегда застрять в очереди планшета:
+    # она отклоняется по отдельности, остальные применяются
+    team_ids = {match.team_a_id, match.team_b_id}
+    criterion_ids = {c.id for c in context["criteria"]}
+    ops = []
+    acks = {}
+    for item in items:
+        try:
+            op_id = str(item["op_id"])[:64]
+        except (TypeError, KeyError):
+            # Без op_id операцию нечем подтвердить — планшет её так и не отправит заново
+            continue
+        try:
+            op = (op_id, int(item["seq"]), int(item["team_id"]), int(item["criterion_id"]), int(item["value"]))
+        except (ValueError, TypeError, KeyError):
+            acks[op_id] = "rejected"
+            continue
+        _op_id, seq, team_id, criterion_id, value = op
+        if seq < 1 or team_id not in team_ids or criterion_id not in criterion_ids or value not in SCORE_VALUES:
+            acks[op_id] = "rejected"
+            continue
+        ops.append(op)
+
+    try:
+        acks.update(sync_scores(match, jury, ops))
+    except ValueError as e:
+        return JsonResponse(
+            {"error": str(e), "match_id": match.id, "submitted": True, "scores": jury_score_map(match, jury)},
+            status=409,
+        )
+
+    return JsonResponse({
+        "match_id": match.id,
+        "submitted": False,
+        "acks": acks,
+        "seq": jury_last_seq(jury),
+        "scores": jury_score_map(match, jury),
+    })
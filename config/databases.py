@@ -0,0 +1,77 @@
+import os
+from pathlib import Path
+
+# Профили БД выбираются переменной DEBATTLE_DB_PROFILE (см. settings.DATABASES):
+#   sqlite          — WAL + busy timeout: читатели экранов не ждут пишущих судей
+#   sqlite-journal  — прежний rollback journal, для сравнения в бенчмарке
+#   sqlite-replica  — sqlite + алиас "replica" на тот же файл только на чтение
+#                     (или на DB_REPLICA_NAME — копию от litestream/LiteFS)
+#   postgres        — постоянные соединения с health checks; DB_REPLICA_HOST добавляет "replica"
+DB_PROFILES = ("sqlite", "sqlite-journal", "sqlite-replica", "postgres")
+
+REPLICA_ALIAS = "replica"
+
+
+def _sqlite(base_dir: Path, journal_mode: str) -> dict:
+    return {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": base_dir / "db.sqlite3",
+        "OPTIONS": {
+            # SQLite игнорирует select_for_update: транзакции берут блокировку записи сразу
+            # (BEGIN IMMEDIATE) и ждут её, а не падают на повышении блокировки посреди транзакции
+            "transaction_mode": "IMMEDIATE",
+            # busy timeout: сколько секунд ждать освобождения блокировки записи
+            "timeout": 20,
+            # В WAL читатели не блокируют писателя и наоборот; synchronous=NORMAL
+            # в WAL безопасен для целостности и убирает fsync на каждом коммите
+            "init_command": (
+                "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL"
+                if journal_mode == "WAL" else f"PRAGMA journal_mode={journal_mode}"
+            ),
+        },
+        # Файловая тестовая БД: in-memory shared cache падает с "table is locked"
+        # вместо ожидания, а нагрузочные тесты регистрации пишут из многих потоков
+        "TEST": {"NAME": base_dir / "test_db.sqlite3"},
+    }
+
+
+def _sqlite_replica(base_dir: Path) -> dict:
+    path = Path(os.environ.get("DB_REPLICA_NAME", base_dir / "db.sqlite3"))
+    return {
+        "ENGINE": "django.db.backends.sqlite3",
+        # mode=ro: запись через реплику сразу падает, а не проходит незаметно
+        "NAME": f"file:{path}?mode=ro",
+        "OPTIONS": {"timeout": 20},
+        "TEST": {"MIRROR": "default"},
+    }
+
+
+def _postgres(host: str) -> dict:
+    return {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": os.environ.get("DB_NAME", "debattle"),
+        "USER": os.environ.get("DB_USER", "debattle"),
+        "PASSWORD": os.environ.get("DB_PASSWORD", ""),
+        "HOST": host,
+        "PORT": os.environ.get("DB_PORT", "5432"),
+        # Соединение живёт между запросами; перед переиспользованием проверяется
+        "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", "60")),
+        "CONN_HEALTH_CHECKS": True,
+    }
+
+
+def build_databases(profile: str, base_dir: Path) -> dict:
+    if profile not in DB_PROFILES:
+        raise ValueError(f"Неизвестный профиль БД {profile!r}. Доступны: {', '.join(DB_PROFILES)}")
+
+    if profile == "postgres":
+        databases = {"default": _postgres(os.environ.get("DB_HOST", "localhost"))}
+        replica_host = os.environ.get("DB_REPLICA_HOST")
+        if replica_host:
+            databases[REPLICA_ALIAS] = {**_postgres(replica_host), "TEST": {"MIRROR": "default"}}
+        return databases
+
+    databases = {"default": _sqlite(base_dir, "DELETE" if profile == "sqlite-journal" else "WAL")}
+    if profile == "sqlite-replica":
+        databases[REPLICA_ALIAS] = _sqlite_replica(base_dir)
+    return databases
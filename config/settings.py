@@ -2,6 +2,8 @@ from pathlib import Path
 from dotenv import load_dotenv
 import os
 
+from config.databases import build_databases
+
 load_dotenv()
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -44,11 +46,21 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Метрики запросов для /metrics; первой в списке — чтобы в замер вошли остальные middleware
+MIDDLEWARE.insert(0, "debattle.metrics.MetricsMiddleware")
+# Токен для сборщика метрик (Authorization: Bearer ...); без него /metrics — только персоналу
+DEBATTLE_METRICS_TOKEN = os.environ.get("DEBATTLE_METRICS_TOKEN", "")
+
+# Нагрузочный прогон (manage.py bench_event) поднимает сервер с DEBATTLE_BENCH=1
+if os.environ.get("DEBATTLE_BENCH"):
+    MIDDLEWARE.insert(0, "debattle.middleware.QueryCountHeaderMiddleware")
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с замером времени рендеринга для метрик запроса
+        'BACKEND': 'debattle.metrics.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / "templates"],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -65,14 +77,43 @@ TEMPLATES = [
 WSGI_APPLICATION = 'config.wsgi.application'
 ASGI_APPLICATION = "config.asgi.application"
 
+# Channels: на проде — Redis (несколько воркеров), локально хватает in-memory слоя
+REDIS_URL = os.environ.get("REDIS_URL")
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {"hosts": [REDIS_URL]},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"},
+    }
+
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+# Профиль БД: sqlite (WAL), sqlite-journal, sqlite-replica, postgres — см. config/databases.py
+DEBATTLE_DB_PROFILE = os.environ.get("DEBATTLE_DB_PROFILE", "sqlite")
+DATABASES = build_databases(DEBATTLE_DB_PROFILE, BASE_DIR)
+
+# Чтения экрана (screen/state.json) идут в алиас "replica", если он настроен
+DATABASE_ROUTERS = ["debattle.db_router.ReplicaRouter"]
+
+
+# Кэш отрендеренных фрагментов экрана/пульта: ключи версионируются по state_version,
+# MAX_ENTRIES ограничивает память при большом числе архивных мероприятий
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "fragments": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "debattle-fragments",
+        "TIMEOUT": 60 * 60,
+        "OPTIONS": {"MAX_ENTRIES": 2000, "CULL_FREQUENCY": 4},
+    },
 }
 
 
@@ -1,6 +1,21 @@
-from django.contrib import admin
-from .models import DebattleEvent, Theme, Team, Participant, Tour, TourTeam, Match, Round
+from operator import attrgetter
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.template.response import TemplateResponse
+from .models import DebattleEvent, EventLogEntry, Theme, Team, Participant, Tour, TourTeam, Match, Round
 from accounts.models import ScoreCriterion
+from .importing import import_event
+from .photos import schedule_renditions
+from .realtime import commit_state_change
+
+class ImportCsvForm(forms.Form):
+    teams = forms.FileField(label="Команды (CSV)", required=False,
+                            help_text="team,participant_1,participant_2[,bio_1,bio_2]")
+    jury = forms.FileField(label="Жюри (CSV)", required=False,
+                           help_text="username[,display_name,email,password]")
+
 
 class ThemeInline(admin.TabularInline):
     model = Theme
@@ -12,9 +27,62 @@ class DebattleEventAdmin(admin.ModelAdmin):
     prepopulated_fields = {"slug": ("title",)}
     inlines = [ThemeInline]
     list_display = ("title", "start_at", "state", "themes_revealed", "voting_open")
+    # Версии ведут переходы и очередь пульта: форма, открытая раньше, не должна вернуть
+    # старое значение (а с ним — устаревшие команды пульта)
+    readonly_fields = ("state_version", "control_version")
+    actions = ["import_csv"]
+
+    @admin.action(description="Импорт команд и жюри из CSV")
+    def import_csv(self, request, queryset):
+        if queryset.count() != 1:
+            self.message_user(request, "Импорт делается в одно мероприятие — выбери одно.", messages.ERROR)
+            return None
+        event = queryset.get()
+
+        # Промежуточная страница с формой файлов; её POST возвращается в это же действие
+        form = ImportCsvForm(request.POST, request.FILES) if "apply" in request.POST else ImportCsvForm()
+        if "apply" in request.POST and form.is_valid():
+            try:
+                result = import_event(
+                    event,
+                    teams_csv=_read_upload(form.cleaned_data["teams"]),
+                    jury_csv=_read_upload(form.cleaned_data["jury"]),
+                )
+            except ValueError as e:
+                form.add_error(None, str(e))
+            else:
+                if result["warning"]:
+                    self.message_user(request, result["warning"], messages.WARNING)
+                self.message_user(
+                    request,
+                    f"Импортировано команд: {result['teams']}, жюри: {result['jury']}, "
+                    f"новых туров: {result['tours']}, матчей: {result['matches']}.",
+                    messages.SUCCESS,
+                )
+                return None
+
+        return TemplateResponse(request, "admin/debattle/import_csv.html", {
+            **self.admin_site.each_context(request),
+            "title": f"Импорт из CSV: {event}",
+            "opts": self.model._meta,
+            "event": event,
+            "form": form,
+            "action_checkbox_name": helpers.ACTION_CHECKBOX_NAME,
+        })
 
     def save_model(self, request, obj, form, change):
-        super().save_model(request, obj, form, change)
+        if change:
+            # Пишем всё, кроме версий: пока открыта форма, переход мог их сдвинуть
+            obj.save(update_fields=[
+                f.name for f in obj._meta.concrete_fields
+                if not f.primary_key and f.name not in self.readonly_fields
+            ])
+        else:
+            super().save_model(request, obj, form, change)
+
+        # правка мероприятия в админке — воркеры должны перечитать закэшированный контекст
+        if change:
+            commit_state_change(obj, "config", {})
 
         # если критериев нет — создаём 5 дефолтных
         if obj.criteria.count() == 0:
@@ -29,9 +97,85 @@ class DebattleEventAdmin(admin.ModelAdmin):
                 ScoreCriterion.objects.create(event=obj, title=t, max_value=3)
 
 
+def _read_upload(upload) -> str:
+    if not upload:
+        return ""
+    try:
+        return upload.read().decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise ValueError(f"{upload.name}: файл должен быть в UTF-8.")
+
+
 admin.site.register(Team)
-admin.site.register(Participant)
-admin.site.register(Tour)
-admin.site.register(TourTeam)
-admin.site.register(Match)
-admin.site.register(Round)
\ No newline at end of file
+
+
+@admin.register(Participant)
+class ParticipantAdmin(admin.ModelAdmin):
+    list_display = ("name", "team", "photo_source")
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+
+        # фото заменили или убрали — пересобираем копии для экранов
+        if "photo" in form.changed_data:
+            schedule_renditions([obj.pk])
+
+
+class StateModelAdmin(admin.ModelAdmin):
+    # Туры, пары и раунды входят в состояние экранов: правка или удаление в админке — переход,
+    # как и правка мероприятия. event_path — путь от объекта до мероприятия
+    event_path = "event"
+
+    def _state_changed(self, events) -> None:
+        for event in {e.pk: e for e in events}.values():
+            commit_state_change(event, "config", {})
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        self._state_changed([attrgetter(self.event_path)(obj)])
+
+    def delete_model(self, request, obj):
+        event = attrgetter(self.event_path)(obj)
+        super().delete_model(request, obj)
+        self._state_changed([event])
+
+    def delete_queryset(self, request, queryset):
+        events = [attrgetter(self.event_path)(obj) for obj in queryset]
+        super().delete_queryset(request, queryset)
+        self._state_changed(events)
+
+
+@admin.register(Tour)
+class TourAdmin(StateModelAdmin):
+    event_path = "event"
+
+
+@admin.register(TourTeam)
+class TourTeamAdmin(StateModelAdmin):
+    event_path = "tour.event"
+
+
+@admin.register(Match)
+class MatchAdmin(StateModelAdmin):
+    event_path = "tour.event"
+
+
+@admin.register(Round)
+class RoundAdmin(StateModelAdmin):
+    event_path = "match.tour.event"
+
+
+@admin.register(EventLogEntry)
+class EventLogEntryAdmin(admin.ModelAdmin):
+    list_display = ("event", "seq", "kind", "version", "created_at")
+    list_filter = ("event", "kind")
+
+    # Журнал только дописывается — из админки его можно читать, но не править
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class DebattleConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'debattle'
+
+    def ready(self):
+        from . import signals  # noqa: F401
\ No newline at end of file
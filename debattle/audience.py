@@ -0,0 +1,190 @@
+import logging
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import close_old_connections, transaction
+from django.db.models import Count
+
+from .models import AudienceVote, DebattleEvent, Round
+from .realtime import event_group_name
+
+logger = logging.getLogger(__name__)
+
+# Голосование зрителей. Голос принимается в памяти процесса без запросов к БД: бюллетень
+# открытого раунда держит множество уже проголосовавших устройств (дедупликация) и счётчики.
+# Поток-сборщик раз в FLUSH_INTERVAL пишет накопленные голоса одним bulk_create и рассылает
+# экранам счёт; close_voting забирает остаток и записывает итог раунда в своей транзакции.
+# Бюллетень и живой счёт — свои у каждого процесса, итог раунда — всегда по записанным голосам
+
+FLUSH_INTERVAL = 0.5
+FLUSH_BATCH_SIZE = 2000
+
+
+class _Ballot:
+    def __init__(self, rnd: Round, team_ids: tuple[int, int], voters=(), counts=None):
+        self.round_id = rnd.id
+        self.round_number = rnd.number
+        self.team_ids = team_ids
+        self.open = True
+        self.voters = set(voters)
+        self.counts = dict(counts or dict.fromkeys(team_ids, 0))
+        self.pending = []
+        self.dirty = False
+
+    def tally(self) -> dict:
+        return {
+            "round": self.round_number,
+            "votes": {str(team_id): self.counts[team_id] for team_id in self.team_ids},
+            "total": len(self.voters),
+        }
+
+
+_ballots = {}
+# Голоса пачки, которую не удалось записать: уйдут следующим прогоном
+_unflushed = []
+# Пачка, которую сборщик пишет прямо сейчас (своей транзакцией)
+_writing = []
+_lock = threading.Lock()
+_flusher = None
+
+
+def open_ballot(event: DebattleEvent, rnd: Round) -> None:
+    # Вызывается после коммита open_voting: новый раунд — новый пустой бюллетень
+    match = rnd.match
+    ballot = _Ballot(rnd, (match.team_a_id, match.team_b_id))
+    with _lock:
+        _ballots[event.slug] = ballot
+    _ensure_flusher()
+
+
+def _load_ballot(slug: str) -> _Ballot | None:
+    # Процесс перезапустили посреди голосования: бюллетень восстанавливается из уже записанных голосов
+    event = DebattleEvent.objects.select_related("current_match").filter(slug=slug).first()
+    if event is None or not event.voting_open or not event.current_match_id:
+        return None
+    rnd = Round.objects.filter(
+        match_id=event.current_match_id, number=event.current_round_number, status=Round.Status.VOTING
+    ).first()
+    if rnd is None:
+        return None
+
+    match = event.current_match
+    votes = AudienceVote.objects.filter(round=rnd)
+    counts = dict.fromkeys((match.team_a_id, match.team_b_id), 0)
+    counts.update(votes.values("team_id").annotate(n=Count("id")).values_list("team_id", "n"))
+    return _Ballot(rnd, (match.team_a_id, match.team_b_id), voters=votes.values_list("voter", flat=True), counts=counts)
+
+
+def cast_vote(slug: str, voter: str, team_id: int) -> bool:
+    # True — голос учтён, False — это устройство в раунде уже голосовало.
+    # ValueError — голосование закрыто или команда не из текущей пары
+    ballot = _ballots.get(slug)
+    if ballot is None:
+        loaded = _load_ballot(slug)
+        if loaded is None:
+            raise ValueError("Голосование закрыто.")
+        with _lock:
+            ballot = _ballots.setdefault(slug, loaded)
+        _ensure_flusher()
+
+    with _lock:
+        if not ballot.open:
+            raise ValueError("Голосование закрыто.")
+        if team_id not in ballot.counts:
+            raise ValueError("Команда не участвует в текущей паре.")
+        if voter in ballot.voters:
+            return False
+        ballot.voters.add(voter)
+        ballot.counts[team_id] += 1
+        ballot.pending.append(AudienceVote(round_id=ballot.round_id, voter=voter, team_id=team_id))
+        ballot.dirty = True
+    return True
+
+
+def live_tally(slug: str) -> dict | None:
+    ballot = _ballots.get(slug)
+    if ballot is None or not ballot.open:
+        return None
+    with _lock:
+        return ballot.tally()
+
+
+def close_ballot(event: DebattleEvent, rnd: Round) -> None:
+    # Внутри транзакции close_voting: больше голосов не принимаем, остаток пишем в этой же
+    # транзакции — вместе с голосами раунда, которые сборщик как раз пишет своей (повтор
+    # отсеет уникальность (round, voter)). Итог раунда (rnd.audience_a/b, сохраняет вызывающий)
+    # — по записанным голосам: счётчики в памяти знают только голоса своего процесса
+    with _lock:
+        ballot = _ballots.get(event.slug)
+        pending = []
+        if ballot is not None and ballot.round_id == rnd.id:
+            ballot.open = False
+            pending, ballot.pending = ballot.pending, []
+        pending += [vote for vote in _writing + _unflushed if vote.round_id == rnd.id]
+
+    AudienceVote.objects.bulk_create(pending, batch_size=FLUSH_BATCH_SIZE, ignore_conflicts=True)
+    counts = dict(
+        AudienceVote.objects.filter(round=rnd).values("team_id").annotate(n=Count("id")).values_list("team_id", "n")
+    )
+    rnd.audience_a = counts.get(rnd.match.team_a_id, 0)
+    rnd.audience_b = counts.get(rnd.match.team_b_id, 0)
+
+
+def flush() -> int:
+    # Одна пачка накопленных голосов всех бюллетеней и рассылка счёта изменившихся.
+    # Закрытые бюллетени остаются в памяти — отвечать «закрыто» без БД до следующего open_voting
+    global _unflushed
+    with _lock:
+        batch, _unflushed = _unflushed, []
+        changed = []
+        for slug, ballot in _ballots.items():
+            if ballot.pending:
+                batch.extend(ballot.pending)
+                ballot.pending = []
+            if ballot.dirty and ballot.open:
+                ballot.dirty = False
+                changed.append((slug, ballot.tally()))
+        _writing.extend(batch)
+
+    if batch:
+        try:
+            with transaction.atomic():
+                AudienceVote.objects.bulk_create(batch, batch_size=FLUSH_BATCH_SIZE, ignore_conflicts=True)
+        except Exception:
+            # Пачка вернётся в следующий прогон; счётчики в памяти от записи не зависят
+            with _lock:
+                _unflushed = batch + _unflushed
+            raise
+        finally:
+            with _lock:
+                _writing.clear()
+
+    layer = get_channel_layer()
+    for slug, tally in changed:
+        try:
+            async_to_sync(layer.group_send)(
+                event_group_name(slug), {"type": "state.delta", "payload": {"kind": "audience_tally", **tally}}
+            )
+        except Exception:
+            logger.exception("Не удалось разослать счёт зрителей в %s", slug)
+    return len(batch)
+
+
+def _run_flusher() -> None:
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        close_old_connections()
+        try:
+            flush()
+        except Exception:
+            logger.exception("Не удалось записать голоса зрителей")
+
+
+def _ensure_flusher() -> None:
+    global _flusher
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_run_flusher, name="debattle-audience", daemon=True)
+            _flusher.start()
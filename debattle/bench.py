@@ -0,0 +1,227 @@
+import asyncio
+import http.client
+import importlib.util
+import math
+import os
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+from django.conf import settings
+
+# Инструменты нагрузочного прогона (manage.py bench_event, bench_screens): локальный ASGI-сервер,
+# HTTP-клиент с cookie/CSRF, asyncio-клиент для тысяч соединений и сбор латентностей по меткам
+
+CSRF_INPUT_RE = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+CONTROL_VERSION_INPUT_RE = re.compile(r'name="control_version" value="(\d+)"')
+
+
+def git_revision() -> tuple[str, bool]:
+    # (короткий хэш коммита, есть ли незакоммиченные изменения) — для сравнения прогонов
+    def git(*args):
+        return subprocess.run(
+            ["git", *args], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+
+    try:
+        return git("rev-parse", "--short", "HEAD"), bool(git("status", "--porcelain", "--untracked-files=no"))
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_asgi_server(port: int, extra_env: dict | None = None) -> subprocess.Popen:
+    # uvicorn, если установлен, иначе daphne (ставится вместе с channels[daphne])
+    if importlib.util.find_spec("uvicorn"):
+        cmd = [sys.executable, "-m", "uvicorn", "config.asgi:application",
+               "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    elif importlib.util.find_spec("daphne"):
+        cmd = [sys.executable, "-m", "daphne", "-b", "127.0.0.1", "-p", str(port), "config.asgi:application"]
+    else:
+        raise RuntimeError("Для бенчмарка нужен uvicorn или daphne.")
+
+    env = {**os.environ, "DEBATTLE_BENCH": "1", **(extra_env or {})}
+    proc = subprocess.Popen(
+        cmd, cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"ASGI-сервер не запустился: {proc.stderr.read().decode(errors='replace')}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+
+    proc.kill()
+    raise RuntimeError("ASGI-сервер не поднялся за 30 секунд.")
+
+
+def stop_asgi_server(proc: subprocess.Popen) -> None:
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def server_threads(pid: int) -> int | None:
+    # Число потоков процесса сервера (Linux, /proc); None — узнать нельзя
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class Recorder:
+    # Потокобезопасный сбор (латентность, число запросов к БД, ошибка) по меткам
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, label: str, latency_ms: float, queries: int | None, ok: bool) -> None:
+        with self._lock:
+            self.samples[label].append((latency_ms, queries))
+            if not ok:
+                self.errors[label] += 1
+
+    def summary(self, wall_seconds: float) -> dict:
+        result = {}
+        for label, samples in sorted(self.samples.items()):
+            latencies = sorted(s[0] for s in samples)
+            queries = [s[1] for s in samples if s[1] is not None]
+            result[label] = {
+                "count": len(samples),
+                "errors": self.errors[label],
+                "p50_ms": round(percentile(latencies, 50), 2),
+                "p95_ms": round(percentile(latencies, 95), 2),
+                "p99_ms": round(percentile(latencies, 99), 2),
+                "rps": round(len(samples) / wall_seconds, 1) if wall_seconds else 0.0,
+                "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+            }
+        return result
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    # nearest-rank по уже отсортированному списку
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(p / 100 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+class BenchClient:
+    # Одно keep-alive соединение на виртуального пользователя; cookie и CSRF ведёт сам
+
+    def __init__(self, port: int, recorder: Recorder, cookies: dict | None = None):
+        self.port = port
+        self.recorder = recorder
+        self.cookies = dict(cookies or {})
+        self.conn = None
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        return self.conn
+
+    def request(self, label: str, method: str, path: str, data: dict | None = None,
+                headers: dict | None = None, body: bytes | None = None) -> tuple[int, str, dict]:
+        headers = dict(headers or {})
+        if data is not None:
+            body = urlencode(data).encode()
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+        if "csrftoken" in self.cookies:
+            headers["X-CSRFToken"] = self.cookies["csrftoken"]
+
+        started = time.perf_counter()
+        try:
+            conn = self._connection()
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            payload = response.read().decode(errors="replace")
+        except (OSError, http.client.HTTPException):
+            self.close()
+            self.recorder.add(label, (time.perf_counter() - started) * 1000, None, ok=False)
+            return 0, "", {}
+        latency_ms = (time.perf_counter() - started) * 1000
+
+        for header in response.headers.get_all("Set-Cookie") or []:
+            for key, morsel in SimpleCookie(header).items():
+                self.cookies[key] = morsel.value
+
+        queries = response.headers.get("X-DB-Queries")
+        self.recorder.add(label, latency_ms, int(queries) if queries else None, ok=response.status < 400)
+        return response.status, payload, dict(response.headers)
+
+    def csrf_token(self, html: str) -> str:
+        match = CSRF_INPUT_RE.search(html)
+        return match.group(1) if match else self.cookies.get("csrftoken", "")
+
+    def control_version(self, html: str) -> str:
+        # Версия, которую показал пульт: без неё команда не проверяется на устаревание
+        match = CONTROL_VERSION_INPUT_RE.search(html)
+        return match.group(1) if match else ""
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+async def afetch(port: int, path: str, headers: dict | None = None, timeout: float = 60) -> tuple[int, dict]:
+    # Минимальный GET по HTTP/1.1 на asyncio: держит тысячи одновременных запросов без потоков.
+    # Возвращает (статус, заголовки); 0 — ошибка соединения или таймаут
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return 0, {}
+    try:
+        lines = [f"GET {path} HTTP/1.1", f"Host: 127.0.0.1:{port}", "Connection: close"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+        await writer.drain()
+
+        async def read_response():
+            status_line = await reader.readline()
+            response_headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                response_headers[name.strip()] = value.strip()
+            await reader.read()
+            return int(status_line.split()[1]), response_headers
+
+        return await asyncio.wait_for(read_response(), timeout)
+    except (OSError, ValueError, IndexError, asyncio.TimeoutError):
+        return 0, {}
+    finally:
+        writer.close()
+
+
+def session_cookies(user) -> dict:
+    # Готовая сессия без логина через форму: виртуальные пользователи сразу авторизованы
+    from django.test import Client
+
+    client = Client()
+    client.force_login(user)
+    return {settings.SESSION_COOKIE_NAME: client.cookies[settings.SESSION_COOKIE_NAME].value}
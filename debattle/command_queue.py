@@ -0,0 +1,120 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+
+from . import game_flow, tracing
+from .metrics import timed_transition
+from .models import DebattleEvent
+from .scheduling import generate_schedule
+
+logger = logging.getLogger(__name__)
+
+# Команды пульта: переходы одного мероприятия выполняет один поток-исполнитель строго
+# по очереди, разные мероприятия — параллельно в своих потоках. Общая блокировка берётся
+# только на поиск/создание исполнителя, не на сам переход
+ACTIONS = {
+    "reveal_themes": game_flow.reveal_themes,
+    "set_tour": game_flow.set_current_tour,
+    "generate_schedule": generate_schedule,
+    "start_roulette": game_flow.start_roulette,
+    "start_round": game_flow.start_next_round,
+    "start_timer": game_flow.start_timer,
+    "stop_timer": game_flow.stop_timer,
+    "open_voting": game_flow.open_voting,
+    "close_voting": game_flow.close_voting,
+}
+
+# Сколько исполнитель ждёт новых команд, прежде чем завершиться
+IDLE_TIMEOUT = 30
+# Сколько запрос пульта ждёт выполнения своей команды
+COMMAND_TIMEOUT = 30
+
+_workers = {}
+_lock = threading.Lock()
+
+
+class StaleCommandError(ValueError):
+    pass
+
+
+class _EventWorker:
+    def __init__(self, event_id: int):
+        self.event_id = event_id
+        self.commands = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name=f"debattle-event-{event_id}", daemon=True)
+
+    def _run(self) -> None:
+        try:
+            while True:
+                try:
+                    command = self.commands.get(timeout=IDLE_TIMEOUT)
+                except queue.Empty:
+                    # Команды кладутся под _lock — проверка пустоты и удаление без гонки
+                    with _lock:
+                        if self.commands.empty():
+                            _workers.pop(self.event_id, None)
+                            return
+                    continue
+                self._execute(*command)
+        finally:
+            connection.close()
+
+    def _execute(
+        self, action: str, kwargs: dict, expected_version: int | None, submitted_ms: int, future: Future
+    ) -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        close_old_connections()
+        try:
+            # Задержка до экранов считается от приёма команды, включая ожидание в очереди
+            with tracing.transition_started(submitted_ms), timed_transition(action):
+                result = _apply(self.event_id, action, kwargs, expected_version)
+            future.set_result(result)
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            close_old_connections()
+
+
+@transaction.atomic
+def _apply(event_id: int, action: str, kwargs: dict, expected_version: int | None):
+    # Строка мероприятия блокируется до конца перехода: очередь упорядочивает команды
+    # внутри процесса, блокировка (и IMMEDIATE-транзакции SQLite) — между процессами.
+    # Событие читаем заново: копия из контекста запроса могла устареть, пока команда ждала
+    event = DebattleEvent.objects.select_for_update().get(pk=event_id)
+    if expected_version is not None and event.control_version != expected_version:
+        raise StaleCommandError(
+            f"Команда устарела: пульт показывал версию {expected_version}, текущая — {event.control_version}. "
+            "Обнови страницу."
+        )
+    result = ACTIONS[action](event, **kwargs)
+    DebattleEvent.objects.filter(pk=event_id).update(control_version=F("control_version") + 1)
+    return result
+
+
+def submit_command(event_id: int, action: str, expected_version: int | None = None, **kwargs):
+    # Ставит команду в очередь мероприятия и ждёт результата; исключения перехода
+    # (ValueError, StaleCommandError) пробрасываются вызывающему
+    if action not in ACTIONS:
+        raise ValueError("Неизвестное действие.")
+
+    future = Future()
+    with _lock:
+        worker = _workers.get(event_id)
+        if worker is None:
+            worker = _workers[event_id] = _EventWorker(event_id)
+            worker.thread.start()
+        worker.commands.put((action, kwargs, expected_version, tracing.now_ms(), future))
+
+    try:
+        return future.result(timeout=COMMAND_TIMEOUT)
+    except TimeoutError:
+        # Команда осталась в очереди и ещё может выполниться — снять её можно, только пока не начата
+        if future.cancel():
+            raise ValueError("Очередь команд занята, команда отменена. Попробуй ещё раз.")
+        logger.warning("Команда %s мероприятия %s выполняется дольше %s с", action, event_id, COMMAND_TIMEOUT)
+        raise ValueError("Команда ещё выполняется. Обнови пульт через несколько секунд.")
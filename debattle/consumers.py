@@ -0,0 +1,117 @@
+import json
+import time
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.generic.http import AsyncHttpConsumer
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.http import Http404
+
+from .models import DebattleEvent
+from .realtime import control_group_name, event_group_name
+from .tracing import ack_trace_id, record_ack
+from .views import wait_state
+
+
+class EventStateConsumer(AsyncJsonWebsocketConsumer):
+    # Экран/жюри подписываются на группу мероприятия и получают только дельты состояния;
+    # в обратную сторону экран шлёт подтверждения показанных дельт (tracing) и пинги
+    # для оценки смещения своих часов относительно серверных (таймер раунда)
+
+    async def connect(self):
+        self.slug = self.scope["url_route"]["kwargs"]["slug"]
+        self.event_id = await self._event_id()
+        if self.event_id is None:
+            await self.close()
+            return
+
+        self.group_name = event_group_name(self.slug)
+        # trace, по которым соединение уже подтверждало доставку
+        self.acked_traces = set()
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if hasattr(self, "group_name"):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def state_delta(self, message):
+        await self.send_json(message["payload"])
+
+    async def receive_json(self, content, **kwargs):
+        if not isinstance(content, dict):
+            return
+        if content.get("type") == "ping":
+            # Без БД и без группы: ответ сразу, чтобы задержка обмена была минимальной
+            await self.send_json({"kind": "pong", "t0": content.get("t0"), "server_ms": int(time.time() * 1000)})
+        elif content.get("type") == "ack":
+            # Не больше одного подтверждения на переход от соединения
+            trace_id = ack_trace_id(content)
+            if trace_id is None or trace_id in self.acked_traces:
+                return
+            if await database_sync_to_async(record_ack)(self.event_id, content):
+                self.acked_traces.add(trace_id)
+
+    @database_sync_to_async
+    def _event_id(self) -> int | None:
+        return DebattleEvent.objects.filter(slug=self.slug).values_list("id", flat=True).first()
+
+
+class ControlProgressConsumer(AsyncJsonWebsocketConsumer):
+    # Пульт оператора (только staff): прогресс жюри по текущему матчу
+
+    async def connect(self):
+        user = self.scope.get("user")
+        if user is None or not user.is_staff:
+            await self.close()
+            return
+
+        event_id = await self._event_id(self.scope["url_route"]["kwargs"]["slug"])
+        if event_id is None:
+            await self.close()
+            return
+
+        self.group_name = control_group_name(event_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if hasattr(self, "group_name"):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def state_delta(self, message):
+        await self.send_json(message["payload"])
+
+    @database_sync_to_async
+    def _event_id(self, slug: str) -> int | None:
+        return DebattleEvent.objects.filter(slug=slug).values_list("id", flat=True).first()
+
+
+class StateWaitConsumer(AsyncHttpConsumer):
+    # Длинный опрос state/wait/ под ASGI-сервером. Тот же ответ, что у state_wait_view, но в
+    # обход HTTP-обработчика Django: он держит на каждый запрос свой поток исполнителя
+    # (ThreadSensitiveContext) всё время ожидания, а здесь ожидающий экран — только корутина
+
+    async def handle(self, body):
+        query = parse_qs(self.scope.get("query_string", b"").decode("latin-1"))
+        try:
+            after = int(query["after"][0])
+        except (KeyError, ValueError):
+            await self._send_json(400, {"error": "Некорректные данные."})
+            return
+
+        try:
+            version, snapshot = await wait_state(self.scope["url_route"]["kwargs"]["slug"], after)
+        except Http404:
+            await self.send_response(404, b"", headers=[(b"Content-Type", b"text/plain")])
+            return
+
+        if snapshot is None:
+            await self.send_response(304, b"", headers=[(b"ETag", f'"{version}"'.encode())])
+        else:
+            await self._send_json(200, snapshot, [(b"ETag", f'"{snapshot["version"]}"'.encode())])
+
+    async def _send_json(self, status: int, data: dict, headers: list | None = None):
+        await self.send_response(status, json.dumps(data).encode(), headers=[
+            (b"Content-Type", b"application/json"), (b"Cache-Control", b"no-cache"), *(headers or []),
+        ])
@@ -0,0 +1,91 @@
+import copy
+import threading
+
+from asgiref.sync import sync_to_async
+from django.http import Http404
+
+from accounts.models import JuryMember
+
+from .models import DebattleEvent
+
+# Контекст мероприятия в памяти процесса: событие с текущими туром и матчем (и командами),
+# критерии и активное жюри. Каждый запрос сверяет только (pk, created_at, control_version,
+# state_version) — один лёгкий запрос; граф объектов перечитывается, лишь когда версию подняли
+# (в любом воркере). control_version — потому что не каждая команда пульта двигает state_version.
+# pk и created_at отличают пересозданное с тем же slug мероприятие (SQLite переиспользует pk)
+MAX_CONTEXTS = 64
+
+_contexts = {}
+_lock = threading.Lock()
+
+
+VERSION_FIELDS = ("pk", "created_at", "control_version", "state_version")
+
+
+def event_version(slug: str) -> tuple | None:
+    return DebattleEvent.objects.filter(slug=slug).values_list(*VERSION_FIELDS).first()
+
+
+async def aevent_version(slug: str) -> tuple | None:
+    return await DebattleEvent.objects.filter(slug=slug).values_list(*VERSION_FIELDS).afirst()
+
+
+def _build(slug: str) -> dict:
+    event = (
+        DebattleEvent.objects.select_related(
+            "current_tour",
+            "current_match__team_a",
+            "current_match__team_b",
+            "current_match__theme",
+        )
+        .filter(slug=slug)
+        .first()
+    )
+    if event is None:
+        raise Http404
+    return {
+        "version": (event.pk, event.created_at, event.control_version, event.state_version),
+        "event": event,
+        "criteria": list(event.criteria.all().order_by("id")),
+        "jurors": list(JuryMember.objects.filter(event=event, is_active=True).select_related("user")),
+    }
+
+
+def get_event_context(slug: str, version: tuple | None = None) -> dict:
+    # version — уже прочитанный вызывающим event_version(), чтобы не спрашивать БД дважды
+    version = version or event_version(slug)
+    if version is None:
+        raise Http404
+
+    context = _contexts.get(slug)
+    if context is None or context["version"] != version:
+        context = _build(slug)
+        with _lock:
+            if len(_contexts) >= MAX_CONTEXTS and slug not in _contexts:
+                _contexts.pop(next(iter(_contexts)))
+            _contexts[slug] = context
+
+    # Своя копия на запрос: game_flow меняет и сохраняет event/match, а кэш общий для потоков
+    return copy.deepcopy(context)
+
+
+async def aget_event_context(slug: str, version: tuple | None = None) -> dict:
+    # Для async-обработчиков: при актуальном контексте в памяти — ни одного перехода в поток,
+    # кроме сверки версии; граф объектов перечитывается синхронным _build в потоке
+    version = version or await aevent_version(slug)
+    if version is None:
+        raise Http404
+
+    context = _contexts.get(slug)
+    if context is None or context["version"] != version:
+        return await sync_to_async(get_event_context)(slug, version)
+    return copy.deepcopy(context)
+
+
+def clear_event_contexts() -> None:
+    with _lock:
+        _contexts.clear()
+
+
+def event_jury_member(context: dict, user) -> JuryMember | None:
+    return next((j for j in context["jurors"] if j.user_id == user.pk), None)
@@ -0,0 +1,131 @@
+from django.db import IntegrityError, connection, transaction
+
+from .models import DebattleEvent, EventLogEntry, EventSnapshot
+
+# Журнал переходов и оценок мероприятия. Состояние на любой записи — последний снимок
+# не позже неё плюс хвост журнала через apply_entry; снимки пишутся каждые SNAPSHOT_EVERY
+# записей, так что восстановление читает два запроса и сворачивает не больше стольких записей
+SNAPSHOT_EVERY = 50
+# Сколько раз запись без блокировки мероприятия берёт следующий seq при столкновении
+APPEND_ATTEMPTS = 10
+
+EVENT_FIELDS = (
+    "state",
+    "themes_revealed",
+    "current_tour_id",
+    "current_match_id",
+    "current_round_number",
+    "voting_open",
+)
+
+
+def empty_state() -> dict:
+    # Ключи словарей — строки: состояние должно пережить JSON снимка без изменений
+    return {
+        "seq": 0,
+        "version": 0,
+        "event": {},
+        "themes": [],
+        "round": None,
+        "timer": None,
+        "audience": None,
+        "matches": {},
+        "results": {},
+        "scores": {},
+        "submitted": {},
+    }
+
+
+def transition_record(event: DebattleEvent, delta: dict, extra: dict | None = None) -> dict:
+    # Запись перехода: поля мероприятия после него и та же дельта, что ушла экранам,
+    # но без составов команд (фото и биографии к состоянию игры не относятся)
+    data = {"event": {name: getattr(event, name) for name in EVENT_FIELDS}}
+    for key in ("themes", "round", "timer", "audience", "results"):
+        if key in delta:
+            data[key] = delta[key]
+    if delta.get("match"):
+        match = dict(delta["match"])
+        for side in ("team_a", "team_b"):
+            match[side] = {"id": match[side]["id"], "name": match[side]["name"]}
+        data["match"] = match
+    data.update(extra or {})
+    return data
+
+
+def apply_entry(state: dict, seq: int, kind: str, version: int, data: dict) -> dict:
+    state["seq"] = seq
+    state["version"] = version
+
+    if kind == "scores":
+        card = state["scores"].setdefault(str(data["match_id"]), {}).setdefault(str(data["jury_id"]), {})
+        card.update(data["cells"])
+        return state
+
+    state["event"].update(data.get("event", {}))
+    if "themes" in data:
+        state["themes"] = data["themes"]
+    if "round" in data:
+        state["round"] = data["round"]
+    if "timer" in data:
+        state["timer"] = data["timer"]
+    if "audience" in data:
+        state["audience"] = data["audience"]
+    if data.get("match"):
+        state["matches"][str(data["match"]["id"])] = data["match"]
+    if data.get("results") is not None:
+        state["results"][str(state["event"]["current_match_id"])] = data["results"]
+    if kind == "jury_submit":
+        submitted = state["submitted"].setdefault(str(data["match_id"]), [])
+        if data["jury_id"] not in submitted:
+            submitted.append(data["jury_id"])
+    return state
+
+
+@transaction.atomic
+def append(event_id: int, kind: str, data: dict, version: int | None = None) -> EventLogEntry:
+    # Переходы состояния (version задана — commit_state_change) идут под блокировкой строки
+    # мероприятия: её и так держит переход, двигая state_version, так что seq переходов идёт
+    # в порядке коммитов. Оценки жюри блокировку не берут, иначе все записи судей мероприятия
+    # встали бы в одну очередь: seq для них выдаёт уникальность (event, seq) — при встречной
+    # записи с тем же номером берём следующий
+    if version is not None and connection.features.has_select_for_update:
+        DebattleEvent.objects.select_for_update().filter(pk=event_id).exists()
+
+    for attempt in range(APPEND_ATTEMPTS):
+        last_seq, last_version = (
+            EventLogEntry.objects.filter(event_id=event_id).order_by("-seq").values_list("seq", "version").first()
+        ) or (0, None)
+        entry_version = version
+        if entry_version is None:
+            # Версию двигает только commit_state_change, а он пишет в журнал — у последней записи она текущая
+            entry_version = last_version
+        if entry_version is None:
+            entry_version = DebattleEvent.objects.filter(pk=event_id).values_list("state_version", flat=True).get()
+
+        try:
+            with transaction.atomic():
+                entry = EventLogEntry.objects.create(
+                    event_id=event_id, seq=last_seq + 1, kind=kind, version=entry_version, data=data
+                )
+            break
+        except IntegrityError:
+            if attempt == APPEND_ATTEMPTS - 1:
+                raise
+
+    if entry.seq % SNAPSHOT_EVERY == 0:
+        EventSnapshot.objects.create(event_id=event_id, seq=entry.seq, state=rebuild_state(event_id))
+    return entry
+
+
+def rebuild_state(event_id: int, upto_seq: int | None = None) -> dict:
+    snapshots = EventSnapshot.objects.filter(event_id=event_id)
+    entries = EventLogEntry.objects.filter(event_id=event_id)
+    if upto_seq is not None:
+        snapshots = snapshots.filter(seq__lte=upto_seq)
+        entries = entries.filter(seq__lte=upto_seq)
+
+    state = snapshots.order_by("-seq").values_list("state", flat=True).first() or empty_state()
+    tail = entries.filter(seq__gt=state["seq"]).order_by("seq").values_list("seq", "kind", "version", "data")
+    for row in tail:
+        apply_entry(state, *row)
+    return state
@@ -0,0 +1,131 @@
+import csv
+import json
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Exists, OuterRef
+
+from accounts.models import JuryMatchSubmission, Score
+
+from .models import DebattleEvent, DeliveryAck, Match, Round
+
+# Выгрузка оценок и результатов мероприятия. Строки читаются курсором пачками по CHUNK_SIZE
+# (values_list().iterator() — без экземпляров моделей) и сразу пишутся в поток, так что
+# память не зависит от размера мероприятия
+
+FORMATS = ("csv", "ndjson")
+CHUNK_SIZE = 2000
+
+# Таблица -> ((колонка, поле ORM), ...)
+TABLES = {
+    "matches": (
+        ("match_id", "id"),
+        ("tour", "tour__number"),
+        ("slot", "slot"),
+        ("status", "status"),
+        ("team_a_id", "team_a_id"),
+        ("team_a", "team_a__name"),
+        ("team_b_id", "team_b_id"),
+        ("team_b", "team_b__name"),
+        ("theme", "theme__title"),
+        ("team_a_position", "team_a_position"),
+        ("team_b_position", "team_b_position"),
+        ("winner_id", "winner_id"),
+        ("created_at", "created_at"),
+    ),
+    "rounds": (
+        ("match_id", "match_id"),
+        ("round", "number"),
+        ("status", "status"),
+        ("started_at", "started_at"),
+        ("ended_at", "ended_at"),
+    ),
+    "submissions": (
+        ("match_id", "match_id"),
+        ("jury_id", "jury_id"),
+        ("jury", "jury__user__username"),
+        ("scores_count", "scores_count"),
+        ("is_submitted", "is_submitted"),
+        ("submitted_at", "submitted_at"),
+    ),
+    "scores": (
+        ("match_id", "match_id"),
+        ("jury_id", "jury_id"),
+        ("team_id", "team_id"),
+        ("team", "team__name"),
+        ("criterion_id", "criterion_id"),
+        ("criterion", "criterion__title"),
+        ("value", "value"),
+    ),
+    "deliveries": (
+        ("trace_id", "trace_id"),
+        ("kind", "kind"),
+        ("version", "version"),
+        ("client", "client"),
+        ("latency_ms", "latency_ms"),
+        ("created_at", "created_at"),
+    ),
+}
+
+
+def _queryset(event: DebattleEvent, table: str, submitted_only: bool):
+    if table == "matches":
+        qs = Match.objects.filter(tour__event=event)
+    elif table == "rounds":
+        qs = Round.objects.filter(match__tour__event=event)
+    elif table == "submissions":
+        qs = JuryMatchSubmission.objects.filter(match__tour__event=event)
+        if submitted_only:
+            qs = qs.filter(is_submitted=True)
+    elif table == "deliveries":
+        qs = DeliveryAck.objects.filter(event=event)
+    else:
+        qs = Score.objects.filter(match__tour__event=event)
+        if submitted_only:
+            # Как в compute_match_results: в зачёт идут только карточки отправивших итог
+            qs = qs.filter(Exists(JuryMatchSubmission.objects.filter(
+                match=OuterRef("match"), jury=OuterRef("jury"), is_submitted=True
+            )))
+    fields = [field for _column, field in TABLES[table]]
+    return qs.order_by("pk").values_list(*fields)
+
+
+class _Echo:
+    # csv.writer пишет в «файл», а нам нужна готовая строка
+    def write(self, value: str) -> str:
+        return value
+
+
+def export_lines(event: DebattleEvent, table: str, fmt: str, submitted_only: bool = False):
+    # table — одна из TABLES или "all" (только NDJSON: у каждой строки ключ "table")
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    if table != "all" and table not in TABLES:
+        raise ValueError(f"Неизвестная таблица выгрузки: {table}")
+    if table == "all" and fmt == "csv":
+        raise ValueError("CSV выгружается по одной таблице.")
+
+    tables = list(TABLES) if table == "all" else [table]
+    return _lines(event, tables, fmt, submitted_only)
+
+
+def _lines(event: DebattleEvent, tables: list[str], fmt: str, submitted_only: bool):
+    writer = csv.writer(_Echo())
+    for table in tables:
+        columns = [column for column, _field in TABLES[table]]
+        rows = _queryset(event, table, submitted_only).iterator(chunk_size=CHUNK_SIZE)
+        if fmt == "csv":
+            yield writer.writerow(columns)
+            for row in rows:
+                yield writer.writerow(row)
+        else:
+            for row in rows:
+                record = {"table": table, **dict(zip(columns, row))}
+                yield json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + "\n"
+
+
+def batched(lines, size: int = 500):
+    # Склеиваем строки в куски: меньше накладных расходов на каждую отправку
+    lines = iter(lines)
+    while chunk := "".join(islice(lines, size)):
+        yield chunk
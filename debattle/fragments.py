@@ -0,0 +1,33 @@
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
+
+# Отдельный кэш с ограниченным числом записей (см. CACHES["fragments"] в settings)
+FRAGMENT_CACHE = "fragments"
+
+# Имена {% cache %}-фрагментов экрана и пульта; все варьируются по (slug, state_version)
+FRAGMENT_NAMES = (
+    "screen_themes",
+    "screen_tours",
+    "screen_match",
+    "screen_standings",
+    "control_tours",
+    "control_status",
+)
+
+
+def fragment_cache():
+    return caches[FRAGMENT_CACHE]
+
+
+def state_cache_key(kind: str, slug: str, version: int) -> str:
+    return f"debattle:{kind}:{slug}:{version}"
+
+
+def invalidate_event_fragments(slug: str, version: int) -> None:
+    # Ключи содержат версию, поэтому после перехода старые фрагменты никто не прочитает —
+    # удаляем их сразу, не дожидаясь вытеснения
+    keys = [make_template_fragment_key(name, [slug, version]) for name in FRAGMENT_NAMES]
+    keys.append(state_cache_key("snapshot", slug, version))
+    keys.append(state_cache_key("screen_page", slug, version))
+    keys.append(state_cache_key("standings", slug, version))
+    fragment_cache().delete_many(keys)
@@ -2,7 +2,17 @@ import random
 from django.db import transaction
 from django.utils import timezone
 
+from accounts.services import compute_match_results
+
+from . import audience
 from .models import DebattleEvent, Tour, Match, Round
+from .realtime import (
+    audience_payload, commit_state_change, match_payload, round_payload, results_payload, timer_payload,
+)
+from .standings import SCREEN_STANDINGS, resolve_match, standings_payload
+
+# Последний раунд матча: его закрытие подводит итог матча
+ROUNDS_PER_MATCH = 3
 
 
 def _pick_current_tour(event: DebattleEvent) -> Tour | None:
@@ -28,37 +38,32 @@ def reveal_themes(event: DebattleEvent) -> None:
         event.state = DebattleEvent.State.REGISTRATION
     event.save(update_fields=["themes_revealed", "state"])
 
+    commit_state_change(event, "reveal_themes", {
+        "state": event.state,
+        "themes_revealed": True,
+        "themes": [t.title for t in event.themes.all()],
+    })
+
 
 @transaction.atomic
 def set_current_tour(event: DebattleEvent, tour_id: int) -> None:
     tour = Tour.objects.select_for_update().get(id=tour_id, event=event)
     event.current_tour = tour
     event.save(update_fields=["current_tour"])
+    commit_state_change(event, "set_current_tour", {})
 
 
-@transaction.atomic
-def start_roulette(event: DebattleEvent) -> Match:
-    tour = _pick_current_tour(event)
-    if tour is None:
-        raise ValueError("Нет доступного тура для рулетки. Нужен тур со статусом CLOSED/RUNNING.")
-
-    teams = list(tour.teams.all())
+def _draw_match(tour: Tour) -> Match:
+    # Без расписания: случайная пара из тура, затем оставшиеся команды
+    teams = list(tour.teams.all()[:4])
     if len(teams) < 2:
         raise ValueError("В туре меньше 2 команд.")
 
-    if len(teams) > 4:
-        # На всякий случай, чтобы не было сюрпризов
-        teams = teams[:4]
-
-    # Проверяем, есть ли уже матчи в этом туре
-    existing_matches = Match.objects.filter(tour=tour)
     used_teams = set()
-    for match in existing_matches:
-        used_teams.add(match.team_a_id)
-        used_teams.add(match.team_b_id)
-    
-    # Если уже есть матч, выбираем оставшиеся команды
-    if existing_matches.exists():
+    for team_a_id, team_b_id in Match.objects.filter(tour=tour).values_list("team_a_id", "team_b_id"):
+        used_teams.update((team_a_id, team_b_id))
+
+    if used_teams:
         remaining_teams = [t for t in teams if t.id not in used_teams]
         if len(remaining_teams) < 2:
             raise ValueError("Недостаточно оставшихся команд для второго матча.")
@@ -67,7 +72,34 @@ def start_roulette(event: DebattleEvent) -> Match:
         # Первый раз - случайный выбор
         team_a, team_b = random.sample(teams, 2)
 
-    match = Match.objects.create(tour=tour, team_a=team_a, team_b=team_b, status=Match.Status.PENDING)
+    return Match.objects.create(tour=tour, team_a=team_a, team_b=team_b, status=Match.Status.RUNNING)
+
+
+@transaction.atomic
+def start_roulette(event: DebattleEvent) -> Match:
+    tour = _pick_current_tour(event)
+    if tour is None:
+        raise ValueError("Нет доступного тура для рулетки. Нужен тур со статусом CLOSED/RUNNING.")
+
+    # Прошлый матч закончен, раз оператор крутит рулетку дальше
+    if event.current_match_id:
+        Match.objects.filter(pk=event.current_match_id).exclude(status=Match.Status.DONE).update(
+            status=Match.Status.DONE
+        )
+
+    # Есть расписание (generate_schedule) — берём следующий запланированный матч
+    match = (
+        Match.objects.select_related("team_a", "team_b", "theme")
+        .filter(tour=tour, slot__isnull=False, status=Match.Status.PENDING)
+        .order_by("slot")
+        .first()
+    )
+
+    if match is None:
+        match = _draw_match(tour)
+    else:
+        match.status = Match.Status.RUNNING
+        match.save(update_fields=["status"])
 
     # Обновляем состояние ивента
     event.current_tour = tour
@@ -84,18 +116,33 @@ def start_roulette(event: DebattleEvent) -> Match:
         tour.status = Tour.Status.RUNNING
         tour.save(update_fields=["status"])
 
+    commit_state_change(event, "start_roulette", {
+        "state": event.state,
+        "round_number": 0,
+        "voting_open": False,
+        "match": match_payload(match, with_participants=True),
+        "round": None,
+        "results": None,
+        "tour": {"id": tour.id, "status": tour.status},
+    })
+
     return match
 
 
 @transaction.atomic
-def start_next_round(event: DebattleEvent) -> Round:
+def start_next_round(event: DebattleEvent, duration: int | None = None) -> Round:
+    # duration — таймер раунда в секундах; по умолчанию event.round_duration
+    if duration is not None and duration <= 0:
+        raise ValueError("Длительность раунда должна быть больше нуля.")
     if not event.current_match_id:
         raise ValueError("Нет текущего матча. Сначала запусти рулетку.")
 
-    if event.current_round_number >= 3:
-        raise ValueError("Всего предусмотрено 3 раунда. Больше запускать нельзя.")
+    if event.current_round_number >= ROUNDS_PER_MATCH:
+        raise ValueError(f"Всего предусмотрено {ROUNDS_PER_MATCH} раунда. Больше запускать нельзя.")
     
-    match = event.current_match
+    # Матч с командами и темой одним запросом: у запечатанного тура всё уже разыграно,
+    # дальше только запись раунда и указателей
+    match = Match.objects.select_related("team_a", "team_b", "theme").get(pk=event.current_match_id)
 
     next_number = event.current_round_number + 1
 
@@ -108,6 +155,9 @@ def start_next_round(event: DebattleEvent) -> Round:
     # если раунд существовал — активируем
     rnd.status = Round.Status.ACTIVE
     rnd.started_at = rnd.started_at or timezone.now()
+    # Таймер стартует вместе с раундом — экраны получат его в той же дельте
+    rnd.timer_remaining_ms = (duration or event.round_duration) * 1000
+    rnd.timer_started_at = timezone.now()
     
     # Если тема еще не выбрана для матча, выбираем её при первом раунде
     if not match.theme_id:
@@ -142,13 +192,64 @@ def start_next_round(event: DebattleEvent) -> Round:
         match.team_b_position = positions[1]
         match.save(update_fields=["team_a_position", "team_b_position"])
     
-    rnd.save(update_fields=["status", "started_at"])
+    rnd.save(update_fields=["status", "started_at", "timer_remaining_ms", "timer_started_at"])
 
     event.current_round_number = next_number
     event.voting_open = False
     event.state = DebattleEvent.State.ROUND_ACTIVE
     event.save(update_fields=["current_round_number", "voting_open", "state"])
 
+    commit_state_change(event, "start_next_round", {
+        "state": event.state,
+        "round_number": next_number,
+        "voting_open": False,
+        "match": match_payload(match),
+        "round": round_payload(rnd),
+        "timer": timer_payload(rnd),
+    })
+
+    return rnd
+
+
+def _pause_timer(rnd: Round) -> None:
+    # Идущий таймер запоминает остаток; запись — на вызывающем
+    elapsed_ms = int((timezone.now() - rnd.timer_started_at).total_seconds() * 1000)
+    rnd.timer_remaining_ms = max(0, rnd.timer_remaining_ms - elapsed_ms)
+    rnd.timer_started_at = None
+
+
+def _current_round(event: DebattleEvent) -> Round:
+    if not event.current_match_id or event.current_round_number == 0:
+        raise ValueError("Нет активного раунда. Сначала запусти раунд.")
+    return Round.objects.select_for_update().get(match_id=event.current_match_id, number=event.current_round_number)
+
+
+@transaction.atomic
+def start_timer(event: DebattleEvent) -> Round:
+    # Продолжить остановленный таймер с остатка — только пока идут выступления
+    rnd = _current_round(event)
+    if rnd.status != Round.Status.ACTIVE:
+        raise ValueError("Раунд не идёт: таймер запускается только в активном раунде.")
+    if rnd.timer_started_at is not None:
+        raise ValueError("Таймер уже идёт.")
+    if not rnd.timer_remaining_ms:
+        raise ValueError("Время раунда вышло.")
+
+    rnd.timer_started_at = timezone.now()
+    rnd.save(update_fields=["timer_started_at"])
+    commit_state_change(event, "start_timer", {"timer": timer_payload(rnd)})
+    return rnd
+
+
+@transaction.atomic
+def stop_timer(event: DebattleEvent) -> Round:
+    rnd = _current_round(event)
+    if rnd.timer_started_at is None:
+        raise ValueError("Таймер не идёт.")
+
+    _pause_timer(rnd)
+    rnd.save(update_fields=["timer_remaining_ms", "timer_started_at"])
+    commit_state_change(event, "stop_timer", {"timer": timer_payload(rnd)})
     return rnd
 
 
@@ -159,11 +260,24 @@ def open_voting(event: DebattleEvent) -> None:
 
     rnd = Round.objects.select_for_update().get(match=event.current_match, number=event.current_round_number)
     rnd.status = Round.Status.VOTING
-    rnd.save(update_fields=["status"])
+    # Выступления закончились — таймер раунда останавливается
+    if rnd.timer_started_at is not None:
+        _pause_timer(rnd)
+    rnd.save(update_fields=["status", "timer_remaining_ms", "timer_started_at"])
 
     event.voting_open = True
     event.state = DebattleEvent.State.VOTING_OPEN
     event.save(update_fields=["voting_open", "state"])
+    # Бюллетень зрителей открывается только если переход закоммичен
+    transaction.on_commit(lambda: audience.open_ballot(event, rnd))
+
+    commit_state_change(event, "open_voting", {
+        "state": event.state,
+        "voting_open": True,
+        "match": match_payload(rnd.match),
+        "round": round_payload(rnd),
+        "timer": timer_payload(rnd),
+    })
 
 
 @transaction.atomic
@@ -174,8 +288,26 @@ def close_voting(event: DebattleEvent) -> None:
     rnd = Round.objects.select_for_update().get(match=event.current_match, number=event.current_round_number)
     rnd.status = Round.Status.LOCKED
     rnd.ended_at = timezone.now()
-    rnd.save(update_fields=["status", "ended_at"])
+    # Голосование зрителей закрывается в этой же транзакции: остаток голосов и итог раунда
+    audience.close_ballot(event, rnd)
+    rnd.save(update_fields=["status", "ended_at", "audience_a", "audience_b"])
 
     event.voting_open = False
     event.state = DebattleEvent.State.RESULTS
-    event.save(update_fields=["voting_open", "state"])
\ No newline at end of file
+    event.save(update_fields=["voting_open", "state"])
+
+    results = compute_match_results(rnd.match)
+    delta = {
+        "state": event.state,
+        "voting_open": False,
+        "match": match_payload(rnd.match),
+        "round": round_payload(rnd),
+        "results": results_payload(results),
+        "audience": audience_payload(rnd),
+    }
+    # Закрыт последний раунд — победитель матча и строки таблицы его команд
+    if rnd.number == ROUNDS_PER_MATCH:
+        resolve_match(event, rnd.match, results)
+        delta["standings"] = standings_payload(event.id, SCREEN_STANDINGS)
+
+    commit_state_change(event, "close_voting", delta)
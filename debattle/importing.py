@@ -0,0 +1,224 @@
+import csv
+import io
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from accounts.models import JuryMember
+
+from .models import DebattleEvent, Participant, Team, Tour, TourTeam
+from .realtime import commit_state_change
+from .scheduling import generate_schedule
+from .services import TOUR_SIZE
+
+# Массовый импорт команд (с участниками) и жюри из CSV. Файл проверяется целиком до первой
+# записи; команды раскладываются по турам тем же правилом, что и регистрация (добор открытых
+# туров по номеру, 4-я команда закрывает тур), и пишутся bulk_create несколькими транзакциями.
+#
+# Команды: team,participant_1,participant_2[,bio_1,bio_2]
+# Жюри:    username[,display_name,email,password]
+
+TEAM_COLUMNS = ("team", "participant_1", "participant_2")
+JURY_COLUMNS = ("username",)
+BATCH_SIZE = 1000
+# Сколько ошибок файла показываем — остальные всё равно придётся исправлять по одной
+MAX_ERRORS = 20
+
+NAME_MAX_LENGTH = 120
+USERNAME_MAX_LENGTH = 150
+
+
+class ImportFileError(ValueError):
+    def __init__(self, errors: list[str]):
+        self.errors = errors
+        shown = errors[:MAX_ERRORS]
+        if len(errors) > MAX_ERRORS:
+            shown.append(f"... и ещё ошибок: {len(errors) - MAX_ERRORS}")
+        super().__init__("\n".join(shown))
+
+
+def _read_rows(text: str, required: tuple[str, ...], label: str, errors: list[str]) -> list[tuple[int, dict]]:
+    # Разделитель — запятая или точка с запятой (так сохраняет CSV русский Excel); BOM срезаем
+    text = text.lstrip("﻿")
+    header = text.split("\n", 1)[0]
+    delimiter = ";" if header.count(";") > header.count(",") else ","
+    reader = csv.DictReader(io.StringIO(text), delimiter=delimiter)
+
+    columns = [name.strip() for name in reader.fieldnames or ()]
+    missing = [name for name in required if name not in columns]
+    if missing:
+        errors.append(f"{label}: нет колонок {', '.join(missing)}")
+        return []
+    reader.fieldnames = columns
+
+    rows = []
+    for row in reader:
+        cleaned = {key: (value or "").strip() for key, value in row.items() if key is not None}
+        if any(cleaned.values()):
+            rows.append((reader.line_num, cleaned))
+    return rows
+
+
+def _check_name(value: str, what: str, where: str, errors: list[str]) -> None:
+    if not value:
+        errors.append(f"{where}: пустое поле «{what}»")
+    elif len(value) > NAME_MAX_LENGTH:
+        errors.append(f"{where}: «{what}» длиннее {NAME_MAX_LENGTH} символов")
+
+
+def parse_teams(event: DebattleEvent, text: str, errors: list[str]) -> list[tuple[str, list[tuple[str, str]]]]:
+    # [(имя команды, [(участник, биография), (участник, биография)]), ...]
+    existing = set(Team.objects.filter(event=event).values_list("name", flat=True))
+    seen = set()
+    teams = []
+    for line, row in _read_rows(text, TEAM_COLUMNS, "Команды", errors):
+        where = f"Команды, строка {line}"
+        name = row["team"]
+        _check_name(name, "team", where, errors)
+        if name in existing:
+            errors.append(f"{where}: команда «{name}» уже есть в мероприятии")
+        elif name in seen:
+            errors.append(f"{where}: команда «{name}» повторяется в файле")
+        seen.add(name)
+
+        # Как и в регистрации — строго 2 участника
+        participants = []
+        for n in (1, 2):
+            member = row[f"participant_{n}"]
+            _check_name(member, f"participant_{n}", where, errors)
+            participants.append((member, row.get(f"bio_{n}", "")))
+        teams.append((name, participants))
+    return teams
+
+
+def parse_jury(event: DebattleEvent, text: str, errors: list[str]) -> list[dict]:
+    rows = _read_rows(text, JURY_COLUMNS, "Жюри", errors)
+    usernames = [row["username"] for _line, row in rows]
+    # Уже существующий пользователь без роли жюри просто становится судьёй этого мероприятия
+    users = {user.username: user for user in User.objects.filter(username__in=usernames)}
+    taken = set(JuryMember.objects.filter(user__username__in=usernames).values_list("user__username", flat=True))
+
+    seen = set()
+    jurors = []
+    for line, row in rows:
+        where = f"Жюри, строка {line}"
+        username = row["username"]
+        if not username:
+            errors.append(f"{where}: пустое поле «username»")
+        elif len(username) > USERNAME_MAX_LENGTH:
+            errors.append(f"{where}: «username» длиннее {USERNAME_MAX_LENGTH} символов")
+        elif username in taken:
+            errors.append(f"{where}: пользователь «{username}» уже в жюри")
+        elif username in seen:
+            errors.append(f"{where}: пользователь «{username}» повторяется в файле")
+        seen.add(username)
+        if len(row.get("display_name", "")) > NAME_MAX_LENGTH:
+            errors.append(f"{where}: «display_name» длиннее {NAME_MAX_LENGTH} символов")
+
+        jurors.append({
+            "username": username,
+            "user": users.get(username),
+            "display_name": row.get("display_name", ""),
+            "email": row.get("email", ""),
+            "password": row.get("password", ""),
+        })
+    return jurors
+
+
+@transaction.atomic
+def _create_teams(event: DebattleEvent, teams: list) -> int:
+    # Блокируем мероприятие: параллельная регистрация ждёт, пока импорт не разложит команды,
+    # и не займёт те же места в открытых турах (на SQLite то же даёт IMMEDIATE-транзакция)
+    DebattleEvent.objects.select_for_update().filter(pk=event.pk).exists()
+
+    created = Team.objects.bulk_create([Team(event=event, name=name) for name, _members in teams], batch_size=BATCH_SIZE)
+    Participant.objects.bulk_create(
+        [
+            Participant(team=team, name=member, bio=bio)
+            for team, (_name, members) in zip(created, teams)
+            for member, bio in members
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+    # Сначала добираем открытые туры по номеру — как _claim_slot, затем открываем новые
+    slots = []
+    open_tours = list(
+        Tour.objects.select_for_update().filter(event=event, status=Tour.Status.OPEN, team_count__lt=TOUR_SIZE)
+        .order_by("number")
+    )
+    for tour in open_tours:
+        free = min(TOUR_SIZE - tour.team_count, len(created) - len(slots))
+        slots.extend([tour] * free)
+        tour.team_count += free
+
+    last_number = Tour.objects.filter(event=event).order_by("-number").values_list("number", flat=True).first() or 0
+    rest = len(created) - len(slots)
+    new_tours = [
+        Tour(event=event, number=last_number + n + 1, team_count=min(TOUR_SIZE, rest - n * TOUR_SIZE))
+        for n in range((rest + TOUR_SIZE - 1) // TOUR_SIZE)
+    ]
+    for tour in open_tours + new_tours:
+        tour.status = Tour.Status.CLOSED if tour.team_count == TOUR_SIZE else Tour.Status.OPEN
+
+    Tour.objects.bulk_update(open_tours, ["team_count", "status"])
+    Tour.objects.bulk_create(new_tours, batch_size=BATCH_SIZE)
+    for tour in new_tours:
+        slots.extend([tour] * tour.team_count)
+
+    TourTeam.objects.bulk_create(
+        [TourTeam(tour=tour, team=team) for tour, team in zip(slots, created)], batch_size=BATCH_SIZE
+    )
+    return len(new_tours)
+
+
+@transaction.atomic
+def _create_jury(event: DebattleEvent, jurors: list[dict]) -> None:
+    new_users = [
+        User(
+            username=juror["username"],
+            email=juror["email"],
+            # Без пароля в файле вход закрыт, пока пароль не задали в админке
+            password=make_password(juror["password"] or None),
+        )
+        for juror in jurors
+        if juror["user"] is None
+    ]
+    users = {user.username: user for user in User.objects.bulk_create(new_users, batch_size=BATCH_SIZE)}
+    JuryMember.objects.bulk_create(
+        [
+            JuryMember(
+                user=juror["user"] or users[juror["username"]], event=event, display_name=juror["display_name"]
+            )
+            for juror in jurors
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+
+def import_event(event: DebattleEvent, teams_csv: str = "", jury_csv: str = "") -> dict:
+    # Возвращает счётчики импорта; при любой ошибке в файлах — ImportFileError и ни одной записи.
+    # Набранные туры сразу печатаются (generate_schedule); если тем не хватает, они останутся
+    # незапечатанными до планирования с пульта, как и при обычной регистрации
+    errors = []
+    teams = parse_teams(event, teams_csv, errors) if teams_csv else []
+    jurors = parse_jury(event, jury_csv, errors) if jury_csv else []
+    if errors:
+        raise ImportFileError(errors)
+
+    result = {"teams": len(teams), "jury": len(jurors), "tours": 0, "matches": 0, "warning": ""}
+    if teams:
+        result["tours"] = _create_teams(event, teams)
+    if jurors:
+        _create_jury(event, jurors)
+    if teams:
+        try:
+            result["matches"] = generate_schedule(event)
+        except ValueError as e:
+            result["warning"] = f"Туры не запечатаны: {e}"
+
+    # Команды, туры и жюри изменились разом — экраны и пульт перечитывают мероприятие
+    if teams or jurors:
+        commit_state_change(event, "config", {})
+    return result
@@ -0,0 +1,168 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError
+from django.utils import timezone
+
+from accounts.models import ScoreCriterion
+from debattle import audience, game_flow
+from debattle.bench import BenchClient, Recorder, free_port, git_revision, start_asgi_server, stop_asgi_server
+from debattle.models import AudienceVote, DebattleEvent, Match, Participant, Team, Theme, Tour, TourTeam
+
+# Сколько ждать, пока сборщик сервера запишет все голоса, с
+FLUSH_WAIT = 10
+
+
+class Command(BaseCommand):
+    help = (
+        "Пропускная способность голосования зрителей: голоса в секунду на ядре приёма "
+        "(audience.cast_vote в процессе) и через HTTP (POST vote/cast/ на поднятом ASGI-сервере, "
+        "у каждого зрителя своя cookie со страницы голосования). Проверяет, что все принятые "
+        "голоса записаны. Пишет результат в benchmarks/ и сравнивает с прошлым прогоном. "
+        "Нужна созданная БД (manage.py migrate --run-syncdb)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--votes", type=int, default=200_000, help="голосов на ядро приёма")
+        parser.add_argument("--http-voters", type=int, default=2000, help="зрителей через HTTP")
+        parser.add_argument("--concurrency", type=int, default=32, help="параллельных HTTP-клиентов")
+        parser.add_argument("--output", help="каталог результатов (по умолчанию BASE_DIR/benchmarks)")
+        parser.add_argument("--keep", action="store_true", help="не удалять данные прогона")
+
+    def handle(self, *args, **options):
+        try:
+            event = self._setup()
+        except OperationalError as e:
+            raise CommandError(f"БД не готова ({e}). Выполни manage.py migrate --run-syncdb.")
+
+        match = event.current_match
+        teams = (match.team_a_id, match.team_b_id)
+        # HTTP первым: иначе сервер при первом голосе поднимает из БД всех зрителей ядра
+        results = {"http": self._http(event, teams, options["http_voters"], options["concurrency"])}
+        results["core"] = self._core(event, teams, options["votes"])
+        stored = AudienceVote.objects.filter(round__match=match).count()
+        expected = options["votes"] + options["http_voters"]
+        if stored != expected:
+            self.stderr.write(self.style.WARNING(f"Записано голосов {stored} из {expected}."))
+
+        for label, row in results.items():
+            self.stdout.write(f"{label:<6}" + "  ".join(f"{key}={value}" for key, value in row.items()))
+
+        commit, dirty = git_revision()
+        result = {
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": timezone.now().isoformat(),
+            "config": {k: options[k] for k in ("votes", "http_voters", "concurrency")},
+            "stored": stored,
+            "results": results,
+        }
+        self._save(result, Path(options["output"]) if options["output"] else settings.BASE_DIR / "benchmarks")
+
+        if not options["keep"]:
+            Match.objects.filter(tour__event=event).delete()
+            event.delete()
+
+    def _setup(self):
+        # Один тур из 4 команд, первый раунд с открытым голосованием
+        suffix = timezone.now().strftime("%Y%m%d%H%M%S%f")
+        event = DebattleEvent.objects.create(
+            title=f"Зрители {suffix}", slug=f"bench-audience-{suffix}", start_at=timezone.now()
+        )
+        Theme.objects.bulk_create(Theme(event=event, order=i, title=f"Тема {i}") for i in range(1, 10))
+        ScoreCriterion.objects.bulk_create(
+            ScoreCriterion(event=event, title=f"Критерий {i}", max_value=3) for i in range(1, 6)
+        )
+        tour = Tour.objects.create(event=event, number=1, status=Tour.Status.CLOSED, team_count=4)
+        teams = Team.objects.bulk_create(Team(event=event, name=f"Команда {i}") for i in range(4))
+        TourTeam.objects.bulk_create(TourTeam(tour=tour, team=team) for team in teams)
+        Participant.objects.bulk_create(
+            Participant(team=team, name=f"{team.name} / {k}") for team in teams for k in (1, 2)
+        )
+
+        game_flow.start_roulette(event)
+        game_flow.start_next_round(DebattleEvent.objects.get(pk=event.pk))
+        # Вне транзакции on_commit срабатывает сразу — бюллетень открыт в этом процессе
+        game_flow.open_voting(DebattleEvent.objects.get(pk=event.pk))
+        return DebattleEvent.objects.select_related("current_match").get(pk=event.pk)
+
+    def _core(self, event, teams: tuple, votes: int) -> dict:
+        # Ядро приёма без HTTP: дедупликация, счётчики и очередь записи; сборщик пишет параллельно.
+        # Бюллетень этого процесса поднимается из БД вместе с голосами HTTP-фазы
+        started = time.perf_counter()
+        for i in range(votes):
+            audience.cast_vote(event.slug, f"core-{i}", teams[i % 2])
+        elapsed = time.perf_counter() - started
+
+        flush_started = time.perf_counter()
+        while audience.flush():
+            pass
+        return {
+            "votes": votes,
+            "votes_per_s": round(votes / elapsed),
+            "final_flush_s": round(time.perf_counter() - flush_started, 2),
+        }
+
+    def _http(self, event, teams: tuple, voters: int, concurrency: int) -> dict:
+        # Сервер открывает бюллетень при первом голосе; cookie и CSRF — со страницы
+        # голосования заранее, замеряются только POST голоса
+        votes = AudienceVote.objects.filter(round__match_id=event.current_match_id)
+        expected = votes.count() + voters
+        recorder = Recorder()
+        port = free_port()
+        server = start_asgi_server(port)
+        page = f"/debattle/{event.slug}/vote/"
+        cast = f"/debattle/{event.slug}/vote/cast/"
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                clients = [BenchClient(port, recorder) for _ in range(voters)]
+                list(pool.map(lambda client: client.request("vote:page", "GET", page), clients))
+
+                def vote(i):
+                    status, _body, _headers = clients[i].request(
+                        "vote:cast", "POST", cast, data={"team_id": teams[i % 2]}
+                    )
+                    clients[i].close()
+                    return status
+
+                started = time.perf_counter()
+                statuses = list(pool.map(vote, range(voters)))
+                elapsed = time.perf_counter() - started
+
+            deadline = time.monotonic() + FLUSH_WAIT
+            while time.monotonic() < deadline and votes.count() < expected:
+                time.sleep(0.2)
+        finally:
+            stop_asgi_server(server)
+
+        row = recorder.summary(elapsed)["vote:cast"]
+        return {
+            "votes": voters,
+            "errors": sum(status != 200 for status in statuses),
+            "votes_per_s": round(voters / elapsed),
+            "p50_ms": row["p50_ms"],
+            "p99_ms": row["p99_ms"],
+        }
+
+    def _save(self, result: dict, output_dir: Path) -> None:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        previous = sorted(output_dir.glob("audience-*.json"))
+
+        stamp = timezone.now().strftime("%Y%m%d-%H%M%S")
+        path = output_dir / f"audience-{stamp}-{result['commit']}.json"
+        path.write_text(json.dumps(result, ensure_ascii=False, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Результаты: {path}"))
+
+        if not previous:
+            return
+
+        baseline = json.loads(previous[-1].read_text())
+        self.stdout.write(f"Сравнение с {previous[-1].name} (коммит {baseline.get('commit')}):")
+        for label, row in result["results"].items():
+            before = baseline.get("results", {}).get(label)
+            if before:
+                self.stdout.write(f"  {label:<6} голосов/с {before['votes_per_s']} → {row['votes_per_s']}")
@@ -0,0 +1,308 @@
+import json
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.utils import timezone
+
+from accounts.models import JuryMember, ScoreCriterion
+from config.databases import DB_PROFILES, build_databases
+from debattle.bench import (
+    BenchClient, Recorder, free_port, git_revision, session_cookies, start_asgi_server, stop_asgi_server,
+)
+from debattle.models import DebattleEvent, Match, Team, Theme
+
+MATCHES_PER_TOUR = 2
+ROUNDS_PER_MATCH = 3
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный прогон живого мероприятия: поднимает ASGI-сервер, регистрирует команды, "
+        "опрашивает экраны, ведёт пульт через все переходы и ставит оценки жюри. "
+        "Пишет p50/p95/p99, RPS и число SQL-запросов в benchmarks/ и сравнивает с прошлым прогоном. "
+        "Нужна созданная БД (миграции не хранятся в репозитории: manage.py migrate --run-syncdb)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--teams", type=int, default=32, help="сколько команд регистрировать")
+        parser.add_argument("--registration-concurrency", type=int, default=16)
+        parser.add_argument("--screens", type=int, default=20, help="сколько экранов опрашивают screen_view")
+        parser.add_argument("--poll-interval", type=float, default=0.5, help="пауза экрана между опросами, с")
+        parser.add_argument("--jurors", type=int, default=5)
+        parser.add_argument("--matches", type=int, default=2, help="сколько матчей провести")
+        parser.add_argument("--output", help="каталог результатов (по умолчанию BASE_DIR/benchmarks)")
+        parser.add_argument("--keep", action="store_true", help="не удалять данные прогона")
+        parser.add_argument(
+            "--db-profile", action="append", choices=DB_PROFILES,
+            help="профиль БД сервера (можно повторять — прогон для каждого и сравнение)",
+        )
+
+    def handle(self, *args, **options):
+        tours_needed = math.ceil(options["matches"] / MATCHES_PER_TOUR)
+        if options["teams"] < tours_needed * 4:
+            raise CommandError(f"Для {options['matches']} матчей нужно минимум {tours_needed * 4} команд.")
+
+        profiles = options["db_profile"] or [settings.DEBATTLE_DB_PROFILE]
+        default_db = settings.DATABASES["default"]
+        for profile in profiles:
+            try:
+                profile_db = build_databases(profile, settings.BASE_DIR)["default"]
+            except ValueError as e:
+                raise CommandError(str(e))
+            # Сервер и команда должны работать с одной и той же БД: данные прогона готовит команда
+            if (profile_db["ENGINE"], str(profile_db["NAME"])) != (default_db["ENGINE"], str(default_db["NAME"])):
+                raise CommandError(
+                    f"Профиль {profile} смотрит в другую БД. Запусти команду с DEBATTLE_DB_PROFILE={profile}."
+                )
+
+        runs = {profile: self._run(profile, options) for profile in profiles}
+
+        if len(runs) > 1:
+            self.stdout.write("Сравнение профилей БД:")
+            self.stdout.write(f"{'профиль':<18}{'RPS':>8}{'set_score p95':>15}{'screen p95':>12}")
+            for profile, result in runs.items():
+                rps = sum(row["rps"] for row in result["results"].values())
+                set_score = result["results"].get("jury:set_score", {}).get("p95_ms", 0)
+                screen = result["results"].get("screen:get", {}).get("p95_ms", 0)
+                self.stdout.write(f"{profile:<18}{rps:>8.1f}{set_score:>15.1f}{screen:>12.1f}")
+
+    def _run(self, profile: str, options) -> dict:
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Профиль БД: {profile}"))
+        try:
+            event, operator, jurors = self._setup(options["jurors"])
+        except OperationalError as e:
+            raise CommandError(f"БД не готова ({e}). Выполни manage.py migrate --run-syncdb.")
+
+        # Режим журнала SQLite хранится в самом файле, а сменить его можно только без других
+        # соединений: выполняем init_command профиля здесь, до старта сервера
+        init_command = build_databases(profile, settings.BASE_DIR)["default"].get("OPTIONS", {}).get("init_command", "")
+        with connection.cursor() as cursor:
+            for statement in filter(None, (s.strip() for s in init_command.split(";"))):
+                cursor.execute(statement)
+
+        recorder = Recorder()
+        port = free_port()
+        server = start_asgi_server(port, {"DEBATTLE_DB_PROFILE": profile})
+        started = time.perf_counter()
+        phases = {}
+
+        try:
+            phase_started = time.perf_counter()
+            self._registration_storm(event, port, recorder, options["teams"], options["registration_concurrency"])
+            phases["registration_s"] = round(time.perf_counter() - phase_started, 2)
+
+            stop = threading.Event()
+            pollers = [
+                threading.Thread(target=self._poll_screen, args=(event, port, recorder, stop, options["poll_interval"]))
+                for _ in range(options["screens"])
+            ]
+            for t in pollers:
+                t.start()
+
+            phase_started = time.perf_counter()
+            try:
+                self._drive_event(event, port, recorder, operator, jurors, options["matches"])
+            finally:
+                stop.set()
+                for t in pollers:
+                    t.join()
+            phases["live_s"] = round(time.perf_counter() - phase_started, 2)
+        finally:
+            stop_asgi_server(server)
+
+        wall = time.perf_counter() - started
+        summary = recorder.summary(wall)
+        self._report(summary)
+
+        commit, dirty = git_revision()
+
+        result = {
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": timezone.now().isoformat(),
+            "db_profile": profile,
+            "config": {k: options[k] for k in (
+                "teams", "registration_concurrency", "screens", "poll_interval", "jurors", "matches",
+            )},
+            "wall_s": round(wall, 2),
+            "phases": phases,
+            "results": summary,
+        }
+        self._save(result, Path(options["output"]) if options["output"] else settings.BASE_DIR / "benchmarks")
+
+        if not options["keep"]:
+            self._cleanup(event, operator, jurors)
+        return result
+
+    def _setup(self, jurors_count: int):
+        suffix = timezone.now().strftime("%Y%m%d%H%M%S%f")
+        slug = f"bench-{suffix}"
+        event = DebattleEvent.objects.create(title=f"Бенчмарк {suffix}", slug=slug, start_at=timezone.now())
+        Theme.objects.bulk_create(Theme(event=event, order=i, title=f"Тема {i}") for i in range(1, 10))
+        ScoreCriterion.objects.bulk_create(
+            ScoreCriterion(event=event, title=f"Критерий {i}", max_value=3) for i in range(1, 6)
+        )
+
+        operator = User.objects.create_user(f"{slug}-operator", is_staff=True)
+        jurors = []
+        for i in range(jurors_count):
+            user = User.objects.create_user(f"{slug}-jury-{i}")
+            JuryMember.objects.create(user=user, event=event, display_name=f"Судья {i}")
+            jurors.append(user)
+        return event, operator, jurors
+
+    def _registration_storm(self, event, port, recorder, teams: int, concurrency: int) -> None:
+        path = f"/debattle/{event.slug}/register/"
+
+        def register(i):
+            client = BenchClient(port, recorder)
+            _status, html, _headers = client.request("register:get", "GET", path)
+            client.request("register:post", "POST", path, data={
+                "csrfmiddlewaretoken": client.csrf_token(html),
+                "name": f"Команда {i}",
+                "form-TOTAL_FORMS": "2",
+                "form-INITIAL_FORMS": "0",
+                "form-MIN_NUM_FORMS": "0",
+                "form-MAX_NUM_FORMS": "2",
+                "form-0-name": f"Участник {i}-1",
+                "form-1-name": f"Участник {i}-2",
+            })
+            client.close()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(register, range(teams)))
+
+        registered = Team.objects.filter(event=event).count()
+        if registered != teams:
+            self.stderr.write(self.style.WARNING(f"Зарегистрировано {registered} из {teams} команд."))
+
+    def _poll_screen(self, event, port, recorder, stop, interval: float) -> None:
+        client = BenchClient(port, recorder)
+        etag = None
+        while not stop.is_set():
+            client.request("screen:get", "GET", f"/debattle/{event.slug}/screen/")
+            headers = {"If-None-Match": etag} if etag else {}
+            _status, _body, response_headers = client.request(
+                "screen:state_json", "GET", f"/debattle/{event.slug}/state.json", headers=headers,
+            )
+            etag = response_headers.get("ETag", etag)
+            stop.wait(interval)
+        client.close()
+
+    def _drive_event(self, event, port, recorder, operator, jurors, matches: int) -> None:
+        operator_client = BenchClient(port, recorder, session_cookies(operator))
+        juror_clients = [BenchClient(port, recorder, session_cookies(user)) for user in jurors]
+        control = f"/debattle/{event.slug}/control/"
+        jury = f"/debattle/{event.slug}/jury/"
+
+        def operate(action, **extra):
+            _status, html, _headers = operator_client.request("control:get", "GET", control)
+            operator_client.request(f"control:{action}", "POST", control, data={
+                "csrfmiddlewaretoken": operator_client.csrf_token(html), "action": action,
+                "control_version": operator_client.control_version(html), **extra,
+            })
+
+        def score(client, cells, submit):
+            _status, html, _headers = client.request("jury:get", "GET", jury)
+            token = client.csrf_token(html)
+            for team_id, criterion_id, value in cells:
+                client.request("jury:set_score", "POST", jury, data={
+                    "csrfmiddlewaretoken": token, "action": "set_score",
+                    "team_id": team_id, "criterion_id": criterion_id, "value": value,
+                })
+            if submit:
+                client.request("jury:submit_final", "POST", jury, data={
+                    "csrfmiddlewaretoken": token, "action": "submit_final",
+                })
+
+        operate("reveal_themes")
+        tour_ids = list(event.tours.order_by("number").values_list("id", flat=True))
+        criterion_ids = list(event.criteria.order_by("id").values_list("id", flat=True))
+
+        with ThreadPoolExecutor(max_workers=max(1, len(juror_clients))) as pool:
+            for i in range(matches):
+                if i and i % MATCHES_PER_TOUR == 0:
+                    operate("set_tour", tour_id=tour_ids[i // MATCHES_PER_TOUR])
+                operate("start_roulette")
+
+                # Матчи запечатанных туров созданы заранее — текущий берём из указателя мероприятия
+                event.refresh_from_db(fields=["current_match"])
+                match = event.current_match
+                if match is None:
+                    raise CommandError("Рулетка не создала матч — см. ошибки control:start_roulette.")
+
+                for number in range(1, ROUNDS_PER_MATCH + 1):
+                    operate("start_round")
+                    operate("open_voting")
+                    # Все судьи голосуют одновременно; у каждого — своя раскладка оценок
+                    cells = [
+                        [(team_id, criterion_id, (j + number + k) % 3 + 1)
+                         for k, (team_id, criterion_id) in enumerate(
+                             (t, c) for t in (match.team_a_id, match.team_b_id) for c in criterion_ids)]
+                        for j in range(len(juror_clients))
+                    ]
+                    list(pool.map(score, juror_clients, cells, [number == ROUNDS_PER_MATCH] * len(juror_clients)))
+                    operate("close_voting")
+
+                # Пульт сообщает об ошибках через messages с редиректом 302 — проверяем итог по БД
+                event.refresh_from_db(fields=["state"])
+                submitted = match.jury_submissions.filter(is_submitted=True).count()
+                if event.state != DebattleEvent.State.RESULTS or submitted != len(juror_clients):
+                    raise CommandError(
+                        f"Матч {i + 1} не дошёл до результатов: state={event.state}, итогов {submitted}."
+                    )
+
+        operator_client.close()
+        for client in juror_clients:
+            client.close()
+
+    def _report(self, summary: dict) -> None:
+        self.stdout.write(
+            f"{'запрос':<22}{'n':>7}{'ошибок':>8}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'RPS':>8}{'SQL':>7}"
+        )
+        for label, row in summary.items():
+            queries = "-" if row["queries_per_request"] is None else f"{row['queries_per_request']:.1f}"
+            self.stdout.write(
+                f"{label:<22}{row['count']:>7}{row['errors']:>8}{row['p50_ms']:>10.1f}"
+                f"{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['rps']:>8.1f}{queries:>7}"
+            )
+
+    def _save(self, result: dict, output_dir: Path) -> None:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        # Сравниваем только с прогонами того же профиля БД
+        previous = sorted(output_dir.glob(f"bench-*-{result['db_profile']}.json"))
+
+        stamp = timezone.now().strftime("%Y%m%d-%H%M%S")
+        path = output_dir / f"bench-{stamp}-{result['commit']}-{result['db_profile']}.json"
+        path.write_text(json.dumps(result, ensure_ascii=False, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Результаты: {path}"))
+
+        if not previous:
+            return
+
+        # Сравнение с последним прогоном: p95 и SQL на запрос по каждой метке
+        baseline = json.loads(previous[-1].read_text())
+        self.stdout.write(f"Сравнение с {previous[-1].name} (коммит {baseline.get('commit')}):")
+        for label, row in result["results"].items():
+            before = baseline.get("results", {}).get(label)
+            if not before:
+                continue
+            delta = row["p95_ms"] - before["p95_ms"]
+            line = f"  {label:<22} p95 {before['p95_ms']:.1f} → {row['p95_ms']:.1f} мс ({delta:+.1f})"
+            if before.get("queries_per_request") is not None and row["queries_per_request"] is not None:
+                line += f", SQL {before['queries_per_request']} → {row['queries_per_request']}"
+            self.stdout.write(line)
+
+    def _cleanup(self, event, operator, jurors) -> None:
+        # Match.team_a/team_b — PROTECT, поэтому матчи удаляем до команд
+        Match.objects.filter(tour__event=event).delete()
+        event.delete()
+        User.objects.filter(pk__in=[operator.pk, *(u.pk for u in jurors)]).delete()
+
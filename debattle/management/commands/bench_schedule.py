@@ -0,0 +1,85 @@
+import json
+import statistics
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from debattle.bench import git_revision
+from debattle.models import DebattleEvent, Match, Team, Theme, Tour, TourTeam
+from debattle.scheduling import generate_schedule
+
+
+class Command(BaseCommand):
+    help = (
+        "Бенчмарк generate_schedule: мероприятие с --teams командами в турах по 4, "
+        "--repeat прогонов планирования. Падает, если медиана дольше --budget-ms."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--teams", type=int, default=10_000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--budget-ms", type=float, default=1000)
+        parser.add_argument("--output", help="каталог результатов (по умолчанию BASE_DIR/benchmarks)")
+
+    def handle(self, *args, teams, repeat, budget_ms, output=None, **options):
+        started = time.perf_counter()
+        event = self._setup(teams)
+        setup_s = time.perf_counter() - started
+
+        timings = []
+        try:
+            for _ in range(repeat):
+                Match.objects.filter(tour__event=event).delete()
+                Tour.objects.filter(event=event).update(draw_seed=None)
+                with CaptureQueriesContext(connection) as queries:
+                    t0 = time.perf_counter()
+                    created = generate_schedule(event, seed=len(timings))
+                    timings.append((time.perf_counter() - t0) * 1000)
+        finally:
+            Match.objects.filter(tour__event=event).delete()
+            event.delete()
+
+        median = statistics.median(timings)
+        self.stdout.write(
+            f"команд {teams}, матчей {created}, запросов {len(queries)}: "
+            f"медиана {median:.1f} мс, минимум {min(timings):.1f} мс (подготовка данных {setup_s:.1f} с)"
+        )
+
+        commit, dirty = git_revision()
+        output_dir = Path(output) if output else settings.BASE_DIR / "benchmarks"
+        output_dir.mkdir(parents=True, exist_ok=True)
+        path = output_dir / f"schedule-{timezone.now():%Y%m%d-%H%M%S}-{commit}.json"
+        path.write_text(json.dumps({
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": timezone.now().isoformat(),
+            "db_profile": settings.DEBATTLE_DB_PROFILE,
+            "config": {"teams": teams, "repeat": repeat},
+            "matches": created,
+            "queries": len(queries),
+            "median_ms": round(median, 2),
+            "min_ms": round(min(timings), 2),
+        }, ensure_ascii=False, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Результаты: {path}"))
+
+        if median > budget_ms:
+            raise CommandError(f"Медиана {median:.1f} мс дольше бюджета {budget_ms:.0f} мс")
+
+    @transaction.atomic
+    def _setup(self, teams_count: int) -> DebattleEvent:
+        slug = f"bench-schedule-{timezone.now():%Y%m%d%H%M%S%f}"
+        event = DebattleEvent.objects.create(title=slug, slug=slug, start_at=timezone.now())
+        Theme.objects.bulk_create(Theme(event=event, order=i, title=f"Тема {i}") for i in range(1, 10))
+
+        tours = Tour.objects.bulk_create(
+            Tour(event=event, number=n + 1, status=Tour.Status.CLOSED, team_count=4)
+            for n in range((teams_count + 3) // 4)
+        )
+        teams = Team.objects.bulk_create(Team(event=event, name=f"Команда {i}") for i in range(teams_count))
+        TourTeam.objects.bulk_create(TourTeam(tour=tours[i // 4], team=team) for i, team in enumerate(teams))
+        return event
@@ -0,0 +1,288 @@
+import asyncio
+import json
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError
+from django.utils import timezone
+
+from accounts.models import ScoreCriterion
+from debattle import game_flow
+from debattle.bench import (
+    BenchClient, Recorder, afetch, free_port, git_revision, percentile, server_threads, session_cookies,
+    start_asgi_server, stop_asgi_server,
+)
+from debattle.models import DebattleEvent, Match, Participant, Team, Theme, Tour, TourTeam
+
+MODES = ("poll", "longpoll")
+# Клиенты подключаются пачками: очередь accept у сервера небольшая
+CONNECT_BATCH = 100
+# Пауза после подключения экранов перед замером простоя, с
+SETTLE = 2
+# Ожидание разбора очереди сервера между фазами: до стольких потоков сверх простоя, не дольше, с
+DRAIN_SLACK = 10
+DRAIN_TIMEOUT = 120
+# Сколько ждать, пока все экраны увидят переход
+PROPAGATION_TIMEOUT = 30
+
+
+class Command(BaseCommand):
+    help = (
+        "Предел одновременных экранов: поднимает ASGI-сервер и для каждого числа экранов меряет "
+        "screen_view под одновременной нагрузкой и простой экранов между переходами — опросом "
+        "state.json (poll) или длинным опросом state/wait (longpoll): латентность пробного запроса, "
+        "пик потоков сервера и время, за которое все экраны увидели переход. "
+        "Пишет результат в benchmarks/ и сравнивает с прошлым прогоном. "
+        "Нужна созданная БД (manage.py migrate --run-syncdb)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--screens", type=int, nargs="+", default=[100, 1000], help="числа экранов")
+        parser.add_argument("--mode", action="append", choices=MODES, help="режим простоя (по умолчанию оба)")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="пауза опроса state.json, с")
+        parser.add_argument("--duration", type=float, default=5.0, help="длительность каждой фазы, с")
+        parser.add_argument("--output", help="каталог результатов (по умолчанию BASE_DIR/benchmarks)")
+        parser.add_argument("--keep", action="store_true", help="не удалять данные прогона")
+
+    def handle(self, *args, **options):
+        try:
+            event, operator = self._setup()
+        except OperationalError as e:
+            raise CommandError(f"БД не готова ({e}). Выполни manage.py migrate --run-syncdb.")
+
+        modes = options["mode"] or list(MODES)
+        port = free_port()
+        server = start_asgi_server(port)
+        operator_client = BenchClient(port, Recorder(), session_cookies(operator))
+        results = {}
+        try:
+            idle_threads = server_threads(server.pid)
+            for screens in options["screens"]:
+                results[f"screen_get@{screens}"] = asyncio.run(
+                    self._screen_storm(port, server.pid, event.slug, screens, options["duration"])
+                )
+                for mode in modes:
+                    self._drain(server.pid, idle_threads)
+                    results[f"{mode}@{screens}"] = asyncio.run(self._idle_screens(
+                        port, server.pid, event, operator_client, mode, screens,
+                        options["duration"], options["poll_interval"],
+                    ))
+                self._drain(server.pid, idle_threads)
+        finally:
+            operator_client.close()
+            stop_asgi_server(server)
+
+        self._report(results)
+        commit, dirty = git_revision()
+        result = {
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": timezone.now().isoformat(),
+            "config": {k: options[k] for k in ("screens", "poll_interval", "duration")},
+            "results": results,
+        }
+        self._save(result, Path(options["output"]) if options["output"] else settings.BASE_DIR / "benchmarks")
+
+        if not options["keep"]:
+            Match.objects.filter(tour__event=event).delete()
+            event.delete()
+            operator.delete()
+
+    def _setup(self):
+        # Один тур из 4 команд и идущий раунд: переходы прогона — пауза и пуск таймера
+        suffix = timezone.now().strftime("%Y%m%d%H%M%S%f")
+        slug = f"bench-screens-{suffix}"
+        event = DebattleEvent.objects.create(title=f"Экраны {suffix}", slug=slug, start_at=timezone.now())
+        Theme.objects.bulk_create(Theme(event=event, order=i, title=f"Тема {i}") for i in range(1, 10))
+        ScoreCriterion.objects.bulk_create(
+            ScoreCriterion(event=event, title=f"Критерий {i}", max_value=3) for i in range(1, 6)
+        )
+        tour = Tour.objects.create(event=event, number=1, status=Tour.Status.CLOSED, team_count=4)
+        teams = Team.objects.bulk_create(Team(event=event, name=f"Команда {i}") for i in range(4))
+        TourTeam.objects.bulk_create(TourTeam(tour=tour, team=team) for team in teams)
+        Participant.objects.bulk_create(
+            Participant(team=team, name=f"{team.name} / {k}") for team in teams for k in (1, 2)
+        )
+
+        game_flow.start_roulette(event)
+        game_flow.start_next_round(DebattleEvent.objects.get(pk=event.pk), duration=3600)
+        self.timer_running = True
+        operator = User.objects.create_user(f"{slug}-operator", is_staff=True)
+        return DebattleEvent.objects.get(pk=event.pk), operator
+
+    def _drain(self, pid: int, idle_threads: int | None) -> None:
+        # Следующая фаза — только когда сервер разобрал очередь прошлой (потоки запросов ушли)
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        while idle_threads is not None and time.monotonic() < deadline:
+            threads = server_threads(pid)
+            if threads is None or threads <= idle_threads + DRAIN_SLACK:
+                return
+            time.sleep(0.2)
+
+    async def _sample_threads(self, pid: int, stop: asyncio.Event) -> int | None:
+        peak = None
+        while not stop.is_set():
+            threads = server_threads(pid)
+            if threads is not None:
+                peak = max(peak or 0, threads)
+            try:
+                await asyncio.wait_for(stop.wait(), 0.1)
+            except asyncio.TimeoutError:
+                pass
+        return peak
+
+    async def _screen_storm(self, port: int, pid: int, slug: str, screens: int, duration: float) -> dict:
+        # screens клиентов одновременно и без пауз открывают страницу экрана
+        latencies = []
+        errors = 0
+        deadline = time.perf_counter() + duration
+
+        async def screen():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                status, _headers = await afetch(port, f"/debattle/{slug}/screen/")
+                latencies.append((time.perf_counter() - started) * 1000)
+                errors += status != 200
+
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(self._sample_threads(pid, stop))
+        started = time.perf_counter()
+        await asyncio.gather(*(screen() for _ in range(screens)))
+        wall = time.perf_counter() - started
+        stop.set()
+
+        latencies.sort()
+        return {
+            "requests": len(latencies),
+            "errors": errors,
+            "rps": round(len(latencies) / wall, 1),
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "peak_threads": await sampler,
+        }
+
+    async def _idle_screens(self, port: int, pid: int, event, operator_client, mode: str, screens: int,
+                            duration: float, poll_interval: float) -> dict:
+        # screens экранов ждут перехода: poll — state.json раз в poll_interval (как до async),
+        # longpoll — state/wait. Пока ждут, отдельный клиент раз в 0,1 с открывает экран
+        # (латентность под нагрузкой), затем пульт делает переход и меряем, когда его увидел каждый
+        version = await asyncio.to_thread(
+            lambda: DebattleEvent.objects.values_list("state_version", flat=True).get(pk=event.pk)
+        )
+        seen = []
+        requests = 0
+        changed_at = None
+        stop = asyncio.Event()
+
+        async def screen():
+            nonlocal requests
+            known = version
+            while not stop.is_set():
+                if mode == "poll":
+                    path = f"/debattle/{event.slug}/state.json"
+                else:
+                    path = f"/debattle/{event.slug}/state/wait/?after={known}"
+                status, headers = await afetch(port, path, {"If-None-Match": f'"{known}"'})
+                requests += 1
+                if status == 200:
+                    known = int(headers.get("ETag", '"0"').strip('"'))
+                    if changed_at is not None and known > version:
+                        seen.append((time.perf_counter() - changed_at) * 1000)
+                        return
+                if mode == "poll" or status == 0:
+                    try:
+                        await asyncio.wait_for(stop.wait(), poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+
+        sampler = asyncio.create_task(self._sample_threads(pid, stop))
+        tasks = []
+        for start in range(0, screens, CONNECT_BATCH):
+            tasks += [asyncio.create_task(screen()) for _ in range(min(CONNECT_BATCH, screens - start))]
+            await asyncio.sleep(0.05)
+        # Пробный запрос — уже в простое, а не на фоне подключения экранов
+        await asyncio.sleep(SETTLE)
+
+        probe = Recorder()
+        probe_stop = threading.Event()
+
+        def probe_screen():
+            client = BenchClient(port, probe)
+            while not probe_stop.is_set():
+                client.request("probe", "GET", f"/debattle/{event.slug}/screen/")
+                probe_stop.wait(0.1)
+            client.close()
+
+        probe_task = asyncio.create_task(asyncio.to_thread(probe_screen))
+        await asyncio.sleep(duration)
+        probe_stop.set()
+        await probe_task
+        idle_requests = requests
+
+        # Переход с пульта: таймер раунда то ставится на паузу, то запускается снова
+        self.timer_running = not self.timer_running
+        action = "start_timer" if self.timer_running else "stop_timer"
+        changed_at = time.perf_counter()
+        await asyncio.to_thread(self._operate, operator_client, event.slug, action)
+        done, pending = await asyncio.wait(tasks, timeout=PROPAGATION_TIMEOUT)
+        stop.set()
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        seen.sort()
+        probe_row = probe.summary(duration).get("probe", {})
+        return {
+            "requests_per_screen_s": round(idle_requests / screens / duration, 2),
+            "probe_p50_ms": probe_row.get("p50_ms", 0),
+            "probe_p99_ms": probe_row.get("p99_ms", 0),
+            "probe_errors": probe_row.get("errors", 0),
+            "peak_threads": await sampler,
+            "propagation_p50_ms": round(percentile(seen, 50), 1),
+            "propagation_max_ms": round(seen[-1], 1) if seen else 0,
+            "missed": screens - len(seen),
+        }
+
+    def _operate(self, client, slug: str, action: str) -> None:
+        control = f"/debattle/{slug}/control/"
+        _status, html, _headers = client.request("control:get", "GET", control)
+        status, _body, _headers = client.request(f"control:{action}", "POST", control, data={
+            "csrfmiddlewaretoken": client.csrf_token(html), "action": action,
+            "control_version": client.control_version(html),
+        })
+        if status not in (200, 302):
+            raise CommandError(f"Пульт не выполнил {action}: HTTP {status}.")
+
+    def _report(self, results: dict) -> None:
+        for label, row in results.items():
+            self.stdout.write(f"{label:<20}" + "  ".join(f"{key}={value}" for key, value in row.items()))
+
+    def _save(self, result: dict, output_dir: Path) -> None:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        previous = sorted(output_dir.glob("screens-*.json"))
+
+        stamp = timezone.now().strftime("%Y%m%d-%H%M%S")
+        path = output_dir / f"screens-{stamp}-{result['commit']}.json"
+        path.write_text(json.dumps(result, ensure_ascii=False, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Результаты: {path}"))
+
+        if not previous:
+            return
+
+        # Сравнение с последним прогоном: пик потоков и латентность пробного запроса/экрана
+        baseline = json.loads(previous[-1].read_text())
+        self.stdout.write(f"Сравнение с {previous[-1].name} (коммит {baseline.get('commit')}):")
+        for label, row in result["results"].items():
+            before = baseline.get("results", {}).get(label)
+            if not before:
+                continue
+            latency = "p99_ms" if "p99_ms" in row else "probe_p99_ms"
+            self.stdout.write(
+                f"  {label:<20} потоков {before['peak_threads']} → {row['peak_threads']}, "
+                f"{latency} {before[latency]} → {row[latency]}"
+            )
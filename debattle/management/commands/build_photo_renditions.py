@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from debattle.models import Participant
+from debattle.photos import build_renditions
+
+
+class Command(BaseCommand):
+    help = "Построить копии фото участников для экранов (те, что ещё не построены или устарели)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--slug", help="только участники этого мероприятия")
+        parser.add_argument("--force", action="store_true", help="перекодировать даже актуальные копии")
+
+    def handle(self, *args, slug=None, force=False, **options):
+        participants = Participant.objects.exclude(photo="").exclude(photo__isnull=True)
+        if slug:
+            participants = participants.filter(team__event__slug=slug)
+
+        built = sum(build_renditions(pk, force=force) for pk in participants.values_list("pk", flat=True))
+        self.stdout.write(self.style.SUCCESS(f"Построено копий фото: {built}"))
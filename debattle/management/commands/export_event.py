@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from debattle.export import FORMATS, TABLES, export_lines
+from debattle.models import DebattleEvent
+
+
+class Command(BaseCommand):
+    help = "Выгрузить оценки, итоги жюри, матчи и раунды мероприятия потоком в CSV или NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("slug", help="slug мероприятия")
+        parser.add_argument("--table", choices=(*TABLES, "all"), default="scores")
+        parser.add_argument("--format", choices=FORMATS, default="csv")
+        parser.add_argument(
+            "--submitted-only", action="store_true",
+            help="только судьи, отправившие итог матча (как в подсчёте результатов)",
+        )
+        parser.add_argument("--output", help="файл (по умолчанию stdout)")
+
+    def handle(self, *args, slug, table, format, submitted_only, output=None, **options):
+        event = DebattleEvent.objects.filter(slug=slug).first()
+        if event is None:
+            raise CommandError(f"Мероприятие {slug} не найдено")
+
+        try:
+            lines = export_lines(event, table, format, submitted_only)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if output:
+            with open(output, "w", encoding="utf-8", newline="") as f:
+                f.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending="")
@@ -0,0 +1,45 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from debattle.importing import import_event
+from debattle.models import DebattleEvent
+
+
+class Command(BaseCommand):
+    help = (
+        "Импорт команд с участниками и жюри из CSV. Файлы проверяются целиком до записи; "
+        "команды раскладываются по турам по 4, набранные туры печатаются"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("slug", help="slug мероприятия")
+        parser.add_argument("--teams", help="CSV команд: team,participant_1,participant_2[,bio_1,bio_2]")
+        parser.add_argument("--jury", help="CSV жюри: username[,display_name,email,password]")
+
+    def handle(self, *args, slug, teams=None, jury=None, **options):
+        event = DebattleEvent.objects.filter(slug=slug).first()
+        if event is None:
+            raise CommandError(f"Мероприятие {slug} не найдено")
+        if not teams and not jury:
+            raise CommandError("Укажи --teams и/или --jury")
+
+        started = time.perf_counter()
+        try:
+            result = import_event(
+                event,
+                teams_csv=Path(teams).read_text(encoding="utf-8-sig") if teams else "",
+                jury_csv=Path(jury).read_text(encoding="utf-8-sig") if jury else "",
+            )
+        except (OSError, UnicodeDecodeError) as e:
+            raise CommandError(f"Не удалось прочитать файл: {e}")
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if result["warning"]:
+            self.stdout.write(self.style.WARNING(result["warning"]))
+        self.stdout.write(self.style.SUCCESS(
+            f"Команд: {result['teams']}, жюри: {result['jury']}, новых туров: {result['tours']}, "
+            f"матчей: {result['matches']} за {time.perf_counter() - started:.1f} с"
+        ))
@@ -0,0 +1,41 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from debattle.event_log import EVENT_FIELDS, rebuild_state
+from debattle.models import DebattleEvent
+
+
+class Command(BaseCommand):
+    help = (
+        "Восстановить состояние мероприятия из журнала (снимок + хвост) и вывести его JSON. "
+        "--check сверяет восстановленное с текущими полями мероприятия"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("slug", help="slug мероприятия")
+        parser.add_argument("--seq", type=int, help="состояние на записи журнала seq (по умолчанию — последнее)")
+        parser.add_argument("--check", action="store_true")
+
+    def handle(self, *args, slug, seq=None, check=False, **options):
+        event = DebattleEvent.objects.filter(slug=slug).first()
+        if event is None:
+            raise CommandError(f"Мероприятие {slug} не найдено")
+
+        started = time.perf_counter()
+        state = rebuild_state(event.id, upto_seq=seq)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        self.stdout.write(json.dumps(state, ensure_ascii=False, indent=2))
+        self.stderr.write(f"Запись {state['seq']}, версия {state['version']}: восстановлено за {elapsed_ms:.1f} мс")
+
+        if check:
+            mismatched = [
+                name for name in EVENT_FIELDS if state["event"].get(name) != getattr(event, name)
+            ]
+            if state["version"] != event.state_version:
+                mismatched.append("state_version")
+            if mismatched:
+                raise CommandError(f"Расходится с базой: {', '.join(mismatched)}")
+            self.stderr.write(self.style.SUCCESS("Совпадает с текущим состоянием в базе"))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from debattle.models import DebattleEvent
+from debattle.scheduling import generate_schedule
+
+
+class Command(BaseCommand):
+    help = "Спланировать матчи всех набранных (CLOSED) туров мероприятия"
+
+    def add_arguments(self, parser):
+        parser.add_argument("slug", help="slug мероприятия")
+        parser.add_argument("--seed", type=int, help="seed жеребьёвки (для воспроизводимости)")
+
+    def handle(self, *args, slug, seed=None, **options):
+        event = DebattleEvent.objects.filter(slug=slug).first()
+        if event is None:
+            raise CommandError(f"Мероприятие {slug} не найдено")
+
+        try:
+            created = generate_schedule(event, seed=seed)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(f"Запланировано матчей: {created}"))
@@ -0,0 +1,207 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+# Метрики процесса в текстовом формате Prometheus (/metrics). Хранятся в памяти процесса:
+# при нескольких воркерах каждый отдаёт свои, суммирует их сам Prometheus.
+# Запись наблюдения — поиск корзины и сложение под коротким локом, без аллокаций
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+METHODS = ("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS")
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...], buckets: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values: tuple, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # [счётчики по корзинам (+ переполнение), сумма, количество]
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def render(self) -> list[str]:
+        with self._lock:
+            snapshot = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, counts, total, count in sorted(snapshot):
+            labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_SECONDS = Histogram(
+    "debattle_http_request_duration_seconds", "Время обработки запроса", ("view", "method"), LATENCY_BUCKETS
+)
+REQUEST_QUERIES = Histogram(
+    "debattle_http_db_queries", "SQL-запросов за запрос", ("view", "method"), QUERY_BUCKETS
+)
+REQUEST_DB_SECONDS = Histogram(
+    "debattle_http_db_duration_seconds", "Время в БД за запрос", ("view", "method"), LATENCY_BUCKETS
+)
+REQUEST_TEMPLATE_SECONDS = Histogram(
+    "debattle_http_template_duration_seconds", "Время рендеринга шаблонов за запрос", ("view", "method"),
+    LATENCY_BUCKETS,
+)
+TRANSITION_SECONDS = Histogram(
+    "debattle_transition_duration_seconds", "Время команды пульта вместе с коммитом", ("action",),
+    LATENCY_BUCKETS,
+)
+
+HISTOGRAMS = (REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_DB_SECONDS, REQUEST_TEMPLATE_SECONDS, TRANSITION_SECONDS)
+
+# Накопители текущего запроса: [запросов, секунд в БД, секунд в шаблонах]
+_request_totals = ContextVar("debattle_request_totals", default=None)
+
+
+def render_metrics() -> str:
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    return "\n".join(lines) + "\n"
+
+
+def reset_metrics() -> None:
+    for histogram in HISTOGRAMS:
+        histogram.reset()
+
+
+@contextmanager
+def timed_transition(action: str):
+    # Вокруг command_queue._apply: в замер входят блокировка мероприятия, сам переход
+    # и коммит внешней транзакции (переходы game_flow внутри неё — лишь точки сохранения)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        TRANSITION_SECONDS.observe((action,), time.perf_counter() - started)
+
+
+def _db_timer(execute, sql, params, many, context):
+    totals = _request_totals.get()
+    if totals is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        totals[0] += 1
+        totals[1] += time.perf_counter() - started
+
+
+def install_db_wrapper(wrapper) -> None:
+    # Обёртка ставится на каждое соединение, а не вокруг обработчика: в async-запросе ORM
+    # работает в потоке sync_to_async со своим соединением. Накопители обёртки ищут по
+    # ContextVar — контекст запроса sync_to_async переносит в поток
+    def install(connection, **kwargs):
+        if wrapper not in connection.execute_wrappers:
+            connection.execute_wrappers.append(wrapper)
+
+    connection_created.connect(install, weak=False, dispatch_uid=f"debattle-db-wrapper-{wrapper.__qualname__}")
+    for connection in connections.all(initialized_only=True):
+        install(connection)
+
+
+install_db_wrapper(_db_timer)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        totals = _request_totals.get()
+        if totals is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            totals[2] += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    # Бэкенд шаблонов Django, считающий время рендеринга в метрики запроса.
+    # Вложенные {% include %} рендерятся внутри родителя и отдельно не считаются
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class MetricsMiddleware:
+    # Латентность, число и время SQL-запросов и время шаблонов — по view и методу.
+    # Умеет и sync, и async: иначе Django гонял бы async-обработчики через поток
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        totals = [0, 0.0, 0.0]
+        token = _request_totals.set(totals)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_totals.reset(token)
+        self._observe(request, totals, time.perf_counter() - started)
+        return response
+
+    async def _acall(self, request):
+        totals = [0, 0.0, 0.0]
+        token = _request_totals.set(totals)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_totals.reset(token)
+        self._observe(request, totals, time.perf_counter() - started)
+        return response
+
+    def _observe(self, request, totals: list, elapsed: float) -> None:
+        match = request.resolver_match
+        labels = (match.view_name if match else "unmatched", request.method if request.method in METHODS else "OTHER")
+        REQUEST_SECONDS.observe(labels, elapsed)
+        REQUEST_QUERIES.observe(labels, totals[0])
+        REQUEST_DB_SECONDS.observe(labels, totals[1])
+        REQUEST_TEMPLATE_SECONDS.observe(labels, totals[2])
@@ -0,0 +1,51 @@
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .metrics import install_db_wrapper
+
+_query_count = ContextVar("debattle_bench_query_count", default=None)
+
+
+def _counter(execute, sql, params, many, context):
+    count = _query_count.get()
+    if count is not None:
+        count[0] += 1
+    return execute(sql, params, many, context)
+
+
+install_db_wrapper(_counter)
+
+
+class QueryCountHeaderMiddleware:
+    # Включается только для бенчмарка (DEBATTLE_BENCH=1): отдаёт число SQL-запросов
+    # запроса в заголовке X-DB-Queries, чтобы нагрузочный клиент видел их со стороны сервера
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        count = [0]
+        token = _query_count.set(count)
+        try:
+            response = self.get_response(request)
+        finally:
+            _query_count.reset(token)
+        response["X-DB-Queries"] = str(count[0])
+        return response
+
+    async def _acall(self, request):
+        count = [0]
+        token = _query_count.set(count)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _query_count.reset(token)
+        response["X-DB-Queries"] = str(count[0])
+        return response
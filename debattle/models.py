@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import F
 from django.utils import timezone
 
 
@@ -22,16 +23,32 @@ class DebattleEvent(models.Model):
     themes_revealed = models.BooleanField(default=False)
     voting_open = models.BooleanField(default=False)
     current_round_number = models.PositiveSmallIntegerField(default=0)
+    # Таймер раунда по умолчанию; пульт может задать другой при запуске раунда
+    round_duration = models.PositiveIntegerField("Длительность раунда, с", default=180)
 
     current_tour = models.ForeignKey("Tour", null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
     current_match = models.ForeignKey("Match", null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
 
+    # Монотонно растёт при каждом переходе game_flow и отправке итога жюри (ETag для экранов)
+    state_version = models.PositiveBigIntegerField(default=0)
+    # Растёт только с командами пульта (command_queue): по нему пульт отсекает устаревшие
+    # команды, и регистрация команд, итоги жюри или импорт их не делают устаревшими
+    control_version = models.PositiveBigIntegerField(default=0)
+
     created_at = models.DateTimeField(auto_now_add=True)
 
     def can_show_themes_button(self) -> bool:
         # За 7 дней до start_at
         return timezone.now() >= (self.start_at - timezone.timedelta(days=7))
 
+    def bump_state_version(self) -> int:
+        # Инкремент на стороне БД, чтобы параллельные переходы не потеряли версию
+        DebattleEvent.objects.filter(pk=self.pk).update(state_version=F("state_version") + 1)
+        self.state_version = (
+            DebattleEvent.objects.filter(pk=self.pk).values_list("state_version", flat=True).get()
+        )
+        return self.state_version
+
     class Meta:
         verbose_name = "ДеБатл"
         verbose_name_plural = "ДеБатл"
@@ -68,9 +85,26 @@ class Participant(models.Model):
     photo = models.ImageField(upload_to="participants/", blank=True, null=True)
     bio = models.TextField(blank=True)
 
+    # Уменьшенные копии фото (см. photos.py): строятся один раз в фоне после регистрации,
+    # имена содержат хэш содержимого. photo_source — из какого оригинала они построены
+    photo_screen = models.ImageField(upload_to="participants/renditions/", max_length=255, blank=True, null=True, editable=False)
+    photo_thumb = models.ImageField(upload_to="participants/renditions/", max_length=255, blank=True, null=True, editable=False)
+    photo_source = models.CharField(max_length=255, blank=True, editable=False)
+
     def __str__(self) -> str:
         return self.name
 
+    @property
+    def screen_photo_url(self) -> str | None:
+        # Оригинал на экраны не отдаём никогда: пока копии нет — без фото
+        from .photos import rendition_url
+        return rendition_url(self.photo_screen)
+
+    @property
+    def thumb_photo_url(self) -> str | None:
+        from .photos import rendition_url
+        return rendition_url(self.photo_thumb)
+
 
 class Tour(models.Model):
     class Status(models.TextChoices):
@@ -82,6 +116,11 @@ class Tour(models.Model):
     event = models.ForeignKey(DebattleEvent, on_delete=models.CASCADE, related_name="tours")
     number = models.PositiveIntegerField()
     status = models.CharField(max_length=16, choices=Status.choices, default=Status.OPEN)
+    # Счётчик занятых мест: регистрация занимает место одной условной записью
+    team_count = models.PositiveSmallIntegerField(default=0)
+    # Seed жеребьёвки запечатанного тура (scheduling.seal_tour): по нему план тура
+    # воспроизводится через draw_tour; пусто — тур ещё не запечатан
+    draw_seed = models.PositiveIntegerField(null=True, blank=True)
 
     teams = models.ManyToManyField(Team, through="TourTeam", related_name="tours")
 
@@ -115,6 +154,8 @@ class Match(models.Model):
     team_b = models.ForeignKey(Team, on_delete=models.PROTECT, related_name="+")
     status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
     winner = models.ForeignKey(Team, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    # Порядковый номер в туре для матчей из расписания (scheduling.py); у матчей рулетки — пусто
+    slot = models.PositiveSmallIntegerField(null=True, blank=True)
     
     # Тема выбирается один раз для всего матча
     theme = models.ForeignKey("Theme", null=True, blank=True, on_delete=models.SET_NULL, related_name="matches")
@@ -123,6 +164,10 @@ class Match(models.Model):
     team_a_position = models.CharField(max_length=16, choices=Position.choices, null=True, blank=True)
     team_b_position = models.CharField(max_length=16, choices=Position.choices, null=True, blank=True)
 
+    # Суммы баллов на момент подведения итога (standings.resolve_match); пусто — матч не подведён
+    team_a_total = models.PositiveIntegerField(null=True, blank=True)
+    team_b_total = models.PositiveIntegerField(null=True, blank=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
 
 
@@ -142,6 +187,15 @@ class Round(models.Model):
     status = models.CharField(max_length=16, choices=Status.choices, default=Status.READY)
     started_at = models.DateTimeField(null=True, blank=True)
     ended_at = models.DateTimeField(null=True, blank=True)
+
+    # Таймер раунда (game_flow.start_timer/stop_timer): остаток на момент последнего
+    # пуска/остановки и время пуска, пока таймер идёт. Пусто — таймера у раунда нет
+    timer_remaining_ms = models.PositiveIntegerField(null=True, blank=True)
+    timer_started_at = models.DateTimeField(null=True, blank=True)
+
+    # Голоса зрителей за команды пары — итог, записанный close_voting (audience.close_ballot)
+    audience_a = models.PositiveIntegerField(null=True, blank=True)
+    audience_b = models.PositiveIntegerField(null=True, blank=True)
     
     # Новые поля для темы и позиций
     theme = models.ForeignKey("Theme", null=True, blank=True, on_delete=models.SET_NULL, related_name="rounds")
@@ -152,4 +206,85 @@ class Round(models.Model):
         unique_together = ("match", "number")
         ordering = ["number"]
         verbose_name = "Раунды"
-        verbose_name_plural = "Раунды"
\ No newline at end of file
+        verbose_name_plural = "Раунды"
+
+
+class TeamStanding(models.Model):
+    # Турнирная таблица: строки двух команд пересчитываются при подведении итога их матча,
+    # чтение — одна упорядоченная выборка по индексу
+    event = models.ForeignKey(DebattleEvent, on_delete=models.CASCADE, related_name="standings")
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name="+")
+    played = models.PositiveIntegerField(default=0)
+    wins = models.PositiveIntegerField(default=0)
+    draws = models.PositiveIntegerField(default=0)
+    losses = models.PositiveIntegerField(default=0)
+    score_for = models.PositiveIntegerField(default=0)
+    score_against = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("event", "team")
+        ordering = ["-wins", "-draws", "-score_for", "team_id"]
+        indexes = [models.Index(fields=["event", "-wins", "-draws", "-score_for"])]
+        verbose_name = "Строка таблицы"
+        verbose_name_plural = "Турнирная таблица"
+
+
+class EventLogEntry(models.Model):
+    # Журнал мероприятия: только дописывается, seq — без пропусков; у переходов — в порядке
+    # коммитов (под блокировкой строки мероприятия), оценки — по уникальности (event, seq),
+    # см. event_log.append
+    event = models.ForeignKey(DebattleEvent, on_delete=models.CASCADE, related_name="log_entries")
+    seq = models.PositiveIntegerField()
+    kind = models.CharField(max_length=32)
+    # state_version мероприятия после записи
+    version = models.PositiveBigIntegerField()
+    data = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("event", "seq")
+        ordering = ["event", "seq"]
+        verbose_name = "Запись журнала"
+        verbose_name_plural = "Журнал мероприятий"
+
+
+class EventSnapshot(models.Model):
+    # Свёрнутое состояние на записи журнала seq: восстановление = снимок + хвост журнала
+    event = models.ForeignKey(DebattleEvent, on_delete=models.CASCADE, related_name="snapshots")
+    seq = models.PositiveIntegerField()
+    state = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("event", "seq")
+        verbose_name = "Снимок состояния"
+        verbose_name_plural = "Снимки состояния"
+
+
+class DeliveryAck(models.Model):
+    # Подтверждение экрана: дельта с trace_id показана через latency_ms после нажатия на пульте
+    event = models.ForeignKey(DebattleEvent, on_delete=models.CASCADE, related_name="delivery_acks")
+    trace_id = models.CharField(max_length=32)
+    kind = models.CharField(max_length=32)
+    version = models.PositiveBigIntegerField()
+    client = models.CharField(max_length=64)
+    latency_ms = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("trace_id", "client")
+        verbose_name = "Подтверждение доставки"
+        verbose_name_plural = "Подтверждения доставки"
+
+
+class AudienceVote(models.Model):
+    # Голос зрителя в раунде: одно устройство (voter — id из подписанной cookie) — один голос
+    round = models.ForeignKey(Round, on_delete=models.CASCADE, related_name="audience_votes")
+    voter = models.CharField(max_length=64)
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name="+")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("round", "voter")
+        verbose_name = "Голос зрителя"
+        verbose_name_plural = "Голоса зрителей"
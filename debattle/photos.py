@@ -0,0 +1,128 @@
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.urls import reverse
+from PIL import Image, ImageOps
+
+from .models import DebattleEvent, Participant
+from .realtime import commit_state_change
+
+logger = logging.getLogger(__name__)
+
+RENDITION_DIR = "participants/renditions/"
+
+# (поле модели, максимальные ширина и высота) — от большей к меньшей:
+# каждая следующая копия уменьшается из уже декодированной предыдущей, без повторного сжатия
+RENDITIONS = (
+    ("photo_screen", (800, 800)),
+    ("photo_thumb", (160, 160)),
+)
+JPEG_QUALITY = 85
+
+# Фоновые потоки: кодирование фото не должно занимать поток запроса регистрации
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="debattle-photos")
+
+
+def rendition_url(field) -> str | None:
+    if not field:
+        return None
+    return reverse("debattle_photo", args=[field.name.removeprefix(RENDITION_DIR)])
+
+
+def _encode(image: Image.Image) -> bytes:
+    buf = BytesIO()
+    image.save(buf, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def _render(original) -> list[bytes]:
+    # Оригинал декодируется один раз; draft() просит у JPEG-декодера сразу уменьшенную
+    # картинку (кратно 1/2..1/8), не разворачивая в память многомегапиксельный кадр
+    with Image.open(original) as source:
+        source.draft("RGB", RENDITIONS[0][1])
+        image = ImageOps.exif_transpose(source).convert("RGB")
+
+    encoded = []
+    for _field, size in RENDITIONS:
+        # thumbnail() только уменьшает и сохраняет пропорции
+        image.thumbnail(size, Image.LANCZOS)
+        encoded.append(_encode(image))
+    return encoded
+
+
+def _renditions_changed(participant_id: int) -> None:
+    # URL копий входят в состояние экранов, а update() сигналов не шлёт — поднимаем версию сами
+    event = DebattleEvent.objects.filter(teams__participants=participant_id).first()
+    if event is not None:
+        commit_state_change(event, "config", {})
+
+
+def build_renditions(participant_id: int, force: bool = False) -> bool:
+    participant = Participant.objects.filter(pk=participant_id).first()
+    if participant is None:
+        return False
+
+    if not participant.photo:
+        stale = [f.name for f in (participant.photo_screen, participant.photo_thumb) if f]
+        if stale:
+            with transaction.atomic():
+                Participant.objects.filter(pk=participant_id).update(photo_screen="", photo_thumb="", photo_source="")
+                _renditions_changed(participant_id)
+            for name in stale:
+                default_storage.delete(name)
+        return False
+
+    # Копии уже построены из этого оригинала — повторно не кодируем
+    if participant.photo_source == participant.photo.name and not force:
+        return False
+
+    with participant.photo.open("rb") as original:
+        encoded = _render(original)
+
+    stem = PurePosixPath(participant.photo.name).stem[:40]
+    names = {}
+    for (field, _size), data in zip(RENDITIONS, encoded):
+        # Имя из хэша содержимого: URL меняется вместе с картинкой, поэтому её можно кэшировать навсегда
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        name = f"{RENDITION_DIR}{participant.pk}-{stem}-{field.removeprefix('photo_')}.{digest}.jpg"
+        if not default_storage.exists(name):
+            name = default_storage.save(name, ContentFile(data))
+        names[field] = name
+
+    old = {f.name for f in (participant.photo_screen, participant.photo_thumb) if f} - set(names.values())
+
+    # Условная запись: если фото успели заменить, пока мы кодировали, результат не сохраняем
+    with transaction.atomic():
+        updated = Participant.objects.filter(pk=participant_id, photo=participant.photo.name).update(
+            photo_source=participant.photo.name, **names
+        )
+        if updated:
+            _renditions_changed(participant_id)
+    if not updated:
+        old = set(names.values())
+
+    for name in old:
+        default_storage.delete(name)
+    return bool(updated)
+
+
+def _build_in_background(participant_id: int) -> None:
+    close_old_connections()
+    try:
+        build_renditions(participant_id)
+    except Exception:
+        logger.exception("Не удалось построить копии фото участника %s", participant_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_renditions(participant_ids) -> None:
+    # После коммита: фоновый поток должен увидеть сохранённого участника
+    ids = list(participant_ids)
+    transaction.on_commit(lambda: [_executor.submit(_build_in_background, pk) for pk in ids])
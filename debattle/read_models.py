@@ -0,0 +1,43 @@
+from django.db.models import prefetch_related_objects
+
+from accounts.services import compute_match_results
+
+from .models import DebattleEvent
+from .standings import SCREEN_STANDINGS, standings_payload
+
+
+def build_screen_read_model(context: dict) -> dict:
+    # Всё, что нужно экрану, фиксированным числом запросов — независимо от числа туров и команд.
+    # Событие с матчем и критерии уже в контексте мероприятия (event_context), здесь добираем:
+    # темы, туры, команды туров, участников пары, раунды, верх таблицы (+2 на результаты)
+    event = context["event"]
+    criteria = context["criteria"]
+
+    if event.themes_revealed:
+        prefetch_related_objects([event], "themes")
+
+    tours = list(event.tours.prefetch_related("teams"))
+
+    match = event.current_match
+    rnd = None
+    results = None
+
+    if match:
+        prefetch_related_objects([match.team_a, match.team_b], "participants")
+        prefetch_related_objects([match], "rounds")
+
+        if event.current_round_number:
+            rnd = next((r for r in match.rounds.all() if r.number == event.current_round_number), None)
+
+        if event.state == DebattleEvent.State.RESULTS:
+            results = compute_match_results(match)
+
+    return {
+        "event": event,
+        "tours": tours,
+        "match": match,
+        "round": rnd,
+        "results": results,
+        "criteria": criteria,
+        "standings": standings_payload(event.id, SCREEN_STANDINGS),
+    }
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from . import event_log, tracing
+from .event_context import aevent_version
+from .fragments import invalidate_event_fragments
+from .models import DebattleEvent, Match, Round
+
+logger = logging.getLogger(__name__)
+
+
+def event_group_name(slug: str) -> str:
+    # Одна группа на мероприятие: все экраны и планшеты жюри этого slug
+    return f"debattle_event_{slug}"
+
+
+def control_group_name(event_id: int) -> str:
+    # Пульт оператора: служебные обновления (прогресс жюри), не влияющие на экран.
+    # По id, а не slug — чтобы запись оценки не искала slug мероприятия
+    return f"debattle_control_{event_id}"
+
+
+def team_payload(team, with_participants: bool = False) -> dict:
+    data = {"id": team.id, "name": team.name}
+    if with_participants:
+        data["participants"] = [
+            {"name": p.name, "bio": p.bio, "photo": p.screen_photo_url} for p in team.participants.all()
+        ]
+    return data
+
+
+def round_payload(rnd: Round | None) -> dict | None:
+    if rnd is None:
+        return None
+    return {"number": rnd.number, "status": rnd.status}
+
+
+def timer_payload(rnd: Round | None) -> dict | None:
+    # Время — миллисекунды эпохи по часам сервера: клиент переводит его в свои часы
+    # через смещение, оценённое пингом (ping/pong по WebSocket мероприятия)
+    if rnd is None or rnd.timer_remaining_ms is None:
+        return None
+    running = rnd.timer_started_at is not None
+    return {
+        "round": rnd.number,
+        "running": running,
+        "remaining_ms": rnd.timer_remaining_ms,
+        "ends_at": int(rnd.timer_started_at.timestamp() * 1000) + rnd.timer_remaining_ms if running else None,
+    }
+
+
+def audience_payload(rnd: Round | None) -> dict | None:
+    # Итог голосования зрителей, записанный close_voting; пока голосование идёт,
+    # экраны получают живой счёт сообщениями audience_tally (audience.flush)
+    if rnd is None or rnd.audience_a is None:
+        return None
+    return {
+        "round": rnd.number,
+        "votes": {str(rnd.match.team_a_id): rnd.audience_a, str(rnd.match.team_b_id): rnd.audience_b},
+        "total": rnd.audience_a + rnd.audience_b,
+    }
+
+
+def match_payload(match: Match | None, with_participants: bool = False) -> dict | None:
+    if match is None:
+        return None
+    return {
+        "id": match.id,
+        "team_a": team_payload(match.team_a, with_participants),
+        "team_b": team_payload(match.team_b, with_participants),
+        "theme": match.theme.title if match.theme_id else None,
+        "team_a_position": match.team_a_position,
+        "team_b_position": match.team_b_position,
+        "rounds": [round_payload(r) for r in match.rounds.all()],
+    }
+
+
+def results_payload(results: dict | None) -> dict | None:
+    # Decimal и int-ключи не сериализуются в JSON как есть
+    if results is None:
+        return None
+    return {
+        "submitted_jury_count": results["submitted_jury_count"],
+        "team_totals": {str(k): str(v) for k, v in results["team_totals"].items()},
+        "team_by_criterion": {
+            str(team_id): {str(c_id): str(v) for c_id, v in by_c.items()}
+            for team_id, by_c in results["team_by_criterion"].items()
+        },
+    }
+
+
+def screen_state(event: DebattleEvent, *, match=None, rnd=None, results=None, criteria=(), standings=()) -> dict:
+    # Полное состояние экрана; дельты из game_flow используют те же ключи
+    return {
+        "version": event.state_version,
+        "state": event.state,
+        "themes_revealed": event.themes_revealed,
+        "themes": [t.title for t in event.themes.all()] if event.themes_revealed else [],
+        "round_number": event.current_round_number,
+        "voting_open": event.voting_open,
+        "match": match_payload(match, with_participants=True),
+        "round": round_payload(rnd),
+        "timer": timer_payload(rnd),
+        "audience": audience_payload(rnd),
+        "results": results_payload(results),
+        "criteria": [{"id": c.id, "title": c.title} for c in criteria],
+        "standings": list(standings),
+    }
+
+
+def _send_on_commit(group: str, payload: dict) -> None:
+    # Отправляем только после коммита, чтобы подписчики не увидели откатившееся состояние
+    def _send():
+        layer = get_channel_layer()
+        if layer is None:
+            return
+        try:
+            async_to_sync(layer.group_send)(group, {"type": "state.delta", "payload": payload})
+        except Exception:
+            # Запись уже закоммичена — падение брокера не должно ронять запрос
+            logger.exception("Не удалось разослать %s в %s", payload.get("kind"), group)
+
+    transaction.on_commit(_send)
+
+
+def publish_event_delta(event: DebattleEvent, kind: str, delta: dict, trace: dict | None = None) -> None:
+    payload = {"kind": kind, "version": event.state_version, **delta}
+    if trace:
+        payload["trace"] = trace
+    _send_on_commit(event_group_name(event.slug), payload)
+
+
+def publish_jury_progress(event_id: int, match_id: int, jury_id: int, scores: int, submitted: bool) -> None:
+    # Прогресс судьи видит только пульт: версию состояния не двигаем, экраны не будим
+    _send_on_commit(control_group_name(event_id), {
+        "kind": "jury_progress",
+        "match_id": match_id,
+        "jury_id": jury_id,
+        "scores": scores,
+        "submitted": submitted,
+    })
+
+
+def commit_state_change(event: DebattleEvent, kind: str, delta: dict, log: dict | None = None) -> None:
+    # Новая версия состояния: сбрасываем фрагменты прошлой версии, пишем переход в журнал
+    # (log — поля только для журнала) и рассылаем дельту экранам с trace для замера доставки
+    event.bump_state_version()
+    invalidate_event_fragments(event.slug, event.state_version - 1)
+    trace = tracing.new_trace()
+    record = event_log.transition_record(event, delta, {**(log or {}), "trace": trace})
+    event_log.append(event.id, kind, record, event.state_version)
+    tracing.remember_trace(event.id, kind, event.state_version, trace)
+    publish_event_delta(event, kind, delta, trace)
+
+
+async def wait_for_version(slug: str, after: int, timeout: float) -> int | None:
+    # Длинный опрос: ждём перехода с версией больше after и возвращаем текущую версию (или
+    # прежнюю по таймауту; None — нет мероприятия). Ожидание — корутина на канале группы
+    # мероприятия, поток не занят. Подписываемся до чтения версии, иначе переход между
+    # чтением и подпиской потерялся бы
+    layer = get_channel_layer()
+    channel = await layer.new_channel()
+    group = event_group_name(slug)
+    await layer.group_add(group, channel)
+    try:
+        stamp = await aevent_version(slug)
+        if stamp is None:
+            return None
+        version = stamp[-1]
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while version <= after:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                message = await asyncio.wait_for(layer.receive(channel), remaining)
+            except asyncio.TimeoutError:
+                break
+            # Сообщения без версии (счёт зрителей) состояние не меняют
+            version = max(version, (message.get("payload") or {}).get("version") or 0)
+        return version
+    finally:
+        await layer.group_discard(group, channel)
@@ -0,0 +1,13 @@
+from django.urls import path
+
+from . import consumers
+
+websocket_urlpatterns = [
+    path("ws/debattle/<slug:slug>/", consumers.EventStateConsumer.as_asgi()),
+    path("ws/debattle/<slug:slug>/control/", consumers.ControlProgressConsumer.as_asgi()),
+]
+
+# Перед HTTP-обработчиком Django: остальные пути уходят в него (config/asgi.py)
+http_urlpatterns = [
+    path("debattle/<slug:slug>/state/wait/", consumers.StateWaitConsumer.as_asgi()),
+]
@@ -0,0 +1,104 @@
+import random
+from itertools import groupby
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import DebattleEvent, Match, Theme, Tour, TourTeam
+
+POSITIONS = (Match.Position.FOR, Match.Position.AGAINST)
+
+# Seed тура — 31 бит: помещается в PositiveIntegerField на любой БД
+SEED_BITS = 31
+SEED_MODULUS = 2 ** SEED_BITS
+# generate_schedule выводит seed тура из общего: (base + id × шаг) mod 2^31 — так seed'ы
+# всех туров записываются одним UPDATE, а не построчным bulk_update
+SEED_STRIDE = 2654435761
+
+
+def new_seed() -> int:
+    return random.SystemRandom().getrandbits(SEED_BITS)
+
+
+def draw_tour(team_ids, theme_ids, seed: int) -> list[tuple[int, int, int, str]]:
+    # План тура: [(team_a_id, team_b_id, theme_id, позиция team_a), ...] по порядку слотов.
+    # Входы сортируются, поэтому те же команды, темы и seed всегда дают тот же план —
+    # по записанному Tour.draw_seed жеребьёвку можно проверить и повторить
+    rng = random.Random(seed)
+    teams = sorted(team_ids)
+    rng.shuffle(teams)
+    pairs = len(teams) // 2
+    if pairs > len(theme_ids):
+        raise ValueError("Тем меньше, чем матчей в туре: темы повторились бы.")
+
+    themes = rng.sample(sorted(theme_ids), pairs)
+    return [
+        (teams[2 * slot], teams[2 * slot + 1], themes[slot], rng.choice(POSITIONS))
+        for slot in range(pairs)
+    ]
+
+
+def _plan_matches(tour_id: int, plan) -> list[Match]:
+    return [
+        Match(
+            tour_id=tour_id,
+            slot=slot,
+            team_a_id=team_a_id,
+            team_b_id=team_b_id,
+            theme_id=theme_id,
+            team_a_position=a_position,
+            team_b_position=POSITIONS[1] if a_position == POSITIONS[0] else POSITIONS[0],
+        )
+        for slot, (team_a_id, team_b_id, theme_id, a_position) in enumerate(plan, 1)
+    ]
+
+
+@transaction.atomic
+def seal_tour(tour: Tour, seed: int | None = None) -> int:
+    # Тур набран: пары, темы и позиции всего тура разыгрываются здесь, одной транзакцией,
+    # а start_roulette / start_next_round потом только переключают указатели.
+    # Возвращает число матчей; уже запечатанный тур или тур с матчами рулетки не трогает
+    seed = new_seed() if seed is None else seed
+    team_ids = list(TourTeam.objects.filter(tour=tour).values_list("team_id", flat=True))
+    theme_ids = list(Theme.objects.filter(event_id=tour.event_id).values_list("id", flat=True))
+    plan = draw_tour(team_ids, theme_ids, seed)
+
+    # Условная запись seed — она же защита от второй печати того же тура
+    claimed = Tour.objects.filter(pk=tour.pk, draw_seed__isnull=True).exclude(matches__isnull=False).update(
+        draw_seed=seed
+    )
+    if not claimed:
+        return 0
+
+    Match.objects.bulk_create(_plan_matches(tour.pk, plan))
+    tour.draw_seed = seed
+    return len(plan)
+
+
+@transaction.atomic
+def generate_schedule(event: DebattleEvent, seed: int | None = None) -> int:
+    # Печать всех набранных (CLOSED) туров, которые ещё не запечатаны и без матчей, одним
+    # bulk_create — для мероприятий, собранных не через регистрацию (импорт, бенчмарк),
+    # и на случай сбоя между набором тура и его печатью. seed задаёт seed'ы туров.
+    # Возвращает число созданных матчей; повторный вызов запечатанные туры не трогает
+    base = random.Random(seed).getrandbits(SEED_BITS)
+    tours = Tour.objects.filter(
+        event=event, status=Tour.Status.CLOSED, draw_seed__isnull=True, matches__isnull=True
+    )
+
+    theme_ids = list(Theme.objects.filter(event=event).values_list("id", flat=True))
+    rows = TourTeam.objects.filter(tour__in=tours).order_by("tour__number", "id").values_list("tour_id", "team_id")
+
+    matches = []
+    for tour_id, group in groupby(rows.iterator(), key=lambda row: row[0]):
+        tour_seed = (base + tour_id * SEED_STRIDE) % SEED_MODULUS
+        plan = draw_tour([team_id for _tour_id, team_id in group], theme_ids, tour_seed)
+        matches.extend(_plan_matches(tour_id, plan))
+
+    sealed = len({m.tour_id for m in matches})
+    if tours.update(draw_seed=(F("id") * SEED_STRIDE + base) % SEED_MODULUS) != sealed:
+        # Между выборкой и записью набрался ещё тур — откатываемся, следующий вызов учтёт и его
+        raise ValueError("Туры изменились во время планирования, повтори.")
+
+    Match.objects.bulk_create(matches, batch_size=1000)
+    return len(matches)
@@ -1,34 +1,103 @@
-from django.db import transaction
-from django.db.models import Count
+import logging
+import time
+
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import Case, F, Value, When
 
 from .models import DebattleEvent, Tour, TourTeam, Team
+from .realtime import commit_state_change
+from .scheduling import seal_tour
 
+logger = logging.getLogger(__name__)
 
-@transaction.atomic
-def add_team_to_tour(event: DebattleEvent, team: Team) -> Tour:
-    # Берём открытый тур (самый ранний открытый)
-    tour = (
-        Tour.objects.select_for_update()
-        .filter(event=event, status=Tour.Status.OPEN)
-        .annotate(cnt=Count("teams"))
-        .order_by("number")
-        .first()
+# В туре ровно 4 команды: 4-я регистрация закрывает тур
+TOUR_SIZE = 4
+
+# SQLite отвечает "database is locked" при встречной записи — такую попытку просто повторяем
+ALLOCATION_ATTEMPTS = 50
+ALLOCATION_BACKOFF = 0.005
+
+
+def _open_next_tour(event: DebattleEvent) -> None:
+    last_number = (
+        Tour.objects.filter(event=event).order_by("-number").values_list("number", flat=True).first()
     )
+    try:
+        with transaction.atomic():
+            Tour.objects.create(event=event, number=(last_number or 0) + 1, status=Tour.Status.OPEN)
+    except IntegrityError:
+        # Параллельная регистрация уже открыла этот тур — займём место в нём на следующем круге
+        pass
+
 
-    if tour is None:
-        last_number = Tour.objects.filter(event=event).aggregate(mx=Count("id"))["mx"] or 0
-        # number лучше считать по max(number), но для MVP можно так.
-        # Сделаем правильно:
-        last = Tour.objects.filter(event=event).order_by("-number").first()
-        next_number = (last.number + 1) if last else 1
-        tour = Tour.objects.create(event=event, number=next_number, status=Tour.Status.OPEN)
+def _claim_slot(event: DebattleEvent) -> Tour:
+    for _ in range(ALLOCATION_ATTEMPTS):
+        tour = (
+            Tour.objects.filter(event=event, status=Tour.Status.OPEN)
+            .order_by("number")
+            .only("id", "number")
+            .first()
+        )
+        if tour is None:
+            _open_next_tour(event)
+            continue
+
+        # Единственная условная запись: занимает место и на 4-й команде сразу закрывает тур.
+        # Если место успели занять — 0 строк, идём за следующим открытым туром
+        claimed = Tour.objects.filter(pk=tour.pk, status=Tour.Status.OPEN, team_count__lt=TOUR_SIZE).update(
+            team_count=F("team_count") + 1,
+            status=Case(
+                When(team_count=TOUR_SIZE - 1, then=Value(Tour.Status.CLOSED)),
+                default=Value(Tour.Status.OPEN),
+            ),
+        )
+        if claimed:
+            tour.refresh_from_db(fields=["team_count", "status"])
+            return tour
+
+    raise RuntimeError("Не удалось подобрать тур для команды.")
+
+
+def add_team_to_tour(event: DebattleEvent, team: Team) -> Tour:
+    for attempt in range(ALLOCATION_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                tour = _claim_slot(event)
+                TourTeam.objects.create(tour=tour, team=team)
+            break
+        except OperationalError:
+            if attempt == ALLOCATION_ATTEMPTS - 1:
+                raise
+            time.sleep(ALLOCATION_BACKOFF * (attempt + 1))
 
-    TourTeam.objects.create(tour=tour, team=team)
+    # Дальше — best-effort: место уже закоммичено, и падение печати или рассылки не должно
+    # доходить до регистрации (она удалила бы команду, оставив тур со счётчиком на неё).
+    # Тур набран — сразу печатаем его план (своей транзакцией, не удлиняя распределение).
+    # Закрывает тур ровно одна регистрация — та, что заняла 4-е место
+    if tour.status == Tour.Status.CLOSED:
+        try:
+            seal_tour(tour)
+        except ValueError as e:
+            # Тем пока не хватает — тур запечатает generate_schedule с пульта, а до тех пор
+            # рулетка разыграет пару по-старому
+            logger.info("Тур %s не запечатан: %s", tour.pk, e)
+        except Exception:
+            logger.exception("Не удалось запечатать тур %s", tour.pk)
 
-    # Если после добавления стало 4 команды — закрываем тур
-    teams_count = TourTeam.objects.filter(tour=tour).count()
-    if teams_count >= 4:
-        tour.status = Tour.Status.CLOSED
-        tour.save(update_fields=["status"])
+    # Версию двигаем уже после коммита распределения, чтобы не держать блокировку события
+    # на время записи команды: список туров на экране и пульте изменился
+    try:
+        with transaction.atomic():
+            commit_state_change(event, "add_team", {
+                "tour": {
+                    "id": tour.id,
+                    "number": tour.number,
+                    "status": tour.status,
+                    "teams": list(tour.teams.values_list("name", flat=True)),
+                },
+            })
+    except Exception:
+        # Экраны увидят команду со следующим переходом
+        logger.exception("Не удалось разослать регистрацию команды %s", team.pk)
 
-    return tour
\ No newline at end of file
+    return tour
@@ -0,0 +1,42 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from accounts.models import JuryMember, ScoreCriterion
+
+from .models import DebattleEvent, Participant, Team
+from .realtime import commit_state_change
+
+
+def _config_changed(event_id: int) -> None:
+    # Контекст мероприятия и фрагменты кэшируются по state_version — поднимаем её,
+    # чтобы все воркеры перечитали событие, а экраны перерисовались
+    event = DebattleEvent.objects.filter(pk=event_id).first() if event_id else None
+    if event is None:
+        # мероприятие удаляется каскадом
+        return
+    commit_state_change(event, "config", {})
+
+
+@receiver(post_save, sender=ScoreCriterion)
+@receiver(post_delete, sender=ScoreCriterion)
+@receiver(post_save, sender=JuryMember)
+@receiver(post_delete, sender=JuryMember)
+def criteria_or_jury_changed(sender, instance, **kwargs):
+    # Каскад от удаления самого мероприятия: строка ещё есть, но журнал уже вычищен —
+    # запись о «правке» осталась бы без мероприятия
+    if isinstance(kwargs.get("origin"), DebattleEvent):
+        return
+    _config_changed(instance.event_id)
+
+
+@receiver(post_save, sender=Team)
+@receiver(post_save, sender=Participant)
+def team_changed(sender, instance, created, **kwargs):
+    # Новые команды и участники приходят через регистрацию — она сама поднимает версию
+    # при добавлении в тур; здесь только правки существующих (админка)
+    if created:
+        return
+    if sender is Team:
+        _config_changed(instance.event_id)
+    else:
+        _config_changed(Team.objects.filter(pk=instance.team_id).values_list("event_id", flat=True).first())
@@ -0,0 +1,93 @@
+from django.db import transaction
+from django.db.models import Q
+
+from .models import DebattleEvent, Match, TeamStanding
+
+# Сколько строк таблицы показывает экран; полная таблица — в standings.json
+SCREEN_STANDINGS = 10
+
+
+def pick_winner(match: Match, results: dict, criteria_ids: list[int]) -> int | None:
+    # Больше сумма — победа; при равных суммах решают суммы по критериям в порядке критериев.
+    # Совпало всё — ничья (None)
+    totals = results["team_totals"]
+    a, b = totals.get(match.team_a_id, 0), totals.get(match.team_b_id, 0)
+    if a != b:
+        return match.team_a_id if a > b else match.team_b_id
+
+    by_criterion = results["team_by_criterion"]
+    for criterion_id in criteria_ids:
+        a = by_criterion.get(match.team_a_id, {}).get(criterion_id, 0)
+        b = by_criterion.get(match.team_b_id, {}).get(criterion_id, 0)
+        if a != b:
+            return match.team_a_id if a > b else match.team_b_id
+    return None
+
+
+@transaction.atomic
+def resolve_match(event: DebattleEvent, match: Match, results: dict) -> None:
+    # results — compute_match_results(match): он же уходит экрану, второй раз не считаем
+    criteria_ids = list(event.criteria.order_by("id").values_list("id", flat=True))
+    totals = results["team_totals"]
+
+    match.winner_id = pick_winner(match, results, criteria_ids)
+    match.team_a_total = int(totals.get(match.team_a_id, 0))
+    match.team_b_total = int(totals.get(match.team_b_id, 0))
+    match.status = Match.Status.DONE
+    match.save(update_fields=["winner", "team_a_total", "team_b_total", "status"])
+
+    refresh_standings(event.id, [match.team_a_id, match.team_b_id])
+
+
+def refresh_standings(event_id: int, team_ids: list[int]) -> None:
+    # Строки команд собираются заново из их подведённых матчей (их единицы) — повторное
+    # подведение того же матча (поздний итог жюри) не задваивает таблицу
+    standings = {team_id: TeamStanding(event_id=event_id, team_id=team_id) for team_id in team_ids}
+    rows = (
+        Match.objects.filter(tour__event_id=event_id, team_a_total__isnull=False)
+        .filter(Q(team_a_id__in=team_ids) | Q(team_b_id__in=team_ids))
+        .values_list("team_a_id", "team_b_id", "winner_id", "team_a_total", "team_b_total")
+    )
+    for team_a_id, team_b_id, winner_id, a_total, b_total in rows:
+        for team_id, own, other in ((team_a_id, a_total, b_total), (team_b_id, b_total, a_total)):
+            standing = standings.get(team_id)
+            if standing is None:
+                continue
+            standing.played += 1
+            standing.score_for += own
+            standing.score_against += other
+            if winner_id is None:
+                standing.draws += 1
+            elif winner_id == team_id:
+                standing.wins += 1
+            else:
+                standing.losses += 1
+
+    TeamStanding.objects.bulk_create(
+        standings.values(),
+        update_conflicts=True,
+        unique_fields=["event", "team"],
+        update_fields=["played", "wins", "draws", "losses", "score_for", "score_against"],
+    )
+
+
+def standings_payload(event_id: int, limit: int | None = None) -> list[dict]:
+    rows = TeamStanding.objects.filter(event_id=event_id).values_list(
+        "team_id", "team__name", "played", "wins", "draws", "losses", "score_for", "score_against"
+    )
+    if limit is not None:
+        rows = rows[:limit]
+    return [
+        {
+            "place": place,
+            "team_id": team_id,
+            "team": name,
+            "played": played,
+            "wins": wins,
+            "draws": draws,
+            "losses": losses,
+            "score_for": score_for,
+            "score_against": score_against,
+        }
+        for place, (team_id, name, played, wins, draws, losses, score_for, score_against) in enumerate(rows, 1)
+    ]
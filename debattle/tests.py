@@ -1,3 +1,1475 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import json
+import os
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import Count
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, TestCase, TransactionTestCase, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import JuryMember, JuryMatchSubmission, ScoreCriterion
+from accounts.services import submit_jury_match, upsert_scores
+from config.databases import build_databases
+
+from . import audience, event_log, game_flow
+from .bench import Recorder, percentile
+from .command_queue import StaleCommandError, _apply as apply_command, submit_command
+from .db_router import ReplicaRouter, replica_reads
+from .event_context import event_version, get_event_context
+from .export import export_lines
+from .importing import ImportFileError, import_event
+from .tracing import MAX_ACK_AGE_MS, latency_summary, record_ack
+from .metrics import (
+    REQUEST_QUERIES, REQUEST_TEMPLATE_SECONDS, TRANSITION_SECONDS, render_metrics, reset_metrics, timed_transition,
+)
+from .event_log import EVENT_FIELDS, apply_entry, empty_state, rebuild_state
+from .photos import build_renditions
+from .realtime import event_group_name, screen_state, timer_payload, wait_for_version
+from .routing import http_urlpatterns, websocket_urlpatterns
+from .fragments import fragment_cache, state_cache_key
+from .models import AudienceVote, DebattleEvent, DeliveryAck, EventLogEntry, EventSnapshot, Match, Round, TeamStanding, Theme, Team, Participant, Tour, TourTeam
+from .scheduling import draw_tour, generate_schedule, seal_tour
+from .standings import pick_winner
+from .services import add_team_to_tour
+
+
+def make_event(slug: str, tours_count: int) -> DebattleEvent:
+    # Мероприятие с заполненными турами по 4 команды, темами и 5 критериями
+    event = DebattleEvent.objects.create(title=slug, slug=slug, start_at=timezone.now())
+    Theme.objects.bulk_create([Theme(event=event, order=i, title=f"Тема {i}") for i in range(9)])
+    ScoreCriterion.objects.bulk_create([
+        ScoreCriterion(event=event, title=f"Критерий {i}", max_value=3) for i in range(5)
+    ])
+
+    tours = Tour.objects.bulk_create([
+        Tour(event=event, number=n, status=Tour.Status.CLOSED, team_count=4) for n in range(1, tours_count + 1)
+    ])
+    teams = Team.objects.bulk_create([
+        Team(event=event, name=f"Команда {i}") for i in range(tours_count * 4)
+    ])
+    TourTeam.objects.bulk_create([
+        TourTeam(tour=tours[i // 4], team=team) for i, team in enumerate(teams)
+    ])
+    Participant.objects.bulk_create([
+        Participant(team=team, name=f"{team.name} / {k}", bio="—") for team in teams for k in (1, 2)
+    ])
+    return event
+
+
+class ScreenQueryBudgetTests(TestCase):
+    # Экран должен укладываться в фиксированное число запросов при любом количестве туров
+    # (холодные кэши: проверка версии + контекст мероприятия (3) + read model с верхом таблицы)
+    QUERY_BUDGET = {
+        DebattleEvent.State.PREVIEW: 10,
+        DebattleEvent.State.ROUND_ACTIVE: 10,
+        DebattleEvent.State.VOTING_OPEN: 10,
+        DebattleEvent.State.RESULTS: 12,
+    }
+    # Контекст той же версии уже в памяти процесса — минус событие, критерии и жюри
+    WARM_CONTEXT_SAVING = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.events = {n: make_event(f"deb-{n}", n) for n in (1, 50, 500)}
+
+    def setUp(self):
+        # Версии состояния повторяются между тестами (откат транзакции) — кэш должен быть пустым
+        fragment_cache().clear()
+
+    def _run_to(self, event: DebattleEvent, state: str) -> None:
+        game_flow.reveal_themes(event)
+        game_flow.start_roulette(event)
+        if state == DebattleEvent.State.PREVIEW:
+            return
+        for _ in range(3):
+            game_flow.start_next_round(event)
+        if state == DebattleEvent.State.ROUND_ACTIVE:
+            return
+        game_flow.open_voting(event)
+        if state == DebattleEvent.State.VOTING_OPEN:
+            return
+
+        match = event.current_match
+        user = User.objects.create(username=f"jury-{event.slug}")
+        jury = JuryMember.objects.create(user=user, event=event)
+        upsert_scores(match, jury, [
+            (team_id, c.id, 2) for team_id in (match.team_a_id, match.team_b_id) for c in event.criteria.all()
+        ])
+        # Строку карточки создаёт upsert_scores (в ней же счётчик заполненных ячеек)
+        JuryMatchSubmission.objects.get(match=match, jury=jury).submit()
+        game_flow.close_voting(event)
+
+    def _assert_screen_budget(self, state: str) -> None:
+        for tours_count, event in self.events.items():
+            with self.subTest(tours=tours_count):
+                event = DebattleEvent.objects.get(pk=event.pk)
+                self._run_to(event, state)
+                url = reverse("debattle_screen", kwargs={"slug": event.slug})
+                with self.assertNumQueries(self.QUERY_BUDGET[state]):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, event.current_match.team_a.name)
+
+    def test_preview_query_budget(self):
+        self._assert_screen_budget(DebattleEvent.State.PREVIEW)
+
+    def test_round_active_query_budget(self):
+        self._assert_screen_budget(DebattleEvent.State.ROUND_ACTIVE)
+
+    def test_voting_open_query_budget(self):
+        self._assert_screen_budget(DebattleEvent.State.VOTING_OPEN)
+
+    def test_results_query_budget(self):
+        self._assert_screen_budget(DebattleEvent.State.RESULTS)
+
+    def test_warm_event_context_skips_event_graph(self):
+        event = DebattleEvent.objects.get(pk=self.events[50].pk)
+        self._run_to(event, DebattleEvent.State.ROUND_ACTIVE)
+        url = reverse("debattle_screen", kwargs={"slug": event.slug})
+        self.client.get(url)
+
+        fragment_cache().clear()
+        with self.assertNumQueries(self.QUERY_BUDGET[DebattleEvent.State.ROUND_ACTIVE] - self.WARM_CONTEXT_SAVING):
+            self.client.get(url)
+
+    def test_state_json_query_count_is_constant(self):
+        for tours_count, event in self.events.items():
+            with self.subTest(tours=tours_count):
+                self._run_to(DebattleEvent.objects.get(pk=event.pk), DebattleEvent.State.RESULTS)
+                url = reverse("debattle_state_json", kwargs={"slug": event.slug})
+                # та же проверка версии + read model
+                with self.assertNumQueries(self.QUERY_BUDGET[DebattleEvent.State.RESULTS]):
+                    response = self.client.get(url)
+                with self.assertNumQueries(1):
+                    not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+                self.assertEqual(not_modified.status_code, 304)
+
+
+class StateEtagTests(TestCase):
+    def setUp(self):
+        fragment_cache().clear()
+        self.event = make_event("deb-etag", 1)
+        self.url = reverse("debattle_state_json", kwargs={"slug": self.event.slug})
+
+    def _version(self) -> int:
+        return DebattleEvent.objects.get(pk=self.event.pk).state_version
+
+    def test_matching_etag_answers_304(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response["ETag"], f'"{self._version()}"')
+        self.assertEqual(response.json()["version"], self._version())
+
+        for header in (response["ETag"], f'"x", {response["ETag"]}', "*"):
+            with self.subTest(header=header), self.assertNumQueries(1):
+                not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=header)
+            self.assertEqual(not_modified.status_code, 304)
+            self.assertEqual(not_modified["ETag"], response["ETag"])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"999"').status_code, 200)
+
+    def test_new_etag_after_version_bump(self):
+        old = self.client.get(self.url)["ETag"]
+        DebattleEvent.objects.get(pk=self.event.pk).bump_state_version()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=old)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], f'"{self._version()}"')
+        self.assertNotEqual(response["ETag"], old)
+
+    def test_transition_invalidates_snapshot_key(self):
+        version = self._version()
+        self.client.get(self.url)
+        self.assertIsNotNone(fragment_cache().get(state_cache_key("snapshot", self.event.slug, version)))
+
+        game_flow.reveal_themes(DebattleEvent.objects.get(pk=self.event.pk))
+        self.assertIsNone(fragment_cache().get(state_cache_key("snapshot", self.event.slug, version)))
+
+        # Новая версия — новый ключ с новым состоянием
+        self.assertTrue(self.client.get(self.url).json()["themes_revealed"])
+        cached = fragment_cache().get(state_cache_key("snapshot", self.event.slug, version + 1))
+        self.assertEqual(cached["version"], version + 1)
+
+
+class ScreenFragmentCacheTests(TestCase):
+    def setUp(self):
+        fragment_cache().clear()
+        self.event = make_event("deb-cache", 3)
+        self.url = reverse("debattle_screen", kwargs={"slug": self.event.slug})
+
+    def _html(self) -> str:
+        # Серверная разметка без JSON-состояния и скрипта экрана
+        content = self.client.get(self.url).content.decode()
+        return content[:content.index('<script id="screen-state-data"')]
+
+    def test_repeated_views_render_once_per_version(self):
+        game_flow.start_roulette(self.event)
+        self.client.get(self.url)
+
+        # Повторный просмотр той же версии — только проверка версии
+        with self.assertNumQueries(1):
+            html = self._html()
+        self.assertIn("<h4>Превью команд</h4>", html)
+
+    def test_transition_invalidates_fragments(self):
+        match = game_flow.start_roulette(self.event)
+        self.client.get(self.url)
+        old_version = self.event.state_version
+
+        game_flow.start_next_round(self.event)
+        self.assertIsNone(fragment_cache().get(state_cache_key("snapshot", self.event.slug, old_version)))
+
+        html = self._html()
+        self.assertNotIn("<h4>Превью команд</h4>", html)
+        self.assertIn("<h4>Раунд 1</h4>", html)
+        self.assertIn(match.team_a.name, html)
+
+    def test_registration_invalidates_tour_list(self):
+        self.client.get(self.url)
+
+        team = Team.objects.create(event=self.event, name="Поздняя команда")
+        add_team_to_tour(self.event, team)
+
+        self.assertIn("Поздняя команда", self._html())
+
+
+class RegistrationAllocatorStressTests(TransactionTestCase):
+    # Регистрационный наплыв: параллельные POST в register_team_view не должны
+    # класть в тур больше 4 команд и оставлять незакрытыми заполненные туры.
+    # DEBATTLE_STRESS_REGISTRATIONS увеличивает наплыв для ручного прогона
+    REGISTRATIONS = int(os.environ.get("DEBATTLE_STRESS_REGISTRATIONS", 1000))
+    WORKERS = 32
+
+    def setUp(self):
+        self.event = DebattleEvent.objects.create(title="Наплыв", slug="rush", start_at=timezone.now())
+        self.url = reverse("debattle_register", kwargs={"slug": self.event.slug})
+
+    def _register(self, i: int) -> int:
+        try:
+            response = Client().post(self.url, {
+                "name": f"Команда {i}",
+                "form-TOTAL_FORMS": "2",
+                "form-INITIAL_FORMS": "0",
+                "form-MIN_NUM_FORMS": "0",
+                "form-MAX_NUM_FORMS": "2",
+                "form-0-name": f"Участник {i}-1",
+                "form-0-bio": "",
+                "form-1-name": f"Участник {i}-2",
+                "form-1-bio": "",
+            })
+            return response.status_code
+        finally:
+            connection.close()
+
+    def test_concurrent_registrations_keep_four_team_invariant(self):
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as pool:
+            statuses = list(pool.map(self._register, range(self.REGISTRATIONS)))
+
+        self.assertEqual(statuses.count(302), self.REGISTRATIONS)
+
+        tours = list(Tour.objects.filter(event=self.event).annotate(cnt=Count("teams")).order_by("number"))
+        self.assertEqual(sum(t.cnt for t in tours), self.REGISTRATIONS)
+        self.assertEqual(len(tours), self.REGISTRATIONS // 4)
+        for tour in tours:
+            self.assertEqual(tour.cnt, 4)
+            self.assertEqual(tour.team_count, 4)
+            self.assertEqual(tour.status, Tour.Status.CLOSED)
+        self.assertFalse(Team.objects.filter(event=self.event, tours__isnull=True).exists())
+
+
+class BenchHarnessTests(TestCase):
+    def test_percentile_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_recorder_summary(self):
+        recorder = Recorder()
+        for ms in (10, 20, 30, 40):
+            recorder.add("screen:get", ms, 3, ok=True)
+        recorder.add("screen:get", 50, None, ok=False)
+
+        row = recorder.summary(wall_seconds=1)["screen:get"]
+        self.assertEqual((row["count"], row["errors"], row["rps"]), (5, 1, 5.0))
+        self.assertEqual(row["p50_ms"], 30)
+        self.assertEqual(row["queries_per_request"], 3)
+
+    @modify_settings(MIDDLEWARE={"prepend": "debattle.middleware.QueryCountHeaderMiddleware"})
+    def test_query_count_header(self):
+        event = make_event("bench-header", 1)
+        url = reverse("debattle_state_json", args=[event.slug])
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=f'"{event.state_version}"')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["X-DB-Queries"], "1")
+
+
+class DatabaseProfileTests(TestCase):
+    def test_sqlite_profile_uses_wal(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], "wal")
+
+    def test_profiles(self):
+        base_dir = Path("/srv/debattle")
+        journal = build_databases("sqlite-journal", base_dir)
+        self.assertIn("journal_mode=DELETE", journal["default"]["OPTIONS"]["init_command"])
+        self.assertNotIn("replica", journal)
+
+        replica = build_databases("sqlite-replica", base_dir)["replica"]
+        self.assertEqual(replica["NAME"], "file:/srv/debattle/db.sqlite3?mode=ro")
+        self.assertEqual(replica["TEST"], {"MIRROR": "default"})
+
+        with mock.patch.dict(os.environ, {"DB_HOST": "db", "DB_REPLICA_HOST": "db-ro"}):
+            postgres = build_databases("postgres", base_dir)
+        self.assertTrue(postgres["default"]["CONN_HEALTH_CHECKS"])
+        self.assertEqual(postgres["default"]["CONN_MAX_AGE"], 60)
+        self.assertEqual(postgres["replica"]["HOST"], "db-ro")
+
+        with self.assertRaises(ValueError):
+            build_databases("mysql", base_dir)
+
+    def test_router_sends_only_flagged_reads_to_replica(self):
+        router = ReplicaRouter()
+        default = settings.DATABASES["default"]
+        with mock.patch.dict(settings.DATABASES, {"default": default, "replica": default}, clear=True):
+            self.assertIsNone(router.db_for_read(DebattleEvent))
+            with replica_reads():
+                self.assertEqual(router.db_for_read(DebattleEvent), "replica")
+                self.assertEqual(router.db_for_write(DebattleEvent), "default")
+            self.assertIsNone(router.db_for_read(DebattleEvent))
+
+        # Без настроенной реплики флаг ничего не меняет
+        with mock.patch.dict(settings.DATABASES, {"default": default}, clear=True), replica_reads():
+            self.assertIsNone(router.db_for_read(DebattleEvent))
+
+
+class PhotoRenditionTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+
+        event = DebattleEvent.objects.create(title="photos", slug="photos", start_at=timezone.now())
+        team = Team.objects.create(event=event, name="Команда")
+        buf = BytesIO()
+        Image.new("RGB", (4000, 3000), "red").save(buf, "JPEG")
+        self.participant = Participant.objects.create(
+            team=team, name="Участник", photo=SimpleUploadedFile("phone.jpg", buf.getvalue()),
+        )
+
+    def test_renditions_are_bounded_and_built_once(self):
+        self.assertIsNone(self.participant.screen_photo_url)
+
+        version = self.participant.team.event.state_version
+        self.assertTrue(build_renditions(self.participant.pk))
+        self.participant.refresh_from_db()
+        # Новые URL копий — новая версия состояния, экраны перечитают его
+        self.assertEqual(DebattleEvent.objects.get(pk=self.participant.team.event_id).state_version, version + 1)
+        with Image.open(self.participant.photo_screen) as screen:
+            self.assertEqual(screen.size, (800, 600))
+        with Image.open(self.participant.photo_thumb) as thumb:
+            self.assertEqual(thumb.size, (160, 120))
+        self.assertEqual(self.participant.photo_source, self.participant.photo.name)
+
+        # Тот же оригинал — повторно не кодируем
+        self.assertFalse(build_renditions(self.participant.pk))
+        self.assertEqual(DebattleEvent.objects.get(pk=self.participant.team.event_id).state_version, version + 1)
+
+    def test_rendition_served_immutable(self):
+        build_renditions(self.participant.pk)
+        self.participant.refresh_from_db()
+
+        url = self.participant.screen_photo_url
+        self.assertRegex(url, r"/debattle/photos/\d+-phone-screen\.[0-9a-f]{16}\.jpg$")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertTrue(b"".join(response.streaming_content).startswith(b"\xff\xd8"))
+
+        self.assertEqual(self.client.get("/debattle/photos/missing.jpg").status_code, 404)
+
+
+class EventContextTests(TestCase):
+    def setUp(self):
+        self.event = make_event("deb-context", 1)
+
+    def test_context_reused_until_version_changes(self):
+        get_event_context(self.event.slug)
+        with self.assertNumQueries(1):
+            context = get_event_context(self.event.slug)
+        self.assertEqual(context["event"].state, DebattleEvent.State.COUNTDOWN)
+
+        game_flow.reveal_themes(DebattleEvent.objects.get(pk=self.event.pk))
+        context = get_event_context(self.event.slug)
+        self.assertEqual(context["event"].state, DebattleEvent.State.REGISTRATION)
+
+    def test_each_request_gets_own_copy(self):
+        first = get_event_context(self.event.slug)
+        first["event"].state = DebattleEvent.State.FINISHED
+        self.assertEqual(get_event_context(self.event.slug)["event"].state, DebattleEvent.State.COUNTDOWN)
+
+    def test_criteria_and_jury_changes_bump_version(self):
+        version = self.event.state_version
+        ScoreCriterion.objects.create(event=self.event, title="Новый критерий", max_value=3)
+        user = User.objects.create(username="late-jury")
+        JuryMember.objects.create(user=user, event=self.event)
+
+        context = get_event_context(self.event.slug)
+        self.assertEqual(context["event"].state_version, version + 2)
+        self.assertEqual(len(context["criteria"]), 6)
+        self.assertEqual([j.user_id for j in context["jurors"]], [user.pk])
+
+
+class ScheduleTests(TestCase):
+    def setUp(self):
+        self.event = make_event("deb-schedule", 3)
+
+    def test_pairs_and_themes_per_tour(self):
+        self.assertEqual(generate_schedule(self.event, seed=7), 6)
+
+        for tour in self.event.tours.all():
+            matches = list(Match.objects.filter(tour=tour).order_by("slot"))
+            self.assertEqual([m.slot for m in matches], [1, 2])
+            teams = [t for m in matches for t in (m.team_a_id, m.team_b_id)]
+            self.assertCountEqual(teams, tour.teams.values_list("id", flat=True))
+            self.assertEqual(len({m.theme_id for m in matches}), 2)
+            self.assertTrue(all({m.team_a_position, m.team_b_position} == set(Match.Position) for m in matches))
+
+        # Уже спланированные туры повторно не трогаем
+        self.assertEqual(generate_schedule(self.event, seed=7), 0)
+
+    def test_plan_reproducible_from_recorded_seed(self):
+        generate_schedule(self.event)
+        theme_ids = list(self.event.themes.values_list("id", flat=True))
+
+        for tour in self.event.tours.all():
+            self.assertIsNotNone(tour.draw_seed)
+            plan = draw_tour(tour.teams.values_list("id", flat=True), theme_ids, tour.draw_seed)
+            stored = Match.objects.filter(tour=tour).order_by("slot").values_list(
+                "team_a_id", "team_b_id", "theme_id", "team_a_position"
+            )
+            self.assertEqual(plan, list(stored))
+
+    def test_registration_seals_full_tour(self):
+        event = DebattleEvent.objects.create(title="Печать", slug="deb-seal", start_at=timezone.now())
+        Theme.objects.bulk_create([Theme(event=event, order=i, title=f"Тема {i}") for i in range(3)])
+        for i in range(4):
+            tour = add_team_to_tour(event, Team.objects.create(event=event, name=f"Команда {i}"))
+            self.assertEqual(tour.matches.count(), 2 if i == 3 else 0)
+
+        self.assertEqual(tour.status, Tour.Status.CLOSED)
+        self.assertIsNotNone(tour.draw_seed)
+        self.assertEqual(seal_tour(tour), 0)
+
+    def test_registration_kept_when_seal_and_publish_fail(self):
+        # Место закоммичено — печать и рассылка best-effort, регистрация их ошибок не видит
+        event = DebattleEvent.objects.create(title="Сбой", slug="deb-seal-fail", start_at=timezone.now())
+        url = reverse("debattle_register", kwargs={"slug": event.slug})
+        with mock.patch("debattle.services.seal_tour", side_effect=RuntimeError("сбой")), \
+                mock.patch("debattle.services.commit_state_change", side_effect=OperationalError("locked")), \
+                self.assertLogs("debattle.services", "ERROR"):
+            for i in range(4):
+                response = self.client.post(url, {
+                    "name": f"Команда {i}",
+                    "form-TOTAL_FORMS": "2", "form-INITIAL_FORMS": "0",
+                    "form-MIN_NUM_FORMS": "0", "form-MAX_NUM_FORMS": "2",
+                    "form-0-name": f"Участник {i}-1", "form-1-name": f"Участник {i}-2",
+                })
+                self.assertEqual(response.status_code, 302)
+
+        tour = Tour.objects.get(event=event)
+        self.assertEqual((tour.team_count, tour.status, tour.teams.count()), (4, Tour.Status.CLOSED, 4))
+
+    def test_live_transitions_do_not_draw(self):
+        generate_schedule(self.event, seed=3)
+        with CaptureQueriesContext(connection) as roulette:
+            game_flow.start_roulette(self.event)
+        with CaptureQueriesContext(connection) as first_round:
+            game_flow.start_next_round(DebattleEvent.objects.get(pk=self.event.pk))
+
+        self.assertFalse(any("debattle_tourteam" in q["sql"] for q in roulette.captured_queries))
+        self.assertFalse(any('FROM "debattle_theme"' in q["sql"] for q in first_round.captured_queries))
+
+    def test_roulette_takes_scheduled_matches_in_order(self):
+        generate_schedule(self.event, seed=1)
+
+        first = game_flow.start_roulette(self.event)
+        self.assertEqual((first.slot, first.status), (1, Match.Status.RUNNING))
+
+        second = game_flow.start_roulette(DebattleEvent.objects.get(pk=self.event.pk))
+        self.assertEqual(second.slot, 2)
+        self.assertEqual(second.tour_id, first.tour_id)
+        first.refresh_from_db()
+        self.assertEqual(first.status, Match.Status.DONE)
+
+
+class CommandQueueTests(TransactionTestCase):
+    # Команды пульта из параллельных запросов: исполнитель мероприятия применяет их по одной
+    def setUp(self):
+        self.event = make_event("deb-queue", 2)
+
+    def _submit_all(self, count: int, action: str, expected_version: int | None) -> list:
+        def submit(_i):
+            try:
+                return submit_command(self.event.id, action, expected_version)
+            except ValueError as e:
+                return e
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=count) as pool:
+            return list(pool.map(submit, range(count)))
+
+    def test_double_click_with_same_version_applies_once(self):
+        results = self._submit_all(8, "start_roulette", self.event.control_version)
+
+        self.assertEqual(sum(isinstance(r, Match) for r in results), 1)
+        self.assertTrue(all(isinstance(r, StaleCommandError) for r in results if not isinstance(r, Match)))
+        self.assertEqual(Match.objects.filter(tour__event=self.event).count(), 1)
+
+    def test_commands_timed_with_commit(self):
+        # Замер — по команде очереди, вокруг транзакции _apply; отклонённая тоже учитывается
+        reset_metrics()
+        submit_command(self.event.id, "start_roulette")
+        with self.assertRaises(StaleCommandError):
+            submit_command(self.event.id, "start_roulette", expected_version=-1)
+        _buckets, total, count = TRANSITION_SECONDS._series[("start_roulette",)]
+        self.assertEqual(count, 2)
+        self.assertGreater(total, 0)
+
+        # Прямой вызов game_flow мимо очереди в метрику не попадает — нет внешнего коммита
+        game_flow.reveal_themes(DebattleEvent.objects.get(pk=self.event.pk))
+        self.assertNotIn(("reveal_themes",), TRANSITION_SECONDS._series)
+
+    def test_rounds_are_not_skipped(self):
+        submit_command(self.event.id, "start_roulette")
+        results = self._submit_all(5, "start_round", None)
+
+        self.assertEqual(sorted(r.number for r in results if isinstance(r, Round)), [1, 2, 3])
+        self.assertEqual(DebattleEvent.objects.get(pk=self.event.pk).current_round_number, 3)
+
+    def test_control_rejects_stale_version(self):
+        staff = User.objects.create(username="operator", is_staff=True)
+        self.client.force_login(staff)
+        url = reverse("debattle_control", kwargs={"slug": self.event.slug})
+        version = self.event.control_version
+
+        self.client.post(url, {"action": "reveal_themes", "control_version": version})
+        response = self.client.post(url, {"action": "start_roulette", "control_version": version}, follow=True)
+
+        self.assertTrue(any("устарела" in str(m) for m in response.context["messages"]))
+        self.assertFalse(Match.objects.filter(tour__event=self.event).exists())
+
+    def test_control_not_stale_after_registration_or_jury(self):
+        # Регистрация команд и итоги жюри двигают state_version, но не версию пульта
+        self.client.force_login(User.objects.create(username="operator", is_staff=True))
+        url = reverse("debattle_control", kwargs={"slug": self.event.slug})
+        page = self.client.get(url)
+        version = page.context["event"].control_version
+        self.assertContains(page, f'name="control_version" value="{version}"')
+
+        DebattleEvent.objects.get(pk=self.event.pk).bump_state_version()
+        self.client.post(url, {"action": "start_roulette", "control_version": version})
+        self.assertTrue(Match.objects.filter(tour__event=self.event).exists())
+
+        # generate_schedule state_version не двигает — пульт всё равно видит новую версию
+        self.client.post(url, {"action": "generate_schedule", "control_version": version + 1})
+        self.assertEqual(self.client.get(url).context["event"].control_version, version + 2)
+
+    def test_control_malformed_version(self):
+        self.client.force_login(User.objects.create(username="operator", is_staff=True))
+        url = reverse("debattle_control", kwargs={"slug": self.event.slug})
+        response = self.client.post(url, {"action": "reveal_themes", "control_version": "x"}, follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(any("Ошибка" in str(m) for m in response.context["messages"]))
+
+    def test_trace_starts_when_command_is_queued(self):
+        # Время ожидания в очереди входит в задержку до экранов
+        with mock.patch("debattle.tracing.now_ms", side_effect=[1000, 9000]):
+            submit_command(self.event.id, "reveal_themes")
+        entry = EventLogEntry.objects.filter(event=self.event).latest("seq")
+        self.assertEqual(entry.data["trace"]["ts"], 1000)
+
+
+class EventLogTests(TestCase):
+    def setUp(self):
+        self.event = make_event("deb-log", 1)
+        self.jury = JuryMember.objects.create(user=User.objects.create(username="jury-log"), event=self.event)
+        self.criteria = list(self.event.criteria.order_by("id"))
+
+    def _play_round(self) -> Match:
+        game_flow.reveal_themes(self.event)
+        match = game_flow.start_roulette(self.event)
+        game_flow.start_next_round(self.event)
+        game_flow.open_voting(self.event)
+        upsert_scores(match, self.jury, [(match.team_a_id, c.id, 2) for c in self.criteria])
+        upsert_scores(match, self.jury, [(match.team_a_id, self.criteria[0].id, 3)])
+        game_flow.close_voting(self.event)
+        return match
+
+    def test_rebuilt_state_matches_database(self):
+        match = self._play_round()
+        state = rebuild_state(self.event.id)
+
+        event = DebattleEvent.objects.get(pk=self.event.pk)
+        self.assertEqual(state["event"], {name: getattr(event, name) for name in EVENT_FIELDS})
+        self.assertEqual(state["version"], event.state_version)
+        self.assertEqual(state["round"], {"number": 1, "status": Round.Status.LOCKED})
+        card = state["scores"][str(match.id)][str(self.jury.id)]
+        self.assertEqual(card[f"{match.team_a_id}:{self.criteria[0].id}"], 3)
+        self.assertEqual(len(card), 5)
+
+        kinds = list(EventLogEntry.objects.filter(event=self.event).values_list("kind", flat=True))
+        self.assertEqual(kinds, [
+            "config", "reveal_themes", "start_roulette", "start_next_round", "open_voting",
+            "scores", "scores", "close_voting",
+        ])
+
+    def test_event_deletion_leaves_no_log(self):
+        self._play_round()
+        Match.objects.filter(tour__event=self.event).delete()
+        self.event.delete()
+        self.assertFalse(EventLogEntry.objects.exists())
+
+    def test_snapshot_plus_tail_equals_full_replay(self):
+        with mock.patch("debattle.event_log.SNAPSHOT_EVERY", 3):
+            self._play_round()
+        self.assertEqual(list(EventSnapshot.objects.filter(event=self.event).values_list("seq", flat=True)), [3, 6])
+
+        full = empty_state()
+        for row in EventLogEntry.objects.filter(event=self.event).values_list("seq", "kind", "version", "data"):
+            apply_entry(full, *row)
+        self.assertEqual(rebuild_state(self.event.id), full)
+
+        with self.assertNumQueries(2):
+            # Снимок на start_roulette (seq 3) + одна запись хвоста
+            first_round = rebuild_state(self.event.id, upto_seq=4)
+        self.assertEqual(first_round["event"]["state"], DebattleEvent.State.ROUND_ACTIVE)
+        self.assertEqual(first_round["round"], {"number": 1, "status": Round.Status.ACTIVE})
+        self.assertEqual(first_round["scores"], {})
+
+
+    def test_only_transitions_lock_event_row(self):
+        # Оценки жюри не встают в очередь за блокировкой мероприятия
+        events = DebattleEvent.objects
+        with mock.patch.object(connection.features, "has_select_for_update", True), \
+                mock.patch.object(events, "select_for_update", return_value=events.all()) as lock:
+            event_log.append(self.event.id, "scores", {"match_id": 0, "jury_id": self.jury.id, "cells": {}})
+            lock.assert_not_called()
+            event_log.append(self.event.id, "config", {}, version=7)
+            lock.assert_called_once()
+
+    def test_seq_collision_retried(self):
+        # Встречная запись заняла тот же seq: уникальность (event, seq) отбила вставку, повторяем
+        create = EventLogEntry.objects.create
+        last_seq = EventLogEntry.objects.filter(event=self.event).count()
+        attempts = []
+
+        def racing_create(**kwargs):
+            attempts.append(kwargs["seq"])
+            if len(attempts) == 1:
+                raise IntegrityError("UNIQUE constraint failed: debattle_eventlogentry.event_id, debattle_eventlogentry.seq")
+            return create(**kwargs)
+
+        with mock.patch.object(EventLogEntry.objects, "create", side_effect=racing_create):
+            entry = event_log.append(self.event.id, "scores", {"match_id": 0, "jury_id": self.jury.id, "cells": {}})
+
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual((entry.seq, entry.kind), (last_seq + 1, "scores"))
+
+    def test_admin_cannot_delete_entries(self):
+        game_flow.reveal_themes(self.event)
+        entry = EventLogEntry.objects.filter(event=self.event).first()
+        self.client.force_login(User.objects.create_superuser(username="log-admin", password="x"))
+
+        response = self.client.post(reverse("admin:debattle_eventlogentry_delete", args=[entry.pk]), {"post": "yes"})
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(EventLogEntry.objects.filter(pk=entry.pk).exists())
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.event = make_event("deb-export", 1)
+        self.match = game_flow.start_roulette(self.event)
+        self.criteria = list(self.event.criteria.order_by("id"))
+        self.jurors = [
+            JuryMember.objects.create(user=User.objects.create(username=f"jury-export-{i}"), event=self.event)
+            for i in range(2)
+        ]
+        for jury in self.jurors:
+            upsert_scores(self.match, jury, [(self.match.team_a_id, c.id, 2) for c in self.criteria])
+        submit_jury_match(
+            DebattleEvent.objects.get(pk=self.event.pk),
+            JuryMatchSubmission.objects.get(match=self.match, jury=self.jurors[0]),
+        )
+
+        self.url = reverse("debattle_export", kwargs={"slug": self.event.slug})
+        self.client.force_login(User.objects.create(username="operator", is_staff=True))
+
+    def test_csv_submitted_only_matches_results(self):
+        response = self.client.get(self.url, {"table": "scores", "submitted_only": "1"})
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(lines[0], "match_id,jury_id,team_id,team,criterion_id,criterion,value")
+        self.assertEqual(len(lines), 1 + len(self.criteria))
+        self.assertTrue(all(line.split(",")[1] == str(self.jurors[0].id) for line in lines[1:]))
+
+        everyone = "".join(export_lines(self.event, "scores", "csv")).splitlines()
+        self.assertEqual(len(everyone), 1 + 2 * len(self.criteria))
+
+    def test_ndjson_all_tables(self):
+        response = self.client.get(self.url, {"format": "ndjson"})
+        records = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+
+        tables = {r["table"] for r in records}
+        self.assertEqual(tables, {"matches", "submissions", "scores"})
+        self.assertEqual(sum(r["table"] == "scores" for r in records), 2 * len(self.criteria))
+        self.assertEqual(self.client.get(self.url, {"table": "all"}).status_code, 400)
+
+    def test_staff_only(self):
+        self.client.force_login(User.objects.create(username="guest"))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    async def test_streams_asynchronously_under_asgi(self):
+        staff = await User.objects.aget(username="operator")
+        await self.async_client.aforce_login(staff)
+        response = await self.async_client.get(self.url, {"table": "matches"})
+
+        self.assertTrue(response.is_async)
+        body = b"".join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(len(body.splitlines()), 2)
+
+
+class StandingsTests(TestCase):
+    def setUp(self):
+        self.event = make_event("deb-standings", 1)
+        self.criteria = list(self.event.criteria.order_by("id"))
+        self.jurors = [
+            JuryMember.objects.create(user=User.objects.create(username=f"jury-standings-{i}"), event=self.event)
+            for i in range(3)
+        ]
+
+    def _event(self) -> DebattleEvent:
+        return DebattleEvent.objects.get(pk=self.event.pk)
+
+    def _score_and_submit(self, match: Match, jury: JuryMember, a: int, b: int) -> None:
+        upsert_scores(match, jury, [(match.team_a_id, c.id, a) for c in self.criteria])
+        upsert_scores(match, jury, [(match.team_b_id, c.id, b) for c in self.criteria])
+        submit_jury_match(self._event(), JuryMatchSubmission.objects.get(match=match, jury=jury))
+
+    def _play_match(self) -> Match:
+        match = game_flow.start_roulette(self._event())
+        for _ in range(game_flow.ROUNDS_PER_MATCH):
+            game_flow.start_next_round(self._event())
+            game_flow.open_voting(self._event())
+            game_flow.close_voting(self._event())
+        return match
+
+    def test_tie_broken_by_criteria_in_order(self):
+        match = Match(team_a_id=1, team_b_id=2)
+        c1, c2 = self.criteria[0].id, self.criteria[1].id
+        results = {
+            "team_totals": {1: 5, 2: 5},
+            "team_by_criterion": {1: {c1: 2, c2: 3}, 2: {c1: 3, c2: 2}},
+        }
+        self.assertEqual(pick_winner(match, results, [c1, c2]), 2)
+        self.assertIsNone(pick_winner(match, {"team_totals": {}, "team_by_criterion": {}}, [c1, c2]))
+
+    def test_final_round_resolves_winner_and_standings(self):
+        match = game_flow.start_roulette(self._event())
+        self._score_and_submit(match, self.jurors[0], 3, 1)
+        for _ in range(game_flow.ROUNDS_PER_MATCH):
+            game_flow.start_next_round(self._event())
+            game_flow.open_voting(self._event())
+            match.refresh_from_db()
+            self.assertIsNone(match.winner_id)
+            game_flow.close_voting(self._event())
+
+        match.refresh_from_db()
+        self.assertEqual((match.winner_id, match.status), (match.team_a_id, Match.Status.DONE))
+        self.assertEqual((match.team_a_total, match.team_b_total), (15, 5))
+
+        response = self.client.get(reverse("debattle_standings_json", kwargs={"slug": self.event.slug}))
+        standings = response.json()["standings"]
+        self.assertEqual([s["team_id"] for s in standings], [match.team_a_id, match.team_b_id])
+        self.assertEqual((standings[0]["wins"], standings[1]["losses"]), (1, 1))
+        self.assertEqual(self._event_screen_state()["standings"], standings)
+
+    def test_late_submission_re_resolves_without_double_counting(self):
+        match = self._play_match()
+        match.refresh_from_db()
+        self.assertIsNone(match.winner_id)
+
+        self._score_and_submit(match, self.jurors[1], 1, 2)
+        self._score_and_submit(match, self.jurors[2], 1, 3)
+
+        match.refresh_from_db()
+        self.assertEqual(match.winner_id, match.team_b_id)
+        row = TeamStanding.objects.get(event=self.event, team_id=match.team_b_id)
+        self.assertEqual((row.played, row.wins, row.score_for, row.score_against), (1, 1, 25, 10))
+
+    def _event_screen_state(self) -> dict:
+        return self.client.get(reverse("debattle_state_json", kwargs={"slug": self.event.slug})).json()
+
+
+class ImportTests(TestCase):
+    def setUp(self):
+        self.event = DebattleEvent.objects.create(title="Импорт", slug="deb-import", start_at=timezone.now())
+        Theme.objects.bulk_create([Theme(event=self.event, order=i, title=f"Тема {i}") for i in range(9)])
+
+    def _teams_csv(self, names, delimiter=",") -> str:
+        header = delimiter.join(("team", "participant_1", "participant_2", "bio_1"))
+        rows = [delimiter.join((name, f"{name} / 1", f"{name} / 2", "—")) for name in names]
+        return "\n".join([header, *rows]) + "\n"
+
+    def test_tops_up_open_tour_then_fills_new_ones(self):
+        # Регистрация уже открыла тур и заняла в нём одно место
+        add_team_to_tour(self.event, Team.objects.create(event=self.event, name="Ранняя"))
+
+        result = import_event(self.event, teams_csv=self._teams_csv([f"Команда {i}" for i in range(10)], ";"))
+
+        self.assertEqual((result["teams"], result["tours"]), (10, 2))
+        tours = list(Tour.objects.filter(event=self.event).order_by("number").annotate(n=Count("tourteam")))
+        self.assertEqual([(t.team_count, t.n, t.status) for t in tours], [
+            (4, 4, Tour.Status.CLOSED), (4, 4, Tour.Status.CLOSED), (3, 3, Tour.Status.OPEN),
+        ])
+        # Набранные туры сразу запечатаны, по 2 матча
+        self.assertEqual(result["matches"], 4)
+        self.assertEqual(Participant.objects.filter(team__event=self.event).count(), 20)
+
+        # Следующая регистрация добирает тот же открытый тур
+        tour = add_team_to_tour(self.event, Team.objects.create(event=self.event, name="Поздняя"))
+        self.assertEqual((tour.number, tour.status), (3, Tour.Status.CLOSED))
+
+    def test_whole_file_validated_before_writing(self):
+        Team.objects.create(event=self.event, name="Была")
+        teams_csv = self._teams_csv(["Новая", "Была", "Новая"]) + "Без участника,Кто-то,\n"
+        jury_csv = "username,display_name\njudge,Судья\n"
+
+        with self.assertRaises(ImportFileError) as raised:
+            import_event(self.event, teams_csv=teams_csv, jury_csv=jury_csv)
+
+        self.assertEqual(raised.exception.errors, [
+            "Команды, строка 3: команда «Была» уже есть в мероприятии",
+            "Команды, строка 4: команда «Новая» повторяется в файле",
+            "Команды, строка 5: пустое поле «participant_2»",
+        ])
+        self.assertEqual(Team.objects.filter(event=self.event).count(), 1)
+        self.assertFalse(User.objects.filter(username="judge").exists())
+
+    def test_jury_import_creates_users_and_refreshes_context(self):
+        User.objects.create(username="existing")
+        get_event_context(self.event.slug)
+
+        result = import_event(self.event, jury_csv="username,display_name,password\nnew,Новый,secret\nexisting,,\n")
+
+        self.assertEqual(result["jury"], 2)
+        new = JuryMember.objects.get(user__username="new")
+        self.assertEqual(new.display_name, "Новый")
+        self.assertTrue(new.user.check_password("secret"))
+        self.assertEqual(JuryMember.objects.get(user__username="existing").event, self.event)
+        self.assertEqual(len(get_event_context(self.event.slug)["jurors"]), 2)
+
+        with self.assertRaises(ImportFileError):
+            import_event(self.event, jury_csv="username\nnew\n")
+
+    def test_admin_action(self):
+        staff = User.objects.create_superuser(username="admin-import", password="x")
+        self.client.force_login(staff)
+        url = reverse("admin:debattle_debattleevent_changelist")
+        upload = SimpleUploadedFile("teams.csv", self._teams_csv(["А", "Б", "В", "Г"]).encode("utf-8-sig"))
+
+        response = self.client.post(url, {
+            "action": "import_csv", "_selected_action": [self.event.pk], "apply": "1", "teams": upload,
+        })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Tour.objects.get(event=self.event).status, Tour.Status.CLOSED)
+        self.assertEqual(Match.objects.filter(tour__event=self.event).count(), 2)
+
+
+class EventAdminTests(TestCase):
+    def setUp(self):
+        self.event = make_event("deb-admin", 1)
+        self.client.force_login(User.objects.create_superuser(username="event-admin", password="x"))
+        self.url = reverse("admin:debattle_debattleevent_change", args=[self.event.pk])
+
+    def _form_data(self, response) -> dict:
+        # То, что отправил бы браузер со страницы изменения без правок
+        forms = [response.context["adminform"].form]
+        for inline in response.context["inline_admin_formsets"]:
+            forms += [inline.formset.management_form, *inline.formset.forms]
+
+        data = {}
+        for form in forms:
+            for name in form.fields:
+                key, value = form.add_prefix(name), form[name].value()
+                if isinstance(value, datetime.datetime):
+                    data[f"{key}_0"], data[f"{key}_1"] = value.date().isoformat(), value.time().isoformat()
+                elif value is True:
+                    data[key] = "on"
+                elif value is not None and value is not False:
+                    data[key] = value
+        return data
+
+    def test_stale_form_keeps_versions(self):
+        data = self._form_data(self.client.get(self.url))
+        # Пока форма открыта, идут переходы
+        apply_command(self.event.id, "reveal_themes", {}, 0)
+        current = DebattleEvent.objects.get(pk=self.event.pk)
+        self.assertEqual(current.control_version, 1)
+
+        data.update(title="Новое название", state_version=0, control_version=0)
+        response = self.client.post(self.url, data)
+        self.assertEqual(response.status_code, 302)
+        event = DebattleEvent.objects.get(pk=self.event.pk)
+        self.assertEqual(event.title, "Новое название")
+        # Правка — сама переход: версия только растёт
+        self.assertEqual(event.state_version, current.state_version + 1)
+        # Команда, отправленная со старого пульта, по-прежнему устарела
+        self.assertEqual(event.control_version, 1)
+        with self.assertRaises(StaleCommandError):
+            apply_command(self.event.id, "reveal_themes", {}, 0)
+
+    def test_tour_change_and_delete_bump_version(self):
+        tour = Tour.objects.get(event=self.event, number=1)
+        url = reverse("admin:debattle_tour_change", args=[tour.pk])
+        data = self._form_data(self.client.get(url))
+        data["team_count"] = 2
+        self.assertEqual(self.client.post(url, data).status_code, 302)
+        event = DebattleEvent.objects.get(pk=self.event.pk)
+        self.assertEqual(event.state_version, self.event.state_version + 1)
+
+        # Удаление тура (и его состава) — тоже переход
+        url = reverse("admin:debattle_tour_delete", args=[tour.pk])
+        self.assertEqual(self.client.post(url, {"post": "yes"}).status_code, 302)
+        self.assertFalse(Tour.objects.filter(pk=tour.pk).exists())
+        self.assertEqual(DebattleEvent.objects.get(pk=self.event.pk).state_version, event.state_version + 1)
+        self.assertEqual(EventLogEntry.objects.filter(event=self.event).latest("seq").kind, "config")
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        reset_metrics()
+        self.event = make_event("deb-metrics", 1)
+        self.url = reverse("metrics")
+
+    def _series(self, histogram, labels: tuple) -> list:
+        return histogram._series[labels]
+
+    def test_request_metrics_per_view_and_method(self):
+        self.client.get(reverse("debattle_screen", kwargs={"slug": self.event.slug}))
+
+        _buckets, queries, count = self._series(REQUEST_QUERIES, ("debattle_screen", "GET"))
+        self.assertEqual(count, 1)
+        self.assertGreater(queries, 0)
+        self.assertGreater(self._series(REQUEST_TEMPLATE_SECONDS, ("debattle_screen", "GET"))[1], 0)
+
+        self.client.post(reverse("debattle_screen", kwargs={"slug": self.event.slug}))
+        self.assertIn(("debattle_screen", "POST"), REQUEST_QUERIES._series)
+
+    def test_prometheus_text_format(self):
+        with timed_transition("reveal_themes"):
+            pass
+        lines = render_metrics().splitlines()
+
+        self.assertIn("# TYPE debattle_transition_duration_seconds histogram", lines)
+        self.assertIn('debattle_transition_duration_seconds_bucket{action="reveal_themes",le="+Inf"} 1', lines)
+        self.assertIn('debattle_transition_duration_seconds_count{action="reveal_themes"} 1', lines)
+
+    def test_staff_or_token_only(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+        with override_settings(DEBATTLE_METRICS_TOKEN="secret"):
+            self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+            response = self.client.get(self.url, HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+
+        self.client.force_login(User.objects.create(username="metrics-staff", is_staff=True))
+        self.assertIn("debattle_http_request_duration_seconds_bucket", self.client.get(self.url).content.decode())
+
+
+class StatePublishTests(TestCase):
+    def setUp(self):
+        self.event = make_event("deb-publish", 1)
+        self.layer = get_channel_layer()
+        self.channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(event_group_name(self.event.slug), self.channel)
+
+    def _received(self) -> list:
+        messages = []
+        while True:
+            try:
+                messages.append(async_to_sync(asyncio.wait_for)(self.layer.receive(self.channel), 0.05)["payload"])
+            except asyncio.TimeoutError:
+                return messages
+
+    def test_delta_sent_only_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            game_flow.reveal_themes(self.event)
+            # Транзакция ещё открыта — экраны ничего не получили
+            self.assertEqual(self._received(), [])
+        self.assertTrue(callbacks)
+
+        for callback in callbacks:
+            callback()
+        [payload] = self._received()
+        self.assertEqual((payload["kind"], payload["version"]), ("reveal_themes", self.event.state_version))
+        self.assertTrue(payload["themes_revealed"])
+
+    def test_rolled_back_change_not_sent(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                game_flow.reveal_themes(self.event)
+                raise RuntimeError("откат")
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self._received(), [])
+
+
+class DeliveryTracingTests(TestCase):
+    def setUp(self):
+        self.event = make_event("deb-trace", 1)
+        cache.clear()
+
+    def _trace(self, trace_id: str, ts: int = 100_000) -> None:
+        # Переход в журнале, как его пишет commit_state_change
+        seq = EventLogEntry.objects.filter(event=self.event).count() + 1
+        EventLogEntry.objects.create(
+            event=self.event, seq=seq, kind="round", version=3, data={"trace": {"id": trace_id, "ts": ts}}
+        )
+
+    def _ack(self, trace_id: str, client: str, latency: int, ts: int = 100_000) -> bool:
+        with mock.patch("debattle.tracing.now_ms", return_value=ts + latency):
+            return record_ack(self.event.id, {
+                "type": "ack", "trace": {"id": trace_id, "ts": 0}, "kind": "fake", "version": 99, "client": client,
+            })
+
+    def test_delta_carries_trace_to_screens(self):
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(event_group_name(self.event.slug), channel)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            game_flow.reveal_themes(self.event)
+        payload = async_to_sync(layer.receive)(channel)["payload"]
+
+        entry = EventLogEntry.objects.filter(event=self.event).latest("seq")
+        self.assertEqual(payload["trace"], entry.data["trace"])
+        self.assertRegex(payload["trace"]["id"], r"^[0-9a-f]{32}$")
+
+    def test_ack_measured_from_server_start(self):
+        # Время, вид и версия из подтверждения игнорируются; trace известен из кэша — без поиска в журнале
+        with mock.patch("debattle.tracing.now_ms", return_value=5000):
+            with self.captureOnCommitCallbacks(execute=True):
+                game_flow.reveal_themes(self.event)
+        entry = EventLogEntry.objects.filter(event=self.event).latest("seq")
+        trace_id = entry.data["trace"]["id"]
+
+        with self.assertNumQueries(1):
+            self.assertTrue(self._ack(trace_id, "hall", 40, ts=5000))
+        ack = DeliveryAck.objects.get(event=self.event)
+        self.assertEqual((ack.latency_ms, ack.kind, ack.version), (40, entry.kind, entry.version))
+
+    def test_unknown_trace_dropped(self):
+        self.assertFalse(self._ack("d" * 32, "hall", 10))
+        # Переход другого мероприятия этому не засчитывается
+        other = make_event("deb-trace-other", 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            game_flow.reveal_themes(other)
+        trace_id = EventLogEntry.objects.filter(event=other).latest("seq").data["trace"]["id"]
+        self.assertFalse(self._ack(trace_id, "hall", 10))
+        # Отказ запомнен — повтор мусора в БД не ходит
+        with self.assertNumQueries(0):
+            self.assertFalse(self._ack("d" * 32, "lobby", 10))
+        self.assertFalse(DeliveryAck.objects.exists())
+
+    def test_summary_per_screen_and_transition(self):
+        a, b = "a" * 32, "b" * 32
+        self._trace(a)
+        self._trace(b)
+        self._ack(a, "hall", 40)
+        self._ack(a, "lobby", 300)
+        self._ack(b, "hall", 60)
+        self._ack(b, "lobby", 80)
+        # Повтор подтверждения и мусор не учитываются
+        self._ack(a, "hall", 999)
+        self.assertFalse(self._ack("not-a-trace", "hall", 10))
+        self.assertFalse(self._ack(b, "hall", -5))
+
+        summary = latency_summary(self.event.id)
+
+        self.assertEqual(summary["acks"], {"count": 4, "p50": 60, "p99": 300, "max": 300})
+        # До последнего экрана: переход a — 300 мс, b — 80 мс
+        self.assertEqual(summary["propagation"], {"count": 2, "p50": 80, "p99": 300, "max": 300})
+        self.assertEqual([c["client"] for c in summary["slowest_clients"]], ["lobby", "hall"])
+
+        lines = list(export_lines(self.event, "deliveries", "csv"))
+        self.assertEqual(lines[0], "trace_id,kind,version,client,latency_ms,created_at\r\n")
+        self.assertEqual(len(lines), 5)
+
+    def test_latency_json_staff_only(self):
+        url = reverse("debattle_latency_json", kwargs={"slug": self.event.slug})
+        self.client.force_login(User.objects.create(username="viewer"))
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(User.objects.create(username="latency-staff", is_staff=True))
+        self.assertEqual(self.client.get(url).json()["acks"]["count"], 0)
+
+
+class ScreenAckConsumerTests(TransactionTestCase):
+    # database_sync_to_async закрывает соединения — в TestCase это ломает его транзакцию
+    def setUp(self):
+        self.event = make_event("deb-ack", 1)
+        cache.clear()
+
+    def test_screen_acks_over_websocket(self):
+        EventLogEntry.objects.create(
+            event=self.event, seq=1, kind="round", version=2,
+            data={"trace": {"id": "c" * 32, "ts": int(time.time() * 1000) - 25}},
+        )
+
+        async def scenario():
+            application = URLRouter(websocket_urlpatterns)
+            communicator = WebsocketCommunicator(application, f"/ws/debattle/{self.event.slug}/")
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            # Одно подтверждение на переход от соединения, под каким бы именем экран ни слал
+            for client in ("hall", "hall-2", "hall-3"):
+                await communicator.send_json_to({"type": "ack", "trace": {"id": "c" * 32, "ts": 0}, "client": client})
+            await communicator.send_json_to({"type": "ack", "trace": {"id": "e" * 32}, "client": "hall"})
+            await communicator.send_json_to({"type": "ack", "trace": "junk", "client": "hall"})
+            # Подтверждение без ответа — закрытие дожидается его обработки
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+        ack = DeliveryAck.objects.get(event=self.event)
+        self.assertEqual((ack.client, ack.kind, ack.version), ("hall", "round", 2))
+        self.assertGreaterEqual(ack.latency_ms, 25)
+        self.assertLess(ack.latency_ms, MAX_ACK_AGE_MS)
+
+    def test_screen_receives_committed_delta(self):
+        async def scenario():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f"/ws/debattle/{self.event.slug}/")
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await database_sync_to_async(game_flow.reveal_themes)(self.event)
+            delta = await communicator.receive_json_from(timeout=2)
+            await communicator.disconnect()
+            return delta
+
+        delta = async_to_sync(scenario)()
+        version = DebattleEvent.objects.get(pk=self.event.pk).state_version
+        self.assertEqual((delta["kind"], delta["version"]), ("reveal_themes", version))
+        self.assertEqual(delta["themes"], [f"Тема {i}" for i in range(9)])
+
+    def test_ping_answers_with_server_time(self):
+        async def scenario():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f"/ws/debattle/{self.event.slug}/")
+            await communicator.connect()
+            before = int(time.time() * 1000)
+            await communicator.send_json_to({"type": "ping", "t0": 12345})
+            pong = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return before, pong
+
+        before, pong = async_to_sync(scenario)()
+        self.assertEqual((pong["kind"], pong["t0"]), ("pong", 12345))
+        self.assertGreaterEqual(pong["server_ms"], before)
+
+
+    def test_long_poll_consumer_answers_new_version(self):
+        version = self.event.state_version
+
+        async def scenario():
+            communicator = HttpCommunicator(
+                URLRouter(http_urlpatterns), "GET", f"/debattle/{self.event.slug}/state/wait/",
+            )
+            communicator.scope["query_string"] = f"after={version - 1}".encode()
+            return await communicator.get_response()
+
+        response = async_to_sync(scenario)()
+        self.assertEqual(response["status"], 200)
+        self.assertIn((b"ETag", f'"{version}"'.encode()), response["headers"])
+        self.assertEqual(json.loads(response["body"])["version"], version)
+
+class RoundTimerTests(TestCase):
+    def setUp(self):
+        self.event = make_event("deb-timer", 1)
+        game_flow.start_roulette(self.event)
+
+    def _event(self) -> DebattleEvent:
+        return DebattleEvent.objects.get(pk=self.event.pk)
+
+    def test_round_starts_timer_and_screens_get_it(self):
+        start = timezone.now()
+        with mock.patch("django.utils.timezone.now", return_value=start):
+            rnd = game_flow.start_next_round(self._event(), duration=90)
+
+        timer = screen_state(self._event(), rnd=rnd)["timer"]
+        self.assertEqual(timer, {
+            "round": 1, "running": True, "remaining_ms": 90_000,
+            "ends_at": int(start.timestamp() * 1000) + 90_000,
+        })
+        # Переход ушёл в журнал вместе с таймером
+        self.assertEqual(rebuild_state(self.event.id)["timer"], timer)
+
+        # Без явной длительности — значение мероприятия
+        game_flow.start_next_round(self._event())
+        self.assertEqual(Round.objects.get(match=self._event().current_match, number=2).timer_remaining_ms, 180_000)
+
+    def test_pause_and_resume_keep_remaining_time(self):
+        start = timezone.now()
+        with mock.patch("django.utils.timezone.now", return_value=start):
+            game_flow.start_next_round(self._event(), duration=60)
+        with mock.patch("django.utils.timezone.now", return_value=start + timezone.timedelta(seconds=20)):
+            rnd = game_flow.stop_timer(self._event())
+        self.assertEqual((rnd.timer_remaining_ms, rnd.timer_started_at), (40_000, None))
+
+        with self.assertRaises(ValueError):
+            game_flow.stop_timer(self._event())
+
+        resumed = start + timezone.timedelta(seconds=100)
+        with mock.patch("django.utils.timezone.now", return_value=resumed):
+            rnd = game_flow.start_timer(self._event())
+        self.assertEqual(timer_payload(rnd)["ends_at"], int(resumed.timestamp() * 1000) + 40_000)
+
+        # Открытие голосования останавливает таймер
+        with mock.patch("django.utils.timezone.now", return_value=resumed + timezone.timedelta(seconds=50)):
+            game_flow.open_voting(self._event())
+        rnd.refresh_from_db()
+        self.assertEqual((rnd.timer_remaining_ms, rnd.timer_started_at), (0, None))
+        with self.assertRaises(ValueError):
+            game_flow.start_timer(self._event())
+
+    def test_control_passes_duration(self):
+        self.client.force_login(User.objects.create(username="timer-operator", is_staff=True))
+        url = reverse("debattle_control", kwargs={"slug": self.event.slug})
+        with mock.patch("debattle.views.submit_command") as submit:
+            submit.return_value = Round(number=1)
+            self.client.post(url, {"action": "start_round", "duration": "75", "control_version": "3"})
+        submit.assert_called_once_with(self.event.id, "start_round", 3, duration=75)
+
+    def test_timer_starts_only_in_active_round(self):
+        game_flow.start_next_round(self._event(), duration=60)
+        game_flow.stop_timer(self._event())
+        # Остаток есть, но раунд уже на голосовании
+        game_flow.open_voting(self._event())
+        with self.assertRaisesMessage(ValueError, "только в активном раунде"):
+            game_flow.start_timer(self._event())
+
+        rnd = Round.objects.get(match=self._event().current_match, number=1)
+        self.assertEqual(rnd.status, Round.Status.VOTING)
+        self.assertIsNone(rnd.timer_started_at)
+        self.assertGreater(rnd.timer_remaining_ms, 0)
+
+
+@mock.patch("debattle.audience._ensure_flusher")
+class AudienceTests(TestCase):
+    def setUp(self):
+        audience._ballots.clear()
+        self.addCleanup(audience._ballots.clear)
+        self.event = make_event("deb-audience", 1)
+        game_flow.start_roulette(self.event)
+        game_flow.start_next_round(self._event())
+        with self.captureOnCommitCallbacks(execute=True):
+            game_flow.open_voting(self._event())
+        match = self._event().current_match
+        self.team_a, self.team_b = match.team_a_id, match.team_b_id
+
+    def _event(self) -> DebattleEvent:
+        return DebattleEvent.objects.get(pk=self.event.pk)
+
+    def test_one_vote_per_device(self, _flusher):
+        slug = self.event.slug
+        self.assertTrue(audience.cast_vote(slug, "phone-1", self.team_a))
+        self.assertFalse(audience.cast_vote(slug, "phone-1", self.team_b))
+        self.assertTrue(audience.cast_vote(slug, "phone-2", self.team_b))
+        with self.assertRaises(ValueError):
+            audience.cast_vote(slug, "phone-3", -1)
+        self.assertEqual(
+            audience.live_tally(slug),
+            {"round": 1, "votes": {str(self.team_a): 1, str(self.team_b): 1}, "total": 2},
+        )
+
+        # Голоса пишутся пачкой сборщика, экраны получают счёт
+        with mock.patch.object(get_channel_layer(), "group_send", new_callable=mock.AsyncMock) as group_send:
+            self.assertEqual(audience.flush(), 2)
+        self.assertEqual(AudienceVote.objects.filter(round__number=1).count(), 2)
+        self.assertEqual(group_send.call_args.args[1]["payload"]["kind"], "audience_tally")
+        self.assertEqual(audience.flush(), 0)
+
+    def test_close_voting_stores_result(self, _flusher):
+        for n in range(3):
+            audience.cast_vote(self.event.slug, f"phone-{n}", self.team_a)
+        audience.cast_vote(self.event.slug, "phone-b", self.team_b)
+
+        with CaptureQueriesContext(connection) as ctx:
+            game_flow.close_voting(self._event())
+        self.assertTrue(any("debattle_audiencevote" in q["sql"] for q in ctx.captured_queries))
+
+        rnd = Round.objects.get(match=self._event().current_match, number=1)
+        self.assertEqual((rnd.audience_a, rnd.audience_b), (3, 1))
+        self.assertEqual(AudienceVote.objects.filter(round=rnd).count(), 4)
+        self.assertEqual(rebuild_state(self.event.id)["audience"], screen_state(self._event(), rnd=rnd)["audience"])
+
+        with self.assertRaises(ValueError):
+            audience.cast_vote(self.event.slug, "phone-late", self.team_a)
+
+    def test_ballot_reloads_after_restart(self, _flusher):
+        audience.cast_vote(self.event.slug, "phone-1", self.team_a)
+        audience.flush()
+        audience._ballots.clear()
+
+        self.assertFalse(audience.cast_vote(self.event.slug, "phone-1", self.team_b))
+        self.assertTrue(audience.cast_vote(self.event.slug, "phone-2", self.team_b))
+        self.assertEqual(audience.live_tally(self.event.slug)["total"], 2)
+
+    def test_vote_view_without_queries(self, _flusher):
+        url = reverse("debattle_audience_vote", kwargs={"slug": self.event.slug})
+        page_url = reverse("debattle_audience", kwargs={"slug": self.event.slug})
+
+        # Без cookie страницы голосования голос не принимается и новый id не выдаётся
+        response = self.client.post(url, {"team_id": self.team_a})
+        self.assertEqual(response.status_code, 403)
+        self.assertNotIn("debattle_voter", response.cookies)
+        self.client.cookies["debattle_voter"] = "forged"
+        self.assertEqual(self.client.post(url, {"team_id": self.team_a}).status_code, 403)
+        del self.client.cookies["debattle_voter"]
+
+        page = self.client.get(page_url)
+        self.assertEqual(page.status_code, 200)
+        voter = page.cookies["debattle_voter"].value
+        # Повторный заход на страницу id не меняет
+        self.assertNotIn("debattle_voter", self.client.get(page_url).cookies)
+
+        with self.assertNumQueries(0):
+            response = self.client.post(url, {"team_id": self.team_a})
+        self.assertEqual(response.json()["accepted"], True)
+
+        # Тот же телефон второй раз не учитывается
+        response = self.client.post(url, {"team_id": self.team_b})
+        self.assertEqual(response.json()["accepted"], False)
+        self.assertEqual(self.client.post(url, {"team_id": "x"}).status_code, 400)
+        self.assertEqual(self.client.cookies["debattle_voter"].value, voter)
+
+        game_flow.close_voting(self._event())
+        self.assertEqual(self.client.post(url, {"team_id": self.team_a}).status_code, 409)
+
+    def test_close_counts_votes_from_database(self, _flusher):
+        audience.cast_vote(self.event.slug, "phone-1", self.team_a)
+        rnd = Round.objects.get(match=self._event().current_match, number=1)
+        # Голоса, принятые другим процессом: в БД они есть, в бюллетене этого процесса — нет
+        AudienceVote.objects.bulk_create([
+            AudienceVote(round=rnd, voter="other-1", team_id=self.team_b),
+            AudienceVote(round=rnd, voter="other-2", team_id=self.team_b),
+        ])
+        # Пачка, которую сборщик как раз пишет своей транзакцией
+        audience._writing.append(AudienceVote(round=rnd, voter="in-flight", team_id=self.team_a))
+        self.addCleanup(audience._writing.clear)
+
+        game_flow.close_voting(self._event())
+        rnd.refresh_from_db()
+        self.assertEqual((rnd.audience_a, rnd.audience_b), (2, 2))
+        self.assertEqual(AudienceVote.objects.filter(round=rnd).count(), 4)
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        fragment_cache().clear()
+        self.event = make_event("deb-async", 1)
+        self.wait_url = reverse("debattle_state_wait", kwargs={"slug": self.event.slug})
+
+    def test_screen_page_cached_per_version(self):
+        url = reverse("debattle_screen", kwargs={"slug": self.event.slug})
+        self.assertEqual(self.client.get(url).status_code, 200)
+        # Повтор той же версии — готовая страница из кэша, в БД только сверка версии
+        with self.assertNumQueries(1):
+            cached = self.client.get(url)
+        self.assertContains(cached, "screen-state-data")
+
+        game_flow.start_roulette(DebattleEvent.objects.get(pk=self.event.pk))
+        match = DebattleEvent.objects.get(pk=self.event.pk).current_match
+        self.assertContains(self.client.get(url), match.team_a.name)
+        self.assertEqual(self.client.get(reverse("debattle_screen", kwargs={"slug": "nope"})).status_code, 404)
+
+    def test_wait_returns_at_once_when_behind(self):
+        version = self.event.state_version
+        response = self.client.get(self.wait_url, {"after": version - 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()["version"], response["ETag"]), (version, f'"{version}"'))
+        self.assertEqual(self.client.get(self.wait_url).status_code, 400)
+
+    def test_wait_times_out_without_transition(self):
+        with mock.patch("debattle.views.WAIT_TIMEOUT", 0.05):
+            response = self.client.get(self.wait_url, {"after": self.event.state_version})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], f'"{self.event.state_version}"')
+
+    def test_wait_caches_only_matching_snapshot(self):
+        # Версию узнали из рассылки, а снимок собран с другой: под её ключ он не кладётся
+        version = self.event.state_version
+        with mock.patch("debattle.views.wait_for_version", mock.AsyncMock(return_value=version + 5)):
+            response = self.client.get(self.wait_url, {"after": version})
+        self.assertEqual(response.json()["version"], version)
+        self.assertIsNone(fragment_cache().get(state_cache_key("snapshot", self.event.slug, version + 5)))
+
+        with mock.patch("debattle.views.wait_for_version", mock.AsyncMock(return_value=version)):
+            self.client.get(self.wait_url, {"after": version - 1})
+        self.assertEqual(fragment_cache().get(state_cache_key("snapshot", self.event.slug, version))["version"], version)
+
+    def test_wait_snapshot_read_from_primary(self):
+        version = self.event.state_version
+        reads = []
+
+        def stamp(slug):
+            reads.append(ReplicaRouter().db_for_read(DebattleEvent))
+            return event_version(slug)
+
+        with mock.patch.dict(settings.DATABASES, {"replica": settings.DATABASES["default"]}), \
+                mock.patch("debattle.views.wait_for_version", mock.AsyncMock(return_value=version)), \
+                mock.patch("debattle.views.event_version", side_effect=stamp):
+            self.assertEqual(self.client.get(self.wait_url, {"after": version - 1}).status_code, 200)
+        self.assertEqual(reads, [None])
+
+    def test_wait_wakes_on_transition(self):
+        version = self.event.state_version
+
+        async def scenario():
+            waiter = asyncio.ensure_future(wait_for_version(self.event.slug, version, 5))
+            await asyncio.sleep(0.05)
+            layer = get_channel_layer()
+            # Счёт зрителей версию не двигает — ожидание продолжается
+            await layer.group_send(event_group_name(self.event.slug), {
+                "type": "state.delta", "payload": {"kind": "audience_tally", "total": 1},
+            })
+            await asyncio.sleep(0.05)
+            self.assertFalse(waiter.done())
+            await layer.group_send(event_group_name(self.event.slug), {
+                "type": "state.delta", "payload": {"kind": "round", "version": version + 1},
+            })
+            return await asyncio.wait_for(waiter, 1)
+
+        self.assertEqual(async_to_sync(scenario)(), version + 1)
@@ -0,0 +1,146 @@
+import re
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .bench import percentile
+from .models import DeliveryAck, EventLogEntry
+
+# Сквозная задержка «кнопка на пульте → экран показал». Каждая смена состояния получает
+# trace: id и серверное время начала (приём команды пульта очередью, иначе — сама смена).
+# Экран, применив дельту, шлёт по своему WebSocket подтверждение с тем же trace, а сервер
+# считает задержку по своим же часам: расхождение часов экрана не влияет, обратный путь
+# подтверждения входит в замер (оценка сверху). Начало перехода берётся только на сервере
+# (кэш trace, иначе журнал) — время из подтверждения экрана не используется
+
+# Подтверждения старше этого не принимаем: экран вернулся из спячки с очередью старых дельт
+MAX_ACK_AGE_MS = 10 * 60 * 1000
+TRACE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+SLOWEST_CLIENTS = 5
+TRACE_CACHE_PREFIX = "debattle:trace:"
+
+_started_ms = ContextVar("debattle_transition_started_ms", default=None)
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+@contextmanager
+def transition_started(ts_ms: int):
+    # Время нажатия на пульте для перехода, выполняемого в потоке очереди команд
+    token = _started_ms.set(ts_ms)
+    try:
+        yield
+    finally:
+        _started_ms.reset(token)
+
+
+def new_trace() -> dict:
+    return {"id": uuid.uuid4().hex, "ts": _started_ms.get() or now_ms()}
+
+
+def remember_trace(event_id: int, kind: str, version: int, trace: dict) -> None:
+    # Начало перехода для подтверждений экранов; после коммита, как и рассылка дельты
+    start = {"event_id": event_id, "ts": trace["ts"], "kind": kind, "version": version}
+    transaction.on_commit(
+        lambda: cache.set(TRACE_CACHE_PREFIX + trace["id"], start, MAX_ACK_AGE_MS // 1000)
+    )
+
+
+def _trace_start(event_id: int, trace_id: str) -> dict | None:
+    start = cache.get(TRACE_CACHE_PREFIX + trace_id)
+    if start is None:
+        # Переход сделан другим процессом или вытеснен из кэша — ищем его в журнале.
+        # Неизвестный trace тоже запоминаем (пустым), чтобы мусор не ходил в БД повторно
+        entry = (
+            EventLogEntry.objects
+            .filter(
+                event_id=event_id,
+                data__trace__id=trace_id,
+                created_at__gte=timezone.now() - timedelta(milliseconds=MAX_ACK_AGE_MS),
+            )
+            .values_list("kind", "version", "data")
+            .first()
+        )
+        start = {}
+        if entry is not None:
+            kind, version, data = entry
+            start = {"event_id": event_id, "ts": data["trace"]["ts"], "kind": kind, "version": version}
+        cache.set(TRACE_CACHE_PREFIX + trace_id, start, MAX_ACK_AGE_MS // 1000)
+    return start if start.get("event_id") == event_id else None
+
+
+def ack_trace_id(content: dict) -> str | None:
+    trace = content.get("trace")
+    trace_id = trace.get("id") if isinstance(trace, dict) else None
+    return trace_id if isinstance(trace_id, str) and TRACE_ID_RE.match(trace_id) else None
+
+
+def record_ack(event_id: int, content: dict) -> bool:
+    # content — сообщение экрана: {"type": "ack", "trace": {"id"}, "client"}. Неизвестный
+    # trace отбрасывается; начало, вид и версия перехода — серверные. Повторное подтверждение
+    # того же экрана по тому же trace не пишется
+    trace_id = ack_trace_id(content)
+    start = _trace_start(event_id, trace_id) if trace_id else None
+    if start is None:
+        return False
+
+    latency = now_ms() - start["ts"]
+    if not 0 <= latency <= MAX_ACK_AGE_MS:
+        return False
+
+    DeliveryAck.objects.bulk_create(
+        [DeliveryAck(
+            event_id=event_id,
+            trace_id=trace_id,
+            kind=start["kind"],
+            version=start["version"],
+            client=str(content.get("client") or "unknown")[:64],
+            latency_ms=latency,
+        )],
+        ignore_conflicts=True,
+    )
+    return True
+
+
+def _stats(values: list[int]) -> dict:
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p99": percentile(values, 99),
+        "max": values[-1] if values else 0,
+    }
+
+
+def latency_summary(event_id: int) -> dict:
+    # acks — все подтверждения; propagation — по переходу до последнего подтвердившего экрана
+    rows = DeliveryAck.objects.filter(event_id=event_id).values_list("trace_id", "kind", "client", "latency_ms")
+
+    by_trace = defaultdict(int)
+    by_client = defaultdict(list)
+    by_kind = defaultdict(list)
+    latencies = []
+    for trace_id, kind, client, latency in rows.iterator():
+        latencies.append(latency)
+        by_trace[trace_id] = max(by_trace[trace_id], latency)
+        by_client[client].append(latency)
+        by_kind[kind].append(latency)
+
+    clients = [{"client": client, **_stats(values)} for client, values in by_client.items()]
+    clients.sort(key=lambda row: (-row["p99"], row["client"]))
+    return {
+        "acks": _stats(latencies),
+        "propagation": _stats(list(by_trace.values())),
+        "screens": len(by_client),
+        "slowest_clients": clients[:SLOWEST_CLIENTS],
+        "by_kind": {kind: _stats(values) for kind, values in sorted(by_kind.items())},
+    }
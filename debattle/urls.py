@@ -5,6 +5,15 @@ urlpatterns = [
     path("", views.index_view, name="index"),
 
     path("debattle/<slug:slug>/screen/", views.screen_view, name="debattle_screen"),
+    path("debattle/<slug:slug>/state.json", views.state_json_view, name="debattle_state_json"),
+    path("debattle/<slug:slug>/state/wait/", views.state_wait_view, name="debattle_state_wait"),
+    path("debattle/<slug:slug>/standings.json", views.standings_json_view, name="debattle_standings_json"),
     path("debattle/<slug:slug>/control/", views.control_view, name="debattle_control"),
+    path("debattle/<slug:slug>/export/", views.export_view, name="debattle_export"),
+    path("debattle/<slug:slug>/latency.json", views.latency_json_view, name="debattle_latency_json"),
     path("debattle/<slug:slug>/register/", views.register_team_view, name="debattle_register"),
+    path("debattle/<slug:slug>/vote/", views.audience_view, name="debattle_audience"),
+    path("debattle/<slug:slug>/vote/cast/", views.audience_vote_view, name="debattle_audience_vote"),
+    path("debattle/photos/<str:name>", views.photo_rendition_view, name="debattle_photo"),
+    path("metrics", views.metrics_view, name="metrics"),
 ]
\ No newline at end of file
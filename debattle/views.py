@@ -1,51 +1,208 @@
-from django.shortcuts import render, get_object_or_404
-from .models import DebattleEvent, Round
+import asyncio
+
+from django.shortcuts import render
+from django.template.loader import render_to_string
+from .models import Round
 
 from django.shortcuts import redirect
+from django.db import transaction
+from django.db.models import Count
 from django.forms import modelformset_factory
 
 from .forms import TeamCreateForm, ParticipantForm
 from .models import Participant
 from .services import add_team_to_tour
-from accounts.models import Score
-from accounts.services import compute_match_results
+from .command_queue import submit_command
+from .realtime import screen_state, wait_for_version
+from .read_models import build_screen_read_model
+from .fragments import fragment_cache, state_cache_key
+from .db_router import replica_reads, replica_reads_view
+from .photos import RENDITION_DIR, schedule_renditions
+from .event_context import aevent_version, event_version, get_event_context
+from .export import batched, export_lines
+from .metrics import render_metrics
+from .audience import cast_vote, live_tally
+from .tracing import latency_summary
+from .standings import standings_payload
 
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_http_methods
 from django.contrib import messages
 
-from .game_flow import reveal_themes, set_current_tour, start_roulette, start_next_round, open_voting, close_voting
-from accounts.models import JuryMember, JuryMatchSubmission
-
-from django.http import HttpResponse
-
-def screen_view(request, slug: str):
-    event = get_object_or_404(DebattleEvent, slug=slug)
-    tours = event.tours.prefetch_related("teams").all()
-
-    match = event.current_match
-    rnd = None
-    results = None
-    criteria = list(event.criteria.all().order_by("id"))
-
-    if match and event.current_round_number:
-        rnd = Round.objects.filter(match=match, number=event.current_round_number).first()
+from accounts.models import JuryMatchSubmission
+
+from django.core.files.storage import default_storage
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, JsonResponse, Http404, StreamingHttpResponse
+from django.utils.functional import SimpleLazyObject
+from django.utils.crypto import constant_time_compare, get_random_string
+from django.views.decorators.http import require_POST
+from django.utils.http import parse_etags, quote_etag
+from django.conf import settings
+
+def _snapshot(data: dict) -> dict:
+    event = data["event"]
+    return {
+        "event": {"slug": event.slug, "title": event.title},
+        **screen_state(
+            event,
+            match=data["match"],
+            rnd=data["round"],
+            results=data["results"],
+            criteria=data["criteria"],
+            standings=data["standings"],
+        ),
+    }
+
+
+def _cached_snapshot(slug: str, version: int, read_model) -> dict:
+    # read_model — ленивый: собирается только при промахе кэша
+    return fragment_cache().get_or_set(
+        state_cache_key("snapshot", slug, version), lambda: _snapshot(read_model)
+    )
 
-    if match and event.state == DebattleEvent.State.RESULTS:
-        results = compute_match_results(match)
 
-    return render(
-        request,
+def _render_screen(request, slug: str, stamp: tuple) -> str:
+    context = get_event_context(slug, stamp)
+    event = context["event"]
+    screen = SimpleLazyObject(lambda: build_screen_read_model(context))
+    return render_to_string(
         "debattle/screen.html",
         {
             "event": event,
-            "tours": tours,
-            "match": match,
-            "round": rnd,
-            "results": results,
-            "criteria": criteria,
+            "screen": screen,
+            "screen_state": _cached_snapshot(slug, event.state_version, screen),
         },
+        request,
+    )
+
+
+@replica_reads_view
+async def screen_view(request, slug: str):
+    # Между переходами страница одинакова для всех экранов: готовый HTML лежит в кэше по
+    # (slug, state_version), и запрос обходится сверкой версии без занятого потока.
+    # При промахе страница рендерится синхронно (фрагменты, ленивый read model) в потоке
+    stamp = await aevent_version(slug)
+    if stamp is None:
+        raise Http404
+
+    key = state_cache_key("screen_page", slug, stamp[-1])
+    page = await fragment_cache().aget(key)
+    if page is None:
+        page = await sync_to_async(_render_screen)(request, slug, stamp)
+        await fragment_cache().aset(key, page)
+    return HttpResponse(page)
+
+
+def _state_response(snapshot: dict) -> JsonResponse:
+    response = JsonResponse(snapshot)
+    # ETag берём из самого снимка: версия могла вырасти между двумя запросами
+    response["ETag"] = quote_etag(str(snapshot["version"]))
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+def _not_modified(version: int) -> HttpResponseNotModified:
+    response = HttpResponseNotModified()
+    response["ETag"] = quote_etag(str(version))
+    return response
+
+
+@replica_reads_view
+def state_json_view(request, slug: str):
+    # Дешёвая проверка версии: при совпадении ETag больше в БД не ходим
+    stamp = event_version(slug)
+    if stamp is None:
+        raise Http404
+    version = stamp[-1]
+
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        if "*" in etags or quote_etag(str(version)) in etags:
+            return _not_modified(version)
+
+    snapshot = _cached_snapshot(
+        slug, version, SimpleLazyObject(lambda: build_screen_read_model(get_event_context(slug, stamp)))
     )
+    return _state_response(snapshot)
+
+
+# Длинный опрос версии для экранов без WebSocket; меньше типичного таймаута прокси (30–60 с)
+WAIT_TIMEOUT = 25
+# Снимок новой версии собирает один ожидающий, остальные разбуженные берут его из кэша
+_snapshot_locks = {}
+
+
+def _primary_snapshot(slug: str) -> dict:
+    # Снимок по основной БД: версию ожидающий мог узнать из рассылки раньше, чем коммит
+    # дошёл до реплики, и снимок с реплики оказался бы старее этой версии
+    stamp = event_version(slug)
+    if stamp is None:
+        raise Http404
+    return _snapshot(build_screen_read_model(get_event_context(slug, stamp)))
+
+
+async def wait_state(slug: str, after: int) -> tuple[int, dict | None]:
+    # (версия, снимок) как только версия станет больше after; по таймауту — (версия, None).
+    # Общая часть state_wait_view и StateWaitConsumer (под ASGI-сервером запрос идёт в него).
+    # Ждём по реплике, снимок новой версии — с основной БД
+    with replica_reads():
+        version = await wait_for_version(slug, after, WAIT_TIMEOUT)
+    if version is None:
+        raise Http404
+    if version <= after:
+        return version, None
+
+    key = state_cache_key("snapshot", slug, version)
+    snapshot = await fragment_cache().aget(key)
+    if snapshot is not None:
+        return version, snapshot
+    async with _snapshot_locks.setdefault(slug, asyncio.Lock()):
+        snapshot = await fragment_cache().aget(key)
+        if snapshot is None:
+            snapshot = await sync_to_async(_primary_snapshot)(slug)
+            # Пока собирали, мог пройти ещё переход — под ключом лежит только снимок этой версии
+            if snapshot["version"] == version:
+                await fragment_cache().aset(key, snapshot)
+    return snapshot["version"], snapshot
+
+
+async def state_wait_view(request, slug: str):
+    # ?after=N — снимок, как у state.json, как только версия станет больше N, либо 304
+    # по истечении WAIT_TIMEOUT. Пока ждём, запрос — корутина, а не занятый поток
+    try:
+        after = int(request.GET["after"])
+    except (KeyError, ValueError):
+        return JsonResponse({"error": "Некорректные данные."}, status=400)
+
+    version, snapshot = await wait_state(slug, after)
+    if snapshot is None:
+        return _not_modified(version)
+    return _state_response(snapshot)
+
+
+@replica_reads_view
+def standings_json_view(request, slug: str):
+    # Полная таблица; меняется только вместе с версией состояния (подведение матча)
+    stamp = event_version(slug)
+    if stamp is None:
+        raise Http404
+    event_id, version = stamp[0], stamp[-1]
+
+    etag = quote_etag(str(version))
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match and etag in parse_etags(if_none_match):
+        response = HttpResponseNotModified()
+    else:
+        standings = fragment_cache().get_or_set(
+            state_cache_key("standings", slug, version), lambda: standings_payload(event_id)
+        )
+        response = JsonResponse({"version": version, "standings": standings})
+    response["ETag"] = etag
+    response["Cache-Control"] = "no-cache"
+    return response
 
 
 @login_required
@@ -54,36 +211,56 @@ def control_view(request, slug: str):
     if not request.user.is_staff:
         return HttpResponse("Доступ запрещён", status=403)
 
-    event = get_object_or_404(DebattleEvent, slug=slug)
-    tours = event.tours.prefetch_related("teams").all()
+    context = get_event_context(slug)
+    event = context["event"]
+    tours = event.tours.annotate(teams_count=Count("teams"))
 
     if request.method == "POST":
         action = request.POST.get("action", "")
 
         try:
+            # Переходы идут через очередь мероприятия; версия пульта с формы отсекает устаревшие
+            # команды (второе нажатие, второй оператор с той же страницей)
+            expected_version = request.POST.get("control_version")
+            expected_version = int(expected_version) if expected_version else None
+
             if action == "reveal_themes":
-                reveal_themes(event)
+                submit_command(event.id, action, expected_version)
                 messages.success(request, "Темы раскрыты.")
 
             elif action == "set_tour":
                 tour_id = int(request.POST["tour_id"])
-                set_current_tour(event, tour_id)
+                submit_command(event.id, action, expected_version, tour_id=tour_id)
                 messages.success(request, "Текущий тур выбран.")
 
+            elif action == "generate_schedule":
+                created = submit_command(event.id, action, expected_version)
+                messages.success(request, f"Расписание: запланировано матчей — {created}.")
+
             elif action == "start_roulette":
-                m = start_roulette(event)
+                m = submit_command(event.id, action, expected_version)
                 messages.success(request, f"Рулетка: выбрана пара {m.team_a.name} vs {m.team_b.name}.")
 
             elif action == "start_round":
-                rnd = start_next_round(event)
+                duration = request.POST.get("duration")
+                duration = int(duration) if duration else None
+                rnd = submit_command(event.id, action, expected_version, duration=duration)
                 messages.success(request, f"Запущен раунд {rnd.number}.")
 
+            elif action == "start_timer":
+                submit_command(event.id, action, expected_version)
+                messages.success(request, "Таймер продолжен.")
+
+            elif action == "stop_timer":
+                submit_command(event.id, action, expected_version)
+                messages.success(request, "Таймер остановлен.")
+
             elif action == "open_voting":
-                open_voting(event)
+                submit_command(event.id, action, expected_version)
                 messages.success(request, "Голосование открыто.")
 
             elif action == "close_voting":
-                close_voting(event)
+                submit_command(event.id, action, expected_version)
                 messages.success(request, "Голосование закрыто. Показ результатов.")
 
             else:
@@ -94,31 +271,38 @@ def control_view(request, slug: str):
 
         return redirect("debattle_control", slug=slug)
 
-    jury_total = JuryMember.objects.filter(event=event, is_active=True).count()
-
-    submitted = 0
+    # Прогресс жюри: одна выборка строк JuryMatchSubmission текущего матча (счётчики ведёт
+    # upsert_scores), дальше страница обновляется по WebSocket пульта
+    jurors = context["jurors"]
+    expected_per_jury = 2 * len(context["criteria"])  # две команды × все критерии мероприятия
+    progress = {}
     if event.current_match_id:
-        submitted = JuryMatchSubmission.objects.filter(match=event.current_match, is_submitted=True).count()
-
-    scores_count = 0
-    expected_scores = 0
-
-    if event.current_match_id:
-        match = event.current_match
-        rounds_count = match.rounds.count()
-        # ожидаем: кол-во судей * раунды * 2 команды * 5 критериев
-        expected_scores = jury_total * 2 * 5
-        scores_count = Score.objects.filter(match=event.current_match).count()
-    else:
-        match = None
+        progress = {
+            s.jury_id: s for s in JuryMatchSubmission.objects.filter(match_id=event.current_match_id)
+        }
 
-    # Получаем текущий раунд и все раунды матча
-    current_round = None
-    all_rounds = []
-    if match:
-        if event.current_round_number:
-            current_round = Round.objects.filter(match=match, number=event.current_round_number).first()
-        all_rounds = Round.objects.filter(match=match).order_by("number")
+    jury_progress = [
+        {
+            "id": j.id,
+            "name": str(j),
+            "scores": progress[j.id].scores_count if j.id in progress else 0,
+            "submitted": progress[j.id].is_submitted if j.id in progress else False,
+        }
+        for j in jurors
+    ]
+    jury_total = len(jurors)
+    submitted = sum(p["submitted"] for p in jury_progress)
+    scores_count = sum(p["scores"] for p in jury_progress)
+    expected_scores = jury_total * expected_per_jury if event.current_match_id else 0
+
+    # Матч с командами уже в контексте мероприятия; раунды нужны только блоку статусов,
+    # он кэшируется по версии, поэтому грузим их лениво
+    match = event.current_match
+    current_round = SimpleLazyObject(
+        lambda: Round.objects.filter(match_id=event.current_match_id, number=event.current_round_number).first()
+        if event.current_match_id and event.current_round_number else None
+    )
+    all_rounds = Round.objects.filter(match_id=event.current_match_id).order_by("number")
 
     return render(
         request,
@@ -130,6 +314,8 @@ def control_view(request, slug: str):
             "submitted": submitted,
             "scores_count": scores_count,
             "expected_scores": expected_scores,
+            "expected_per_jury": expected_per_jury,
+            "jury_progress": jury_progress,
             "match": match,
             "current_round": current_round,
             "all_rounds": all_rounds,
@@ -138,7 +324,7 @@ def control_view(request, slug: str):
 
 
 def register_team_view(request, slug: str):
-    event = get_object_or_404(DebattleEvent, slug=slug)
+    event = get_event_context(slug)["event"]
 
     # после старта регистрацию можно закрыть
     # (позже сделаем флагом/состоянием, пока так)
@@ -161,20 +347,27 @@ def register_team_view(request, slug: str):
         if team_form.is_valid() and formset.is_valid():
             team = team_form.save(commit=False)
             team.event = event
-            team.save()
 
             participants = formset.save(commit=False)
             # строго 2 участника
             if len(participants) != 2:
-                team.delete()
                 messages.error(request, "Нужно указать ровно 2 участников.")
                 return redirect("debattle_register", slug=slug)
 
-            for p in participants:
-                p.team = team
-                p.save()
-
-            tour = add_team_to_tour(event, team)
+            with transaction.atomic():
+                team.save()
+                for p in participants:
+                    p.team = team
+                    p.save()
+                # Копии фото для экранов строятся в фоне после коммита
+                schedule_renditions(p.pk for p in participants if p.photo)
+
+            # Падает только само распределение, и его транзакция место в туре не держит
+            try:
+                tour = add_team_to_tour(event, team)
+            except Exception:
+                team.delete()
+                raise
 
             messages.success(request, f"Команда зарегистрирована и добавлена в тур №{tour.number}.")
             return redirect("debattle_register", slug=slug)
@@ -192,4 +385,121 @@ def register_team_view(request, slug: str):
     )
 
 def index_view(request):
-    return render(request, "index.html")
\ No newline at end of file
+    return render(request, "index.html")
+
+
+def photo_rendition_view(request, name: str):
+    # Имя копии содержит хэш содержимого: по одному URL всегда одна и та же картинка,
+    # поэтому браузеры и прокси могут хранить её год и не перепроверять
+    if "/" in name or not name.endswith(".jpg"):
+        raise Http404
+    path = RENDITION_DIR + name
+    if not default_storage.exists(path):
+        raise Http404
+
+    response = FileResponse(default_storage.open(path, "rb"), content_type="image/jpeg")
+    response["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+
+async def _async_chunks(chunks):
+    # Синхронный итератор под ASGI Django сначала собрал бы целиком в список. Отдаём куски
+    # по одному; курсор читается в том же потоке, где работала view (thread_sensitive)
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    while (chunk := await next_chunk(chunks, None)) is not None:
+        yield chunk
+
+
+@login_required
+def export_view(request, slug: str):
+    if not request.user.is_staff:
+        return HttpResponse("Доступ запрещён", status=403)
+
+    event = get_event_context(slug)["event"]
+    fmt = request.GET.get("format", "csv")
+    table = request.GET.get("table", "scores" if fmt == "csv" else "all")
+    submitted_only = request.GET.get("submitted_only") in ("1", "true", "on")
+
+    try:
+        chunks = batched(export_lines(event, table, fmt, submitted_only))
+    except ValueError as e:
+        return HttpResponse(str(e), status=400)
+
+    if isinstance(request, ASGIRequest):
+        chunks = _async_chunks(chunks)
+
+    content_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    response = StreamingHttpResponse(chunks, content_type=f"{content_type}; charset=utf-8")
+    suffix = "-submitted" if submitted_only else ""
+    response["Content-Disposition"] = f'attachment; filename="{slug}-{table}{suffix}.{fmt}"'
+    return response
+
+
+@login_required
+def latency_json_view(request, slug: str):
+    # Задержка «пульт → экраны» по подтверждениям экранов — для блока на пульте
+    if not request.user.is_staff:
+        return JsonResponse({"error": "Доступ запрещён"}, status=403)
+
+    event = get_event_context(slug)["event"]
+    return JsonResponse(latency_summary(event.id))
+
+
+def metrics_view(request):
+    # Метрики процесса для Prometheus: персоналу по сессии, сборщику — по токену.
+    # Без login_required: сборщик с неверным токеном должен получить 403, а не редирект
+    auth = request.headers.get("Authorization", "")
+    token = settings.DEBATTLE_METRICS_TOKEN
+    by_token = bool(token) and constant_time_compare(auth, f"Bearer {token}")
+    if not by_token and not request.user.is_staff:
+        return HttpResponse("Доступ запрещён", status=403)
+
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# Устройство зрителя — случайный id в подписанной cookie: подделать чужой id нельзя,
+# а повторный голос с того же телефона отсекает бюллетень раунда. id выдаёт только страница
+# голосования; голос без действующей cookie не принимается — иначе клиент без cookie
+# (curl в цикле, приватные вкладки) голосовал бы сколько угодно раз
+VOTER_COOKIE = "debattle_voter"
+VOTER_SALT = "debattle.audience"
+VOTER_MAX_AGE = 30 * 24 * 60 * 60
+
+
+def _voter_id(request) -> str | None:
+    return request.get_signed_cookie(VOTER_COOKIE, default=None, salt=VOTER_SALT, max_age=VOTER_MAX_AGE)
+
+
+def audience_view(request, slug: str):
+    # Страница голосования для телефонов зрителей
+    event = get_event_context(slug)["event"]
+    response = render(request, "debattle/audience.html", {
+        "event": event,
+        "match": event.current_match if event.voting_open else None,
+        "tally": live_tally(slug),
+    })
+    if not _voter_id(request):
+        response.set_signed_cookie(
+            VOTER_COOKIE, get_random_string(32), salt=VOTER_SALT, max_age=VOTER_MAX_AGE, httponly=True, samesite="Lax"
+        )
+    return response
+
+
+@require_POST
+def audience_vote_view(request, slug: str):
+    # Горячий путь: ни одного запроса к БД, голос копится в памяти (debattle.audience)
+    voter = _voter_id(request)
+    if not voter:
+        return JsonResponse({"error": "Откройте страницу голосования заново."}, status=403)
+
+    try:
+        team_id = int(request.POST["team_id"])
+    except (KeyError, ValueError):
+        return JsonResponse({"error": "Некорректные данные."}, status=400)
+
+    try:
+        accepted = cast_vote(slug, voter, team_id)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=409)
+
+    return JsonResponse({"accepted": accepted, "tally": live_tally(slug)})